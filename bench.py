@@ -0,0 +1,457 @@
+"""Micro-benchmarks for the protocol, broadcast and collision hot paths.
+
+Runs headless on Linux: client pieces use the SDL dummy drivers, servers
+send to fake sockets. Each benchmark reports the median and best time per
+call over several runs.
+
+    python bench.py                                 # run everything
+    python bench.py -k protocol -k fanout           # only names containing these
+    python bench.py --save-baseline                 # store bench_baseline.json
+    python bench.py --compare                       # flag regressions against it
+    python bench.py --json results.json
+
+--compare exits with status 1 when any benchmark got slower than the
+baseline by more than --threshold, so it can gate CI.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import mapdata
+import protocol
+import rooms
+import snapshot
+import spatial
+try:
+    import numpy as np
+    import projectiles
+except ImportError:
+    np = projectiles = None
+
+BASELINE = 'bench_baseline.json'
+SIZES = (10, 100, 1000)
+
+BENCHMARKS = []  # (name, setup) where setup() returns the callable to time
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def each_size(template, sizes=SIZES):
+    """Register setup(n) once per size, named template.format(n=n)."""
+    def register(setup):
+        for n in sizes:
+            BENCHMARKS.append((template.format(n=n), lambda n=n: setup(n)))
+        return setup
+    return register
+
+
+def measure(fn, min_time, repeat):
+    """Seconds per call: (median, best) over `repeat` runs of at least min_time each."""
+    fn()  # warm up: first-use caches, initial snapshots
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    runs = [elapsed / number]
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - t0) / number)
+    return statistics.median(runs), min(runs), number
+
+
+# -- fixtures ---------------------------------------------------------------
+
+def make_players(n, seed=1):
+    rnd = random.Random(seed)
+    return {pid: {'name': f'Player{pid}', 'x': rnd.uniform(0, mapdata.WIDTH), 'y': rnd.uniform(0, mapdata.HEIGHT),
+                  'color': [rnd.randint(50, 255) for _ in range(3)], 'hp': 100, 'max_hp': 100, 'invuln_until': 0.0}
+            for pid in range(1, n + 1)}
+
+
+def move_some(players, rnd, fraction=0.1):
+    for pid in rnd.sample(list(players), max(1, int(len(players) * fraction))):
+        p = players[pid]
+        p['x'] = min(mapdata.WIDTH, max(0.0, p['x'] + rnd.uniform(-5, 5)))
+        p['y'] = min(mapdata.HEIGHT, max(0.0, p['y'] + rnd.uniform(-5, 5)))
+
+
+def state_msg(n):
+    return {'type': 'state', 'tick': 1234, 't': 61.7, 'players': snapshot.public_view(make_players(n))}
+
+
+def delta_msg(n):
+    view = snapshot.public_view(make_players(n))
+    upd = {pid: {'x': f['x'] + 1, 'y': f['y'] - 1} for pid, f in list(view.items())[:max(1, n // 10)]}
+    return {'type': 'delta', 'seq': 7, 'tick': 1234, 't': 61.7, 'upd': upd}
+
+
+SHOT = {'type': 'shot', 'owner': 3, 'x': 120.0, 'y': 80.0, 'vx': 400.0, 'vy': -250.0,
+        'damage': 10, 'size': 6, 'color': [255, 90, 90], 'sid': 0, 'ref': 17}
+POS = {'type': 'pos', 'x': 312.5, 'y': 140.25}
+
+
+class FakeSocket:
+    """Accepts every byte at once, like a socket with an empty send buffer."""
+
+    def send(self, data):
+        return len(data)
+
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+# -- protocol ---------------------------------------------------------------
+
+for _name, _msg in (('pos', POS), ('shot', SHOT)):
+    @benchmark(f'protocol.json.encode.{_name}')
+    def _(msg=_msg):
+        return lambda: protocol.encode_stream(msg)
+
+    @benchmark(f'protocol.json.decode.{_name}')
+    def _(msg=_msg):
+        data = protocol.dumps(msg)
+        return lambda: protocol.loads(data)
+
+    @benchmark(f'protocol.bin.encode.{_name}')
+    def _(msg=_msg):
+        return lambda: protocol.encode_stream(msg, True)
+
+    @benchmark(f'protocol.bin.decode.{_name}')
+    def _(msg=_msg):
+        data = protocol.encode(msg)
+        return lambda: protocol.decode(data)
+
+
+@benchmark('protocol.parse.shot')
+def _():
+    msg = protocol.loads(protocol.dumps(SHOT))
+    return lambda: protocol.STRUCTS['shot'].parse(msg)
+
+
+@each_size('protocol.json.encode.state[{n}]')
+def _(n):
+    msg = state_msg(n)
+    return lambda: protocol.encode_stream(msg)
+
+
+@each_size('protocol.json.decode.state[{n}]')
+def _(n):
+    data = protocol.dumps(state_msg(n))
+    return lambda: protocol.loads(data)
+
+
+@each_size('protocol.bin.encode.state[{n}]')
+def _(n):
+    msg = state_msg(n)
+    return lambda: protocol.encode_stream(msg, True)
+
+
+@each_size('protocol.bin.decode.state[{n}]')
+def _(n):
+    data = protocol.encode(state_msg(n))
+    return lambda: protocol.decode(data)
+
+
+@each_size('protocol.bin.encode.delta[{n}]')
+def _(n):
+    msg = delta_msg(n)
+    return lambda: protocol.encode(msg)
+
+
+# -- snapshot construction --------------------------------------------------
+
+@each_size('snapshot.public_view[{n}]')
+def _(n):
+    players = make_players(n)
+    return lambda: snapshot.public_view(players)
+
+
+@each_size('snapshot.delta_build[{n}]')
+def _(n):
+    # One client's delta per tick with a tenth of the players moving
+    players = make_players(n)
+    rnd = random.Random(2)
+    tracker = snapshot.DeltaTracker()
+    tracker.build(snapshot.public_view(players))
+
+    def run():
+        move_some(players, rnd)
+        tracker.build(snapshot.public_view(players))
+    return run
+
+
+@each_size('spatial.interest_update[{n}]')
+def _(n):
+    players = make_players(n)
+    rnd = random.Random(3)
+    interest = spatial.InterestManager(200.0, 20.0)
+    interest.update(players)
+
+    def run():
+        move_some(players, rnd)
+        interest.update(players)
+    return run
+
+
+def tcp_server(n, delta):
+    """server.py with one room of n connected players on fake sockets."""
+    import server
+    server.clients.clear()
+    room = rooms.Room('bench', n, server.AOI_RADIUS, server.AOI_HYSTERESIS)
+    for pid, player in make_players(n).items():
+        conn = server.Connection(FakeSocket(), ('127.0.0.1', pid))
+        conn.cid = pid
+        conn.room = room
+        # Every client due every tick, so each call is one full snapshot round
+        conn.rate = snapshot.SnapshotRate(server.TICK_RATE, server.TICK_RATE, server.TICK_RATE)
+        if delta:
+            conn.delta = snapshot.DeltaTracker()
+        server.clients[pid] = conn
+        room.join(pid, conn, player)
+    return server, room
+
+
+for _delta in (False, True):
+    @each_size('server.broadcast_state.' + ('delta' if _delta else 'full') + '[{n}]', sizes=(10, 100, 1000))
+    def _(n, delta=_delta):
+        # One tick: pick due clients, build and encode snapshots, write them out
+        server, room = tcp_server(n, delta)
+        rnd = random.Random(4)
+        conns = list(room.clients.values())
+
+        def run():
+            move_some(room.players, rnd)
+            room.tick += 1
+            server.broadcast_state(room)
+            for conn in conns:
+                server.flush(conn)
+        return run
+
+
+# -- fan-out ----------------------------------------------------------------
+
+@each_size('fanout.tcp.broadcast_line[{n}]')
+def _(n):
+    server, room = tcp_server(n, False)
+    conns = list(room.clients.values())
+
+    def run():
+        server.broadcast_line(SHOT, conns)
+        for conn in conns:
+            server.flush(conn)
+    return run
+
+
+@each_size('fanout.ws.broadcast[{n}]')
+def _(n):
+    try:
+        import server_ws
+    except ImportError:
+        return None
+    room = rooms.Room('bench', n)
+    for pid in range(1, n + 1):
+        client = server_ws.Client(None)
+        client.cid = pid
+        client.room = room
+        room.join(pid, client, {})
+    clients = list(room.clients.values())
+
+    def run():
+        server_ws.broadcast(SHOT, room)
+        for client in clients:
+            # Stand-in for the writer task draining the queue
+            client.queue.clear()
+    return run
+
+
+# -- collision --------------------------------------------------------------
+
+def projectile_world(bullets, targets, seed=5):
+    rnd = random.Random(seed)
+    shots = projectiles.ProjectileSystem(mapdata.WIDTH, mapdata.HEIGHT, mapdata.WALLS,
+                                         target_size=mapdata.PLAYER_SIZE)
+    ids = list(range(1, targets + 1))
+    xs = [rnd.uniform(0, mapdata.WIDTH - 50) for _ in ids]
+    ys = [rnd.uniform(0, mapdata.HEIGHT - 50) for _ in ids]
+
+    def refill():
+        while shots.count < bullets:
+            shots.spawn(rnd.uniform(0, mapdata.WIDTH), rnd.uniform(0, mapdata.HEIGHT),
+                        rnd.uniform(-400, 400), rnd.uniform(-400, 400), 10, owner=rnd.randint(1, max(1, targets)))
+    return shots, refill, ids, xs, ys
+
+
+for _bullets in (10, 100, 1000):
+    for _targets in (10, 100):
+        @benchmark(f'collision.step[bullets={_bullets},players={_targets}]')
+        def _(bullets=_bullets, targets=_targets):
+            if projectiles is None:
+                return None
+            shots, refill, ids, xs, ys = projectile_world(bullets, targets)
+
+            def run():
+                # Keep the density constant as bullets die
+                refill()
+                shots.step(1 / 60, ids, xs, ys)
+            return run
+
+
+# -- client -----------------------------------------------------------------
+
+_client = None
+
+
+def game_client():
+    global _client
+    if _client is None:
+        import game
+        _client = game.GameClient()
+    return _client
+
+
+@each_size('client.handle_server_msg.state[{n}]')
+def _(n):
+    try:
+        g = game_client()
+    except ImportError:
+        return None
+    msg = protocol.loads(protocol.dumps(state_msg(n)))
+
+    def run():
+        g.other_players.clear()
+        g.handle_server_msg(msg)
+    return run
+
+
+@each_size('client.handle_server_msg.delta[{n}]')
+def _(n):
+    try:
+        g = game_client()
+    except ImportError:
+        return None
+    g.other_players.clear()
+    g.handle_server_msg(protocol.loads(protocol.dumps(state_msg(n))))
+    msg = protocol.loads(protocol.dumps(delta_msg(n)))
+    return lambda: g.handle_server_msg(msg)
+
+
+@benchmark('client.send_line+flush_outbox')
+def _():
+    try:
+        g = game_client()
+    except ImportError:
+        return None
+    g.socket = FakeSocket()
+    g.ws_runner = None
+    g._held = None
+    g.connected = True
+    g.batch_interval = 0.0
+
+    def run():
+        g.send_line(POS)
+        g.send_line(SHOT)
+        g.flush_outbox(time.time())
+    return run
+
+
+# -- running and comparing ----------------------------------------------------
+
+def run_benchmarks(patterns, min_time, repeat):
+    results = {}
+    for name, setup in BENCHMARKS:
+        if patterns and not any(p in name for p in patterns):
+            continue
+        fn = setup()
+        if fn is None:
+            print(f'{name:<48} skipped (missing dependency)')
+            continue
+        median, best, number = measure(fn, min_time, repeat)
+        results[name] = {'median_us': round(median * 1e6, 3), 'min_us': round(best * 1e6, 3),
+                         'number': number, 'repeat': repeat}
+        print(f'{name:<48} {median * 1e6:12.2f} us  (best {best * 1e6:.2f}, x{number})', flush=True)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'json_backend': protocol.JSON_BACKEND,
+        'numpy': np.__version__ if np is not None else None,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the change against baseline; returns the names that regressed."""
+    regressed = []
+    print(f'\n{"benchmark":<48} {"baseline":>12} {"now":>12} {"ratio":>7}')
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = r['median_us'] / base['median_us'] if base['median_us'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressed.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = '  faster'
+        print(f'{name:<48} {base["median_us"]:12.2f} {r["median_us"]:12.2f} {ratio:7.2f}{flag}')
+    return regressed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('-k', dest='patterns', action='append', default=[],
+                    help='only run benchmarks whose name contains this (repeatable)')
+    ap.add_argument('--min-time', type=float, default=0.1, help='minimum seconds per run')
+    ap.add_argument('--repeat', type=int, default=5, help='runs per benchmark')
+    ap.add_argument('--json', help='write results to this file')
+    ap.add_argument('--save-baseline', nargs='?', const=BASELINE, metavar='PATH')
+    ap.add_argument('--compare', nargs='?', const=BASELINE, metavar='PATH')
+    ap.add_argument('--threshold', type=float, default=0.2,
+                    help='relative slowdown counted as a regression (0.2 = 20%%)')
+    args = ap.parse_args(argv)
+
+    results = run_benchmarks(args.patterns, args.min_time, args.repeat)
+    report = {'env': environment(), 'results': results}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline['results'], args.threshold)
+        if regressed:
+            print(f'\n{len(regressed)} regression(s) over {args.threshold:.0%}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
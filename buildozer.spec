@@ -5,7 +5,7 @@ package.domain = org.mauricio
 version = 0.1
 source.dir = .
 source.include_exts = py,json
-requirements = python3,pygame,websockets
+requirements = python3,pygame,websockets,numpy
 orientation = landscape
 android.permissions = INTERNET
 bootstrap = sdl2
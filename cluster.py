@@ -0,0 +1,199 @@
+"""Run server_ws.py as several worker processes, each hosting its own rooms.
+
+One asyncio process only ever uses one core. The supervisor here starts
+WORKERS copies of server_ws, and each serves the public PORT (shared
+through SO_REUSEPORT, so the kernel spreads new connections over them)
+plus a private port of its own. Every room lives on the worker that
+rooms.owner() names; a worker that gets a hello for a room it doesn't host
+answers with a 'redirect' to the owner's port, and the client says hello
+there instead.
+
+Workers report their rooms and clients to the supervisor over a
+multiprocessing queue every REPORT_INTERVAL. The supervisor sends each
+worker the rooms hosted by the others, so overflow into name-2, name-3 is
+decided for the whole cluster, along with the health of every worker
+(served on /health), and restarts workers whose process exits. Without
+SO_REUSEPORT only worker 0 takes the public port.
+
+    WORKERS=4 PORT=8000 python cluster.py
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+
+import rooms
+
+HOST = '0.0.0.0'
+PORT = int(os.environ.get('PORT', 8000))
+WORKERS = int(os.environ.get('WORKERS', 0)) or os.cpu_count() or 1
+# Worker i also listens on WORKER_PORT + i; redirects point there
+WORKER_PORT = int(os.environ.get('WORKER_PORT', PORT + 1))
+# Public address of a worker when its port isn't reachable directly (e.g.
+# behind a TLS proxy): a template with {worker} and {port}, such as
+# 'wss://game.example/w{worker}'. Unset, clients keep their host and only
+# switch port.
+WORKER_URL = os.environ.get('WORKER_URL')
+REPORT_INTERVAL = 0.5  # seconds between presence reports
+HEALTH_TIMEOUT = 3.0  # a worker silent for this long is reported unhealthy
+REUSE_PORT = hasattr(socket, 'SO_REUSEPORT')
+
+
+class WorkerLink:
+    """A worker's end of the supervisor channel; server_ws holds it as `worker`."""
+
+    def __init__(self, index, workers, ports, reports, presence, url=None):
+        self.index = index
+        self.workers = workers
+        self.ports = ports  # private port of every worker
+        self.url = url
+        self.interval = REPORT_INTERVAL
+        self.reports = reports  # worker -> supervisor
+        self.presence = presence  # supervisor -> this worker
+        self.remote = {}  # room name -> players, for rooms on the other workers
+        self.health = []  # one status dict per worker, from the supervisor
+
+    def start(self):
+        threading.Thread(target=self._listen, name='presence', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                update = self.presence.get()
+            except (EOFError, OSError):
+                return
+            # Replaced whole, so the event loop never sees a half-applied update
+            self.remote = update['rooms']
+            self.health = update['workers']
+
+    def owns(self, name):
+        return rooms.owner(name, self.workers) == self.index
+
+    def redirect(self, name):
+        i = rooms.owner(name, self.workers)
+        msg = {'type': 'redirect', 'room': name, 'port': self.ports[i]}
+        if self.url:
+            msg['url'] = self.url.format(worker=i, port=self.ports[i])
+        return msg
+
+    def report(self, status):
+        try:
+            self.reports.put_nowait(status)
+        except queue.Full:
+            pass
+
+
+def listen(host, port, reuse_port=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def run_worker(index, workers, host, port, ports, url, reports, presence):
+    """Entry point of a worker process: server_ws on its own and the public port."""
+    import uvicorn
+    import server_ws
+    server_ws.join_cluster(WorkerLink(index, workers, ports, reports, presence, url))
+    sockets = [listen(host, ports[index])]
+    if REUSE_PORT or index == 0:
+        sockets.append(listen(host, port, REUSE_PORT))
+    uvicorn.Server(uvicorn.Config(server_ws.app)).run(sockets=sockets)
+
+
+class Supervisor:
+    def __init__(self, workers=WORKERS, host=HOST, port=PORT, worker_port=WORKER_PORT, url=WORKER_URL):
+        # spawn rather than fork: every worker imports server_ws from scratch
+        self.ctx = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.url = url
+        self.ports = [worker_port + i for i in range(workers)]
+        self.reports = self.ctx.Queue(maxsize=workers * 64)
+        self.presence = [self.ctx.Queue(maxsize=2) for _ in range(workers)]
+        self.procs = [None] * workers
+        self.status = [None] * workers  # last report from each worker
+        self.seen = [0.0] * workers  # when it arrived
+
+    def spawn(self, i):
+        proc = self.ctx.Process(target=run_worker, name=f'worker-{i}', daemon=True,
+                                args=(i, self.workers, self.host, self.port, self.ports, self.url,
+                                      self.reports, self.presence[i]))
+        proc.start()
+        self.procs[i] = proc
+        self.status[i] = None
+        self.seen[i] = time.monotonic()  # startup counts as healthy until the timeout
+
+    def collect(self, timeout):
+        """Take reports from the workers for up to timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                status = self.reports.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            i = status['worker']
+            # Ignore whatever a restarted worker's predecessor left queued
+            if status['pid'] == self.procs[i].pid:
+                self.status[i] = status
+                self.seen[i] = time.monotonic()
+
+    def health(self, now):
+        out = []
+        for i, proc in enumerate(self.procs):
+            rooms_here = (self.status[i] or {}).get('rooms', {})
+            out.append({
+                'worker': i, 'pid': proc.pid, 'port': self.ports[i],
+                'healthy': proc.is_alive() and now - self.seen[i] < HEALTH_TIMEOUT,
+                'clients': (self.status[i] or {}).get('clients', 0),
+                'players': sum(rooms_here.values()), 'rooms': len(rooms_here),
+            })
+        return out
+
+    def publish(self, now):
+        workers = self.health(now)
+        for i, q in enumerate(self.presence):
+            remote = {}
+            for j, status in enumerate(self.status):
+                if j != i and status is not None:
+                    remote.update(status['rooms'])
+            try:
+                q.put_nowait({'rooms': remote, 'workers': workers})
+            except queue.Full:
+                pass  # the worker hasn't caught up; it gets the next one
+
+    def run(self):
+        for i in range(self.workers):
+            self.spawn(i)
+        print(f"Starting {self.workers} workers on {self.host}:{self.port} "
+              f"(worker ports {self.ports[0]}-{self.ports[-1]})")
+        try:
+            while True:
+                self.collect(REPORT_INTERVAL)
+                for i, proc in enumerate(self.procs):
+                    if not proc.is_alive():
+                        # Its rooms are gone; their clients reconnect and start over
+                        print(f"worker {i} exited with {proc.exitcode}; restarting")
+                        self.spawn(i)
+                self.publish(time.monotonic())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for proc in self.procs:
+                proc.terminate()
+            for proc in self.procs:
+                proc.join(5)
+
+
+if __name__ == '__main__':
+    # Stop the workers on SIGTERM too, not only on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    Supervisor().run()
@@ -1,21 +1,39 @@
 import pygame
 import socket
 import threading
-import json
 import math
 import time
 import random
 import asyncio
 import queue
+import collections
+try:
+  import numpy as np
+except ImportError:
+  # Bullets are simulated and drawn in batch through projectiles.py
+  raise SystemExit("The client needs numpy: pip install numpy "
+                   "(Android builds list it in buildozer.spec requirements)")
 try:
   import websockets
 except Exception:
   websockets = None
 
+import interpolation
+import mapdata
+import movement
+import profiler
+import projectiles
+import protocol
+import render
+
 # Configurações do jogo
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 FPS = 60
+# Record a Chrome trace from startup and write it here on exit (e.g. on
+# Android, where there is no F4 key); None to disable
+PROFILE_TRACE = None
+MAX_REDIRECTS = 3  # cluster workers followed to reach our room before giving up
 
 # Cores
 WHITE = (255, 255, 255)
@@ -26,6 +44,7 @@ GRAY = (60, 60, 60)
 LIGHT_GRAY = (200, 200, 200)
 GREEN = (0, 200, 0)
 YELLOW = (240, 200, 0)
+HEALTH_LEVELS = 25  # distinct health bar sprites (every 4%)
 
 class Weapon:
   def __init__(self, name, fire_rate, bullet_speed, damage, color=(255, 80, 80), size=6):
@@ -48,6 +67,9 @@ class Bullet:
     self.life = life
     self.alive = True
     self.owner_id = owner_id
+    # Server projectile id (authoritative shots) and our local tag for it
+    self.sid = None
+    self.ref = None
 
   def update(self, dt, walls):
     if not self.alive:
@@ -68,6 +90,65 @@ class Bullet:
     if self.alive:
       pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), self.size)
 
+class BulletSystem(projectiles.ProjectileSystem):
+  # Bullets packed into preallocated arrays and stepped in batch each
+  # frame. Network threads never touch the arrays: they queue spawns,
+  # server id tags and despawns, which the game loop applies before stepping.
+  FIELDS = projectiles.ProjectileSystem.FIELDS + ('sid', 'ref')
+
+  def __init__(self, walls, capacity=256):
+    super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, walls, capacity=capacity, target_size=50)
+    self.sid = np.zeros(self.capacity, np.int64)
+    self.ref = np.full(self.capacity, -1, np.int32)
+    self.pending = collections.deque()
+
+  def __len__(self):
+    return self.count
+
+  def add(self, b):
+    self.spawn(b.x, b.y, b.vx, b.vy, b.damage, owner=b.owner_id, size=b.size, color=b.color, life=b.life)
+    i = self.count - 1
+    self.sid[i] = b.sid or 0
+    self.ref[i] = -1 if b.ref is None else b.ref
+
+  def post(self, op, *args):
+    # Thread-safe: op is 'add', 'tag' (ref, sid) or 'despawn' (sid)
+    self.pending.append((op, args))
+
+  def apply_pending(self):
+    while self.pending:
+      op, args = self.pending.popleft()
+      if op == 'add':
+        self.add(*args)
+      elif op == 'tag':
+        ref, sid, owner = args
+        n = self.count
+        idx = np.flatnonzero((self.ref[:n] == ref) & (self.sid[:n] == 0) & (self.owner[:n] == owner))
+        if len(idx):
+          self.sid[idx[0]] = sid
+      elif op == 'despawn':
+        n = self.count
+        keep = self.sid[:n] != args[0]
+        if not keep.all():
+          self._compact(keep)
+
+  def clear(self):
+    super().clear()
+    self.pending.clear()
+
+  def draw(self, screen, sprites):
+    n = self.count
+    if n == 0:
+      return []
+    sizes = self.size[:n].astype(np.int32)
+    xs = (self.x[:n].astype(np.int32) - sizes).tolist()
+    ys = (self.y[:n].astype(np.int32) - sizes).tolist()
+    # Few distinct looks: fetch one sprite per (color, size), then index
+    c = self.color[:n].astype(np.int64)
+    looks, which = np.unique((c[:, 0] << 40) | (c[:, 1] << 32) | (c[:, 2] << 24) | sizes, return_inverse=True)
+    surfs = [sprites.disc((k >> 40 & 255, k >> 32 & 255, k >> 24 & 255), k & 0xFFFFFF) for k in looks.tolist()]
+    return screen.blits([(surfs[i], (x, y)) for i, x, y in zip(which.tolist(), xs, ys)])
+
 class Joystick:
   def __init__(self, center, radius=70):
     self.center = center
@@ -103,23 +184,28 @@ class Joystick:
       return 0.0, 0.0, 0.0
     return dx / self.radius, dy / self.radius, mag / self.radius
 
-  def draw(self, screen):
+  def draw_base(self, surface):
+    # Static rings; drawn once into the cached background
     base_color = (230, 230, 230)
+    pygame.draw.circle(surface, base_color, (int(self.center[0]), int(self.center[1])), self.radius, 2)
+    pygame.draw.circle(surface, LIGHT_GRAY, (int(self.center[0]), int(self.center[1])), int(self.radius * 0.6), 1)
+
+  def draw(self, screen):
     knob_color = (60, 160, 250)
-    pygame.draw.circle(screen, base_color, (int(self.center[0]), int(self.center[1])), self.radius, 2)
-    pygame.draw.circle(screen, LIGHT_GRAY, (int(self.center[0]), int(self.center[1])), int(self.radius * 0.6), 1)
-    pygame.draw.circle(screen, knob_color, (int(self.pointer[0]), int(self.pointer[1])), 14)
+    return pygame.draw.circle(screen, knob_color, (int(self.pointer[0]), int(self.pointer[1])), 14)
 
 class Player:
   def __init__(self, x, y, color):
     self.x = x
     self.y = y
     self.color = color
-    self.speed = 5
+    self.speed = movement.SPEED
     self.rect = pygame.Rect(x, y, 50, 50)
     self.max_hp = 100
     self.hp = 100
     self.alive = True
+    # Stamped server positions, drawn slightly in the past (remote players only)
+    self.history = None
   
   def move(self, dx, dy):
     self.x += dx * self.speed
@@ -127,16 +213,18 @@ class Player:
     self.rect.x = int(self.x)
     self.rect.y = int(self.y)
   
-  def draw(self, screen):
-    pygame.draw.rect(screen, self.color, self.rect)
-    # Health bar above player
+  def blit_items(self, sprites):
+    # Body and health bar above it, as (surface, pos) pairs for Surface.blits
+    x, y, w, h = self.rect
     bar_w = 50
     bar_h = 6
     pct = max(0, min(1, self.hp / self.max_hp))
-    bg = pygame.Rect(self.rect.x, self.rect.y - 10, bar_w, bar_h)
-    fg = pygame.Rect(self.rect.x, self.rect.y - 10, int(bar_w * pct), bar_h)
-    pygame.draw.rect(screen, LIGHT_GRAY, bg)
-    pygame.draw.rect(screen, GREEN if pct > 0.5 else YELLOW if pct > 0.25 else RED, fg)
+    # Rounded up so any remaining health still shows a sliver
+    level = math.ceil(pct * HEALTH_LEVELS)
+    pct = level / HEALTH_LEVELS
+    bar = sprites.bar(bar_w, bar_h, bar_w * level // HEALTH_LEVELS,
+                      GREEN if pct > 0.5 else YELLOW if pct > 0.25 else RED, LIGHT_GRAY)
+    return ((sprites.box(self.color, w, h), (x, y)), (bar, (x, y - 10)))
 
   def move_towards(self, tx, ty):
     dx = tx - self.x
@@ -157,9 +245,16 @@ class GameClient:
     self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Jogo Online")
     self.clock = pygame.time.Clock()
+    self.text = render.TextCache()
+    self.sprites = render.SpriteCache()
+    # F3 toggles the profiler HUD, F4 starts/stops a trace capture
+    self.profiler = profiler.FrameProfiler()
+    if PROFILE_TRACE:
+      self.profiler.start_trace()
     
     self.player = Player(100, 100, BLUE)
     self.other_players = {}
+    self.server_clock = interpolation.ServerClock()
     
     self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     self.connected = False
@@ -168,6 +263,19 @@ class GameClient:
     self.net_mode = 'ws'  # set to 'ws' to use WebSocket
     self.ws_url = 'wss://pythonmult.squareweb.app'
     self.ws_runner = None
+    # Wire format: ask for compact binary frames in hello, JSON until the server agrees
+    self.use_binary = True
+    self.binary = False
+    # Room (match) to ask for in hello; None joins the server's default. The
+    # welcome says which room we got, which a full room may overflow into
+    self.room = None
+    self._held = None  # TCP messages queued while waiting for the welcome
+    self._send_lock = threading.Lock()
+    # Outbound batching: messages from the game loop are collected and sent
+    # as one packet per frame, or every batch_interval seconds when set
+    self.batch_interval = 0.0
+    self._outbox = []
+    self._last_flush = 0.0
     
     # Controle por clique (click-to-move)
     self.target_pos = None
@@ -183,6 +291,16 @@ class GameClient:
     # Networking throttle
     self.last_pos_send = 0.0
     self.pos_send_interval = 0.12
+    # Client-side prediction: movement is applied locally at once and sent
+    # as numbered commands; the server's acks are reconciled against the
+    # commands still in flight
+    self.input_seq = 0
+    self.move_dx = 0.0  # stick input summed over frames not yet sent
+    self.move_dy = 0.0
+    self.move_steps = 0
+    self.pending_inputs = collections.deque(maxlen=256)  # (seq, dx, dy) sent, not acked
+    self.pending_ack = None  # newest ack from the network thread
+    self.teleport_seq = 0  # acks up to this seq predate a local respawn
     # Twin-stick joysticks
     self.move_js = Joystick((80, SCREEN_HEIGHT - 80), radius=70)
     self.aim_js = Joystick((SCREEN_WIDTH - 80, SCREEN_HEIGHT - 80), radius=70)
@@ -196,16 +314,14 @@ class GameClient:
     }
     self.active_weapon = self.weapons['Pistol']
     self.last_shot = 0.0
-    self.bullets = []
     # Test walls for cover
-    self.walls = [
-      pygame.Rect(180, 140, 120, 20),
-      pygame.Rect(420, 120, 20, 140),
-      pygame.Rect(580, 260, 140, 20),
-      pygame.Rect(240, 360, 200, 20),
-      pygame.Rect(90, 280, 20, 160),
-      pygame.Rect(640, 420, 120, 20)
-    ]
+    self.walls = [pygame.Rect(*w) for w in mapdata.WALLS]
+    self.bullets = BulletSystem(self.walls)
+    # Broad-phase grid over the walls (shared with the bullet system)
+    self.wall_grid = self.bullets.walls
+    # Server-authoritative shots: the server decides hits, we only draw
+    self.auth_shots = False
+    self.shot_ref = 0
     # Menu controls
     self.menu_index = 0  # 0: Conectar, 1: Offline
     # Predefine botões do menu para evitar erros em eventos antes do desenho
@@ -219,26 +335,64 @@ class GameClient:
     self.btn_back = pygame.Rect(SCREEN_WIDTH//2 - 140, 335, 280, 50)
     # Respawn invulnerability window
     self.invuln_until = 0.0
+    # Static layer (floor, walls, joystick rings) composed once; each frame
+    # only the regions under moving things are restored and pushed
+    self.renderer = render.DirtyRenderer(self.screen, self.build_background())
+    self._overlay = None
   
+  def build_background(self):
+    bg = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    bg.fill(WHITE)
+    for w in self.walls:
+      pygame.draw.rect(bg, GRAY, w)
+    self.move_js.draw_base(bg)
+    self.aim_js.draw_base(bg)
+    return bg
+
+  def hello_msg(self, **extra):
+    msg = {'type': 'hello', 'name': self.name, 'x': self.player.x, 'y': self.player.y, 'delta': True}
+    if self.use_binary:
+      msg['proto'] = protocol.PROTO_BIN
+    if self.room is not None:
+      msg['room'] = self.room
+    msg.update(extra)
+    return msg
+
   def connect_to_server(self, host='pythonmult.squareweb.app', port=12345):
     try:
       self.socket.connect((host, port))
       self.connected = True
+      self.binary = False
+      if self.use_binary:
+        # The server switches its parser right after hello, so hold
+        # everything else until the welcome tells us which format to use.
+        # Set before the receive thread starts, so the welcome can't be
+        # handled (and the hold released) before the hold exists
+        self._held = []
       threading.Thread(target=self.receive_data, daemon=True).start()
-      # Send hello with initial info
-      self.send_line({'type': 'hello', 'name': self.name, 'x': self.player.x, 'y': self.player.y})
+      # Send hello with initial info; it goes out past the hold
+      self.profiler.count_out(0, 1)
+      with self._send_lock:
+        self._send_tcp(self.hello_msg())
       return True
     except:
       return False
 
   class _WSRunner:
-    def __init__(self, url, on_message):
+    def __init__(self, url, on_message, prof):
       self.url = url
       self.on_message = on_message
+      self.profiler = prof
       self.loop = None
       self.send_q = None
       self.stop = False
       self.thread = None
+      self.binary = False
+      # Messages sent before the loop is up (e.g. hello) wait here
+      self.pending = []
+      self.lock = threading.Lock()
+      self.hello = None  # repeated to the worker a cluster redirect points at
+      self.redirect = None
 
     def start(self):
       self.thread = threading.Thread(target=self._run, daemon=True)
@@ -248,27 +402,56 @@ class GameClient:
       asyncio.run(self._run_async())
 
     async def _run_async(self):
-      self.loop = asyncio.get_running_loop()
-      self.send_q = asyncio.Queue()
-      try:
-        async with websockets.connect(self.url, max_size=2**20) as ws:
-          recv_task = asyncio.create_task(self._recv_loop(ws))
-          send_task = asyncio.create_task(self._send_loop(ws))
-          await asyncio.wait([recv_task, send_task], return_when=asyncio.FIRST_COMPLETED)
-      except Exception:
-        pass
+      with self.lock:
+        self.send_q = asyncio.Queue()
+        for obj in self.pending:
+          self.send_q.put_nowait(obj)
+        self.pending = []
+        self.loop = asyncio.get_running_loop()
+      for _ in range(MAX_REDIRECTS + 1):
+        self.redirect = None
+        try:
+          async with websockets.connect(self.url, max_size=2**20) as ws:
+            recv_task = asyncio.create_task(self._recv_loop(ws))
+            send_task = asyncio.create_task(self._send_loop(ws))
+            _, pending = await asyncio.wait([recv_task, send_task], return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+              task.cancel()
+        except Exception:
+          pass
+        redirect = self.redirect
+        if redirect is None or self.stop or self.hello is None:
+          return
+        # The server runs several workers and another one hosts our room:
+        # say hello there, ahead of anything still waiting to be sent. The
+        # queue itself stays, since send() may already have scheduled puts
+        # into it; this runs on the loop, so none land in between
+        self.url = protocol.redirect_url(self.url, redirect)
+        waiting = []
+        while not self.send_q.empty():
+          waiting.append(self.send_q.get_nowait())
+        self.send_q.put_nowait(dict(self.hello, room=redirect.get('room')))
+        for obj in waiting:
+          self.send_q.put_nowait(obj)
 
     async def _recv_loop(self, ws):
       try:
+        prof = self.profiler
         async for line in ws:
+          t0 = time.perf_counter()
+          prof.count_in(len(line))
           try:
-            msg = json.loads(line)
+            msg = protocol.decode_ws(line)
           except Exception:
             continue
+          if msg.get('type') == 'redirect':
+            self.redirect = msg
+            return
           try:
             self.on_message(msg)
           except Exception:
             pass
+          prof.span('net.recv', t0)
       except Exception:
         pass
 
@@ -276,19 +459,26 @@ class GameClient:
       try:
         while not self.stop:
           obj = await self.send_q.get()
+          if obj.get('type') == 'hello':
+            self.hello = obj
           try:
-            await ws.send(json.dumps(obj) + "\n")
+            data = protocol.encode_ws(obj, self.binary and obj.get('type') != 'hello')
+            self.profiler.count_out(len(data))
+            await ws.send(data)
           except Exception:
             pass
       except Exception:
         pass
 
     def send(self, obj):
-      if self.loop and self.send_q:
-        try:
-          self.loop.call_soon_threadsafe(self.send_q.put_nowait, obj)
-        except Exception:
-          pass
+      with self.lock:
+        if not (self.loop and self.send_q):
+          self.pending.append(obj)
+          return
+      try:
+        self.loop.call_soon_threadsafe(self.send_q.put_nowait, obj)
+      except Exception:
+        pass
 
   def connect_to_ws(self, url):
     if websockets is None:
@@ -296,19 +486,37 @@ class GameClient:
       return False
     try:
       # Start WS runner thread
-      self.ws_runner = GameClient._WSRunner(url, self.handle_server_msg)
+      self.ws_runner = GameClient._WSRunner(url, self.handle_server_msg, self.profiler)
       self.ws_runner.start()
       self.connected = True
+      self.binary = False
       # Send hello over WS
-      self.send_line({'type': 'hello', 'name': self.name, 'x': self.player.x, 'y': self.player.y, 'color': self.player.color})
+      self.send_line(self.hello_msg(color=self.player.color), batch=False)
       return True
     except Exception:
       self.connected = False
       return False
 
-  def send_line(self, obj):
+  def send_line(self, obj, batch=True):
     if not self.connected:
       return
+    if batch:
+      # Only the game loop batches, and it is the one that flushes
+      self._outbox.append(obj)
+      return
+    self.profiler.count_out(0, 1)
+    self._send_now(obj)
+
+  def flush_outbox(self, now):
+    if not self._outbox or now - self._last_flush < self.batch_interval:
+      return
+    self._last_flush = now
+    msgs, self._outbox = self._outbox, []
+    self.profiler.count_out(0, len(msgs))
+    if self.connected:
+      self._send_now(msgs[0] if len(msgs) == 1 else {'type': 'batch', 'msgs': msgs})
+
+  def _send_now(self, obj):
     # Route via WS if active
     if self.ws_runner is not None:
       try:
@@ -317,18 +525,30 @@ class GameClient:
         pass
       return
     # Fallback to TCP socket
+    with self._send_lock:
+      if self._held is not None:
+        self._held.append(obj)
+        return
+      self._send_tcp(obj)
+
+  def _send_tcp(self, obj):
     try:
-      line = json.dumps(obj) + "\n"
-      self.socket.sendall(line.encode('utf-8'))
+      data = protocol.encode_stream(obj, self.binary)
+      self.profiler.count_out(len(data))
+      self.socket.sendall(data)
     except:
       self.connected = False
-  
-  def send_player_data(self):
-    if self.connected:
-      self.send_line({'type': 'pos', 'x': self.player.x, 'y': self.player.y})
+
+  def _release_held(self):
+    with self._send_lock:
+      held, self._held = self._held, None
+      for obj in held or ():
+        self._send_tcp(obj)
   
   def send_shot(self, b):
     if self.connected:
+      self.shot_ref = (self.shot_ref + 1) & 0xFFFF
+      b.ref = self.shot_ref
       self.send_line({
         'type': 'shot',
         'owner': self.client_id,
@@ -338,9 +558,39 @@ class GameClient:
         'vy': b.vy,
         'damage': b.damage,
         'size': b.size,
-        'color': list(b.color)
+        'color': list(b.color),
+        'ref': b.ref
       })
   
+  def send_input(self):
+    if not self.move_steps:
+      return
+    if self.connected:
+      self.input_seq += 1
+      self.pending_inputs.append((self.input_seq, self.move_dx, self.move_dy))
+      self.send_line({'type': 'input', 'seq': self.input_seq,
+                      'dx': self.move_dx, 'dy': self.move_dy, 'n': self.move_steps})
+    self.move_dx = self.move_dy = 0.0
+    self.move_steps = 0
+
+  def reconcile(self):
+    ack, self.pending_ack = self.pending_ack, None
+    if ack is None or ack.seq <= self.teleport_seq or ack.x is None:
+      return
+    pending = self.pending_inputs
+    while pending and pending[0][0] <= ack.seq:
+      pending.popleft()
+    # Server position plus everything it hasn't applied yet
+    x, y = ack.x, ack.y
+    for _, dx, dy in pending:
+      x, y = movement.apply(x, y, dx, dy)
+    x, y = movement.apply(x, y, self.move_dx, self.move_dy)
+    if abs(x - self.player.x) > 0.5 or abs(y - self.player.y) > 0.5:
+      self.player.x = x
+      self.player.y = y
+      self.player.rect.x = int(x)
+      self.player.rect.y = int(y)
+
   def send_hit(self, victim_id, damage):
     if self.connected:
       self.send_line({'type': 'hit', 'victim': victim_id, 'damage': damage})
@@ -352,6 +602,9 @@ class GameClient:
     except:
       pass
     self.connected = False
+    self.binary = False
+    self._held = None
+    self._outbox = []
     # Recreate socket for potential reconnection
     try:
       self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -359,74 +612,142 @@ class GameClient:
       pass
   
   def receive_data(self):
-    buf = ""
+    buf = b""
     while self.connected:
       try:
         data = self.socket.recv(4096)
         if not data:
           self.connected = False
           break
-        buf += data.decode('utf-8', errors='ignore')
-        while '\n' in buf:
-          line, buf = buf.split('\n', 1)
+        t0 = time.perf_counter()
+        self.profiler.count_in(len(data))
+        buf += data
+        while buf:
+          if self.binary:
+            frames, buf = protocol.split_frames(buf)
+            for payload in frames:
+              try:
+                msg = protocol.decode(payload)
+              except Exception:
+                continue
+              self.handle_server_msg(msg)
+            break
+          if b'\n' not in buf:
+            break
+          line, buf = buf.split(b'\n', 1)
           if not line.strip():
             continue
           try:
-            msg = json.loads(line)
+            msg = protocol.loads(line)
           except:
             continue
+          # The welcome may switch the rest of the stream to binary frames
           self.handle_server_msg(msg)
+        self.profiler.span('net.recv', t0)
       except:
         self.connected = False
         break
 
+  dispatcher = protocol.Dispatcher()
+
   def handle_server_msg(self, msg):
+    self.profiler.count_in(0, 1)
     try:
-      t = msg.get('type')
-      if t == 'welcome':
-        self.client_id = msg.get('id')
-        try:
-          if self.client_id in self.other_players:
-            del self.other_players[self.client_id]
-        except Exception:
-          pass
-      elif t == 'state':
-        players = msg.get('players', {})
-        self.update_other_players(players)
-      elif t == 'shot':
-        owner = msg.get('owner')
-        bx = float(msg.get('x', 0))
-        by = float(msg.get('y', 0))
-        bvx = float(msg.get('vx', 0))
-        bvy = float(msg.get('vy', 0))
-        dmg = int(msg.get('damage', 10))
-        size = int(msg.get('size', 6))
-        color = tuple(msg.get('color', [255, 90, 90]))
-        if owner is not None and (self.client_id is not None and int(owner) == int(self.client_id)):
-          pass
-        else:
-          self.bullets.append(Bullet(bx, by, bvx, bvy, dmg, color, size=size, owner_id=int(owner)))
-      elif t == 'hp':
-        pid = int(msg.get('id'))
-        hpv = int(msg.get('hp'))
-        if self.client_id is not None and pid == self.client_id:
-          self.player.hp = hpv
-        else:
-          op = self.other_players.get(pid)
-          if op:
-            op.hp = hpv
+      self.dispatcher.dispatch(self, msg)
     except Exception:
       pass
 
-  def update_other_players(self, players):
-    # players: {id: {name, x, y, color}}
-    # Remove missing
-    ids = set(int(k) for k in players.keys())
-    for oid in list(self.other_players.keys()):
-      if oid not in ids:
-        del self.other_players[oid]
+  @dispatcher.on('welcome')
+  def _on_welcome(self, m):
+    self.client_id = m.id
+    self.binary = m.proto == protocol.PROTO_BIN
+    self.auth_shots = m.auth_shots
+    if m.room is not None:
+      self.room = m.room
+    self.server_clock = interpolation.ServerClock()
+    self.pending_inputs.clear()
+    self.teleport_seq = self.input_seq
+    if self.ws_runner is not None:
+      self.ws_runner.binary = self.binary
+    else:
+      self._release_held()
+    self.other_players.pop(self.client_id, None)
+
+  @dispatcher.on('state')
+  def _on_state(self, m):
+    # Full snapshot: anything we know about that is missing has left
+    ids = set(int(k) for k in m.players.keys())
+    left = [oid for oid in self.other_players if oid not in ids]
+    self.update_other_players(m.players, left=left)
+    self._record_snapshot(m.t)
+
+  @dispatcher.on('delta')
+  def _on_delta(self, m):
+    self.update_other_players(m.join, m.upd, m.leave)
+    self._record_snapshot(m.t)
+
+  def _record_snapshot(self, t):
+    if t is None:
+      return
+    self.server_clock.observe(t, time.monotonic())
+    # A snapshot is a sample for everyone we know about: deltas leave out
+    # players that didn't move
+    for p in list(self.other_players.values()):
+      p.history.push(t, p.x, p.y)
+
+  def interpolate_others(self):
+    render_t = self.server_clock.now(time.monotonic()) - self.server_clock.delay()
+    for p in list(self.other_players.values()):
+      pos = p.history.sample(render_t) if p.history is not None else None
+      x, y = pos if pos is not None else (p.x, p.y)
+      p.rect.x = int(x)
+      p.rect.y = int(y)
+
+  @dispatcher.on('shot')
+  def _on_shot(self, m):
+    if m.owner is not None and self.client_id is not None and m.owner == int(self.client_id):
+      # Our own shot echoed back: remember the server id of the local bullet
+      if m.sid is not None:
+        self.bullets.post('tag', m.ref, m.sid, m.owner)
+    else:
+      nb = Bullet(m.x, m.y, m.vx, m.vy, m.damage, m.color, size=m.size, owner_id=m.owner)
+      nb.sid = m.sid
+      self.bullets.post('add', nb)
+
+  @dispatcher.on('ack')
+  def _on_ack(self, m):
+    # Applied by the game loop, which owns the local player
+    self.pending_ack = m
+
+  @dispatcher.on('ping')
+  def _on_ping(self, m):
+    # The server measures our RTT to pick our snapshot rate
+    self.send_line({'type': 'pong', 't': m.t}, batch=False)
+
+  @dispatcher.on('despawn')
+  def _on_despawn(self, m):
+    self.bullets.post('despawn', m.sid)
+
+  @dispatcher.on('hp')
+  def _on_hp(self, m):
+    if self.client_id is not None and m.id == self.client_id:
+      self.player.hp = m.hp
+    else:
+      op = self.other_players.get(m.id)
+      if op:
+        op.hp = m.hp
+
+  def update_other_players(self, joined, changed=None, left=()):
+    # joined: {id: {name, x, y, color, hp, max_hp}} full entries
+    # changed: {id: {field: value}} only the fields that moved since last delta
+    # left: ids that are gone
+    for k in left:
+      try:
+        self.other_players.pop(int(k), None)
+      except Exception:
+        continue
     # Add/update
-    for k, pdata in players.items():
+    for k, pdata in joined.items():
       try:
         pid = int(k)
       except:
@@ -443,23 +764,43 @@ class GameClient:
         pnew = Player(int(px), int(py), color)
         pnew.hp = hpv
         pnew.max_hp = mhp
+        pnew.history = interpolation.History()
         self.other_players[pid] = pnew
       else:
+        # Only the latest server position; interpolate_others moves the rect
         p = self.other_players[pid]
         p.x = px
         p.y = py
-        p.rect.x = int(px)
-        p.rect.y = int(py)
         # Update hp if provided in state
         p.max_hp = mhp
         p.hp = hpv
+    if not changed:
+      return
+    for k, fields in changed.items():
+      try:
+        p = self.other_players.get(int(k))
+      except Exception:
+        continue
+      if p is None:
+        continue
+      if 'x' in fields:
+        p.x = float(fields['x'])
+      if 'y' in fields:
+        p.y = float(fields['y'])
+      if 'hp' in fields:
+        p.hp = int(fields['hp'])
+      if 'max_hp' in fields:
+        p.max_hp = int(fields['max_hp'])
+      if 'color' in fields:
+        p.color = tuple(fields['color'])
 
   def random_spawn(self):
     for _ in range(100):
       x = random.randint(20, SCREEN_WIDTH - 70)
       y = random.randint(20, SCREEN_HEIGHT - 70)
       rect = pygame.Rect(x, y, 50, 50)
-      if not any(rect.colliderect(w) for w in self.walls):
+      nearby = self.wall_grid.query(rect.left, rect.top, rect.right, rect.bottom)
+      if not any(rect.colliderect(self.walls[i]) for i in nearby):
         return x, y
     return 100, 100
 
@@ -472,22 +813,24 @@ class GameClient:
     self.player.y = sy
     self.player.rect.x = int(sx)
     self.player.rect.y = int(sy)
+    # Commands sent before the respawn would be replayed from the old spot
+    self.move_dx = self.move_dy = 0.0
+    self.move_steps = 0
+    self.teleport_seq = self.input_seq
     self.in_death_menu = False
     # Clear existing bullets to avoid instant damage on spawn
-    self.bullets = []
+    self.bullets.clear()
     # 1.5s invulnerability after revive
     self.invuln_until = time.time() + 1.5
     # Clear joysticks
     self.move_js.stop()
     self.aim_js.stop()
-    # Notify server of revive (authoritative hp reset)
+    # Notify server of revive (authoritative hp reset) and the new position
     if self.connected:
       try:
-        self.send_line({'type': 'revive'})
+        self.send_line({'type': 'revive', 'x': sx, 'y': sy})
       except Exception:
         pass
-    # Notify server of new position
-    self.send_player_data()
 
   def create_new_player(self):
     # Randomize color and name
@@ -497,7 +840,7 @@ class GameClient:
     self.player = Player(sx, sy, new_color)
     self.other_players = {}
     # Reset bullets and joysticks
-    self.bullets = []
+    self.bullets.clear()
     self.move_js.stop()
     self.aim_js.stop()
     self.in_death_menu = False
@@ -513,9 +856,13 @@ class GameClient:
     if self.in_death_menu or not self.player.alive:
       return
     # Twin-stick movement and aiming/shooting
+    self.reconcile()
     dx, dy, mag = self.move_js.direction()
     if mag > 0:
       self.player.move(dx, dy)
+      self.move_dx += dx
+      self.move_dy += dy
+      self.move_steps += 1
 
     ax, ay, amag = self.aim_js.direction()
     now = time.time()
@@ -525,15 +872,16 @@ class GameClient:
         if dir_mag > 0:
           vx = (ax / dir_mag) * self.active_weapon.bullet_speed
           vy = (ay / dir_mag) * self.active_weapon.bullet_speed
-          self.bullets.append(Bullet(self.player.x + 25, self.player.y + 25, vx, vy,
-                                     self.active_weapon.damage, self.active_weapon.color, self.active_weapon.size,
-                                     owner_id=self.client_id))
+          b = Bullet(self.player.x + 25, self.player.y + 25, vx, vy,
+                     self.active_weapon.damage, self.active_weapon.color, self.active_weapon.size,
+                     owner_id=self.client_id)
           # Send shot to server for other clients
-          self.send_shot(self.bullets[-1])
+          self.send_shot(b)
+          self.bullets.add(b)
           self.last_shot = now
 
-    if now - self.last_pos_send >= self.pos_send_interval:
-      self.send_player_data()
+    if now - self.last_pos_send >= self.pos_send_interval or self.move_steps >= movement.MAX_STEPS:
+      self.send_input()
       self.last_pos_send = now
 
   def draw_cursor(self, screen):
@@ -542,8 +890,9 @@ class GameClient:
     color = RED
     size = 10
     thickness = 2
-    pygame.draw.line(screen, color, (mx - size, my), (mx + size, my), thickness)
-    pygame.draw.line(screen, color, (mx, my - size), (mx, my + size), thickness)
+    h = pygame.draw.line(screen, color, (mx - size, my), (mx + size, my), thickness)
+    v = pygame.draw.line(screen, color, (mx, my - size), (mx, my + size), thickness)
+    return h.union(v)
 
   def draw_aim_feedback(self, screen):
     if self.aim_js.active:
@@ -556,16 +905,28 @@ class GameClient:
         if dir_mag > 0:
           lx = cx + int((ax / dir_mag) * 140)
           ly = cy + int((ay / dir_mag) * 140)
-          pygame.draw.line(screen, (255, 120, 120), (cx, cy), (lx, ly), 2)
-          pygame.draw.circle(screen, (255, 120, 120), (lx, ly), 5, 1)
+          ray = pygame.draw.line(screen, (255, 120, 120), (cx, cy), (lx, ly), 2)
+          tip = pygame.draw.circle(screen, (255, 120, 120), (lx, ly), 5, 1)
+          return ray.union(tip)
+    return None
   
   def run(self):
     running = True
 
     while running:
+      prof = self.profiler
+      prof.begin_frame()
       for event in pygame.event.get():
         if event.type == pygame.QUIT:
           running = False
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+          prof.enable(not prof.enabled)
+          self.renderer.invalidate()
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+          if prof.tracing:
+            print('Trace salvo em', prof.stop_trace())
+          else:
+            prof.start_trace()
         elif self.in_menu and event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
           mx, my = event.pos
           # Simple buttons
@@ -673,55 +1034,59 @@ class GameClient:
             self.in_menu = True
             pygame.mouse.set_visible(True)
 
+      prof.lap('events')
       if not self.in_menu:
         self.handle_input()
+        prof.lap('input')
 
       # Desenhar tudo
-      self.screen.fill(WHITE)
-
       if self.in_menu:
+        self.screen.fill(WHITE)
         self.draw_menu()
+        # Full repaint, and the game view starts from a clean background again
+        self.renderer.invalidate()
       else:
-        self.player.draw(self.screen)
-        # Desenhar outros jogadores
+        # Paredes e anéis dos joysticks já estão no fundo em cache
+        self.renderer.begin()
+        mark = self.renderer.add
+        # Jogadores (o nosso e os outros) numa única chamada blits
+        self.interpolate_others()
+        items = list(self.player.blit_items(self.sprites))
         for player in self.other_players.values():
-          player.draw(self.screen)
-        # Desenhar paredes
-        for w in self.walls:
-          pygame.draw.rect(self.screen, GRAY, w)
-        # Atualizar e desenhar balas
+          items.extend(player.blit_items(self.sprites))
+        self.renderer.extend(self.screen.blits(items))
+        prof.lap('draw')
+        # Atualizar e desenhar balas (todas de uma vez, em arrays)
         dt = self.clock.get_time() / 1000.0
-        for b in list(self.bullets):
-          b.update(dt, self.walls)
-          # Bullet vs player collisions (local prototype, no server changes)
-          if b.alive:
-            brect = pygame.Rect(int(b.x - b.size/2), int(b.y - b.size/2), b.size, b.size)
-            # Our bullets can damage other players
-            if b.owner_id == self.client_id:
-              for pid, op in list(self.other_players.items()):
-                if brect.colliderect(op.rect):
-                  op.hp = max(0, op.hp - b.damage)
-                  # Report hit to server so all clients sync hp
-                  try:
-                    self.send_hit(pid, b.damage)
-                  except Exception:
-                    pass
-                  b.alive = False
-                  break
-            # Enemy bullets (future sync) can damage us
-            elif b.owner_id is not None and b.owner_id != self.client_id:
-              if brect.colliderect(self.player.rect):
-                # Respect respawn invulnerability
-                if time.time() >= self.invuln_until:
-                  self.player.hp = max(0, self.player.hp - b.damage)
-                b.alive = False
-          if not b.alive:
+        self.bullets.apply_pending()
+        # Only our bullets damage others; everyone else's only matter if they hit us
+        my_id = self.client_id if self.client_id is not None else -1
+        ids = [my_id]
+        xs = [self.player.rect.x]
+        ys = [self.player.rect.y]
+        for pid, op in list(self.other_players.items()):
+          ids.append(pid)
+          xs.append(op.rect.x)
+          ys.append(op.rect.y)
+        _, victims, damage, owners = self.bullets.step(dt, ids, xs, ys, local_id=my_id)
+        # With authoritative shots the server applies damage and sends
+        # hp/despawn; locally the bullet only stops where it hits
+        for victim, dmg, owner in zip(victims.tolist(), damage.tolist(), owners.tolist()):
+          if victim == my_id:
+            # Enemy bullets (offline ones have no owner) can damage us; respect respawn invulnerability
+            if owner != -1 and not self.auth_shots and time.time() >= self.invuln_until:
+              self.player.hp = max(0, self.player.hp - dmg)
+            continue
+          op = self.other_players.get(victim)
+          if op is not None and not self.auth_shots:
+            op.hp = max(0, op.hp - dmg)
+            # Report hit to server so all clients sync hp
             try:
-              self.bullets.remove(b)
-            except ValueError:
+              self.send_hit(victim, dmg)
+            except Exception:
               pass
-          else:
-            b.draw(self.screen)
+        prof.lap('bullets')
+        self.renderer.extend(self.bullets.draw(self.screen, self.sprites))
         # Check death
         if self.player.alive and self.player.hp <= 0:
           self.player.alive = False
@@ -731,29 +1096,38 @@ class GameClient:
           self.aim_js.stop()
         # Desenhar joysticks
         if not self.in_death_menu:
-          self.move_js.draw(self.screen)
-          self.aim_js.draw(self.screen)
+          mark(self.move_js.draw(self.screen))
+          mark(self.aim_js.draw(self.screen))
         # Aim feedback (trajectory)
         if not self.in_death_menu:
-          self.draw_aim_feedback(self.screen)
+          mark(self.draw_aim_feedback(self.screen))
         # Desenhar cursor personalizado
-        self.draw_cursor(self.screen)
+        mark(self.draw_cursor(self.screen))
         # Debug info
-        self.draw_debug()
-        # Death menu overlay
+        mark(self.draw_debug())
+        # Death menu overlay covers the whole window; repaint it all
         if self.in_death_menu:
           self.draw_death_menu()
+          self.renderer.invalidate()
+      if prof.enabled:
+        self.renderer.add(self.draw_profiler())
+      prof.lap('draw')
 
-      pygame.display.flip()
+      self.flush_outbox(time.time())
+      prof.lap('send')
+      self.renderer.present()
+      prof.lap('flip')
       self.clock.tick(FPS)
+      prof.lap('wait')
 
+    if prof.tracing:
+      print('Trace salvo em', prof.stop_trace(PROFILE_TRACE))
     pygame.quit()
     if self.connected:
       self.socket.close()
 
   def draw_menu(self):
-    font = pygame.font.SysFont(None, 36)
-    title = font.render('Fazenda Comunitária', True, BLACK)
+    title = self.text.render('Fazenda Comunitária', BLACK, 36)
     self.screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 100))
     # Buttons
     # Destacar opção selecionada pelo teclado
@@ -767,38 +1141,51 @@ class GameClient:
       pygame.draw.rect(self.screen, border_color, self.btn_connect, 2, border_radius=6)
     else:
       pygame.draw.rect(self.screen, border_color, self.btn_offline, 2, border_radius=6)
-    txt1 = font.render('Conectar', True, BLACK)
-    txt2 = font.render('Offline', True, BLACK)
+    txt1 = self.text.render('Conectar', BLACK, 36)
+    txt2 = self.text.render('Offline', BLACK, 36)
     self.screen.blit(txt1, (self.btn_connect.centerx - txt1.get_width()//2, self.btn_connect.centery - txt1.get_height()//2))
     self.screen.blit(txt2, (self.btn_offline.centerx - txt2.get_width()//2, self.btn_offline.centery - txt2.get_height()//2))
     # Dica de controles
-    hint = font.render('Use ↑/↓ e Enter', True, BLACK)
+    hint = self.text.render('Use ↑/↓ e Enter', BLACK, 36)
     self.screen.blit(hint, (SCREEN_WIDTH//2 - hint.get_width()//2, 360))
     # Status de conexão
     if self.menu_message:
-      msg = font.render(self.menu_message, True, (180, 40, 40))
+      msg = self.text.render(self.menu_message, (180, 40, 40), 36)
       self.screen.blit(msg, (SCREEN_WIDTH//2 - msg.get_width()//2, 410))
 
   def draw_debug(self):
-    font = pygame.font.SysFont(None, 24)
     cid = self.client_id if self.client_id is not None else '-'
     status = "DEAD" if not self.player.alive else "ALIVE"
-    txt = font.render(f"ID: {cid} | {status} | Outros: {len(self.other_players)}", True, BLACK)
-    self.screen.blit(txt, (10, 10))
+    # Same string as last frame -> same cached surface, nothing re-rendered
+    room = f" | Sala: {self.room}" if self.room is not None else ''
+    txt = self.text.render(f"ID: {cid}{room} | {status} | Outros: {len(self.other_players)}", BLACK, 24)
+    return self.screen.blit(txt, (10, 10))
+
+  def draw_profiler(self):
+    # Rolling frame/phase timings and traffic, top right; returns the area drawn
+    lines = self.profiler.hud_lines()
+    area = None
+    y = 10
+    for line in lines:
+      surf = self.text.render(line, BLACK, 18, 'monospace')
+      r = self.screen.blit(surf, (SCREEN_WIDTH - surf.get_width() - 10, y))
+      area = r if area is None else area.union(r)
+      y += surf.get_height()
+    return area
 
   def draw_death_menu(self):
-    # Translucent overlay
-    overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-    overlay.fill((20, 20, 20, 160))
-    self.screen.blit(overlay, (0, 0))
-    font = pygame.font.SysFont(None, 42)
-    title = font.render('Você morreu!', True, (250, 80, 80))
+    # Translucent overlay, built once
+    if self._overlay is None:
+      self._overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+      self._overlay.fill((20, 20, 20, 160))
+    self.screen.blit(self._overlay, (0, 0))
+    title = self.text.render('Você morreu!', (250, 80, 80), 42)
     self.screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 160))
     # Buttons
     pygame.draw.rect(self.screen, (210, 240, 210), self.btn_revive, border_radius=8)
     pygame.draw.rect(self.screen, (240, 210, 210), self.btn_back, border_radius=8)
-    txt1 = font.render('Reviver', True, BLACK)
-    txt3 = font.render('Voltar ao menu', True, BLACK)
+    txt1 = self.text.render('Reviver', BLACK, 42)
+    txt3 = self.text.render('Voltar ao menu', BLACK, 42)
     self.screen.blit(txt1, (self.btn_revive.centerx - txt1.get_width()//2, self.btn_revive.centery - txt1.get_height()//2))
     self.screen.blit(txt3, (self.btn_back.centerx - txt3.get_width()//2, self.btn_back.centery - txt3.get_height()//2))
 
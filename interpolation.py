@@ -0,0 +1,86 @@
+"""Snapshot interpolation for remote entities on the client.
+
+Servers stamp every snapshot with their time. The client keeps a short
+history of stamped positions per remote entity and draws it INTERP_DELAY
+seconds in the past (longer when the server sends this client fewer
+snapshots), between two snapshots it has already received, so motion
+stays smooth at low snapshot rates. If the next snapshot is late
+the entity keeps moving along its last velocity for at most
+MAX_EXTRAPOLATION seconds.
+"""
+import collections
+
+HISTORY = 32  # samples kept per entity
+INTERP_DELAY = 0.1
+MAX_INTERP_DELAY = 0.5
+MAX_EXTRAPOLATION = 0.25
+
+
+class ServerClock:
+    """Estimates the server's clock from snapshot timestamps.
+
+    The offset follows the least-delayed snapshots and drifts slowly
+    toward later ones, so one slow packet doesn't jerk the timeline. It
+    also tracks the spacing of snapshots to size the interpolation delay.
+    """
+
+    def __init__(self, smoothing=0.05, resync=1.0):
+        self.offset = None  # server time - local time
+        self.smoothing = smoothing
+        self.resync = resync
+        self.last_t = None
+        self.interval = 0.0  # smoothed server time between snapshots
+
+    def observe(self, server_t, local_t):
+        if self.last_t is not None and server_t > self.last_t:
+            gap = min(server_t - self.last_t, MAX_INTERP_DELAY)
+            self.interval += (gap - self.interval) * 0.1
+        self.last_t = server_t
+        sample = server_t - local_t
+        if self.offset is None or abs(sample - self.offset) > self.resync or sample > self.offset:
+            self.offset = sample
+        else:
+            self.offset += (sample - self.offset) * self.smoothing
+
+    def now(self, local_t):
+        return local_t + (self.offset or 0.0)
+
+    def delay(self):
+        """How far behind the server clock to render."""
+        return min(MAX_INTERP_DELAY, max(INTERP_DELAY, self.interval * 1.25))
+
+
+class History:
+    """Ring buffer of (server time, x, y) samples for one entity."""
+
+    def __init__(self, size=HISTORY):
+        self.samples = collections.deque(maxlen=size)
+
+    def push(self, t, x, y):
+        s = self.samples
+        if s and t <= s[-1][0]:
+            if t == s[-1][0]:
+                s[-1] = (t, x, y)
+            return
+        s.append((t, x, y))
+
+    def sample(self, t, max_extrapolation=MAX_EXTRAPOLATION):
+        """Position at server time t, or None without any samples."""
+        # The network thread appends concurrently; work on a copy
+        s = list(self.samples)
+        if not s:
+            return None
+        t1, x1, y1 = s[-1]
+        if t >= t1:
+            if len(s) < 2:
+                return x1, y1
+            t0, x0, y0 = s[-2]
+            ahead = min(t - t1, max_extrapolation) / (t1 - t0)
+            return x1 + (x1 - x0) * ahead, y1 + (y1 - y0) * ahead
+        for i in range(len(s) - 2, -1, -1):
+            t0, x0, y0 = s[i]
+            if t0 <= t:
+                f = (t - t0) / (t1 - t0)
+                return x0 + (x1 - x0) * f, y0 + (y1 - y0) * f
+            t1, x1, y1 = t0, x0, y0
+        return x1, y1
@@ -0,0 +1,551 @@
+"""Headless load generator for server.py and server_ws.py.
+
+Runs many simulated players in one asyncio loop. Each bot speaks the real
+protocol (hello, pos or input, shot, hit, revive, ping/pong) with a
+configurable movement pattern and fire rate, and the run reports join
+latency, snapshot inter-arrival jitter, end-to-end shot latency, RTT, the
+server's effective tick rate and its CPU use.
+
+With --steps the player count is raised in stages and every stage is held
+for --hold seconds, giving a capacity curve of players against the tick
+rate the server actually sustains:
+
+    python loadgen.py --spawn --steps 50,100,200,400,800 --hold 10
+    python loadgen.py --transport ws --url ws://127.0.0.1:8000/ws --players 500 --hold 30
+    python loadgen.py --server-pid 1234 --steps 100,200 --json capacity.json
+    python loadgen.py --transport ws --spawn --workers 4 --rooms 16 --players 800
+
+Run it on other cores than the server (or another machine): past a few
+thousand bots the generator itself becomes the bottleneck.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import mapdata
+import movement
+import protocol
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+SHOT_SPEED = 600.0
+SHOT_MEMORY = 3.0  # seconds a sent shot is kept for latency matching
+MAX_REDIRECTS = 3  # cluster redirects a bot follows before giving up on joining
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def ms(v):
+    return None if v is None else round(v * 1000.0, 2)
+
+
+class Results:
+    """Samples collected by every bot during one stage."""
+
+    def __init__(self):
+        self.reset_joins()
+        self.reset()
+
+    def reset_joins(self):
+        self.joins = []
+        self.failed = 0
+        self.redirects = 0
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.intervals = []
+        self.shot_latency = []
+        self.rtt = []
+        self.snapshots = 0
+        self.bytes_in = 0
+        self.msgs_out = 0
+        self.disconnects = 0
+        # Every room counts its own ticks: room -> [(local time, tick) first seen, last seen]
+        self.ticks = {}
+
+    def on_tick(self, now, tick, room=None):
+        seen = self.ticks.get(room)
+        if seen is None:
+            self.ticks[room] = [(now, tick), (now, tick)]
+            return
+        if tick < seen[0][1]:
+            seen[0] = (now, tick)
+        if tick > seen[1][1]:
+            seen[1] = (now, tick)
+
+    def tick_rate(self):
+        """Ticks per second, averaged over the rooms."""
+        rates = [(last[1] - first[1]) / (last[0] - first[0])
+                 for first, last in self.ticks.values() if last[0] > first[0]]
+        if not rates:
+            return None
+        return sum(rates) / len(rates)
+
+
+class Bot:
+    """One simulated player: protocol state plus its movement and fire pattern."""
+
+    def __init__(self, n, args, results, shots):
+        self.n = n
+        self.args = args
+        self.results = results
+        self.shots = shots  # (owner, x, y) -> send time, shared by all bots
+        self.cid = None
+        self.room = None
+        self.binary = False
+        self.hello_at = None
+        self.joined = asyncio.Event()
+        self.x = random.uniform(0, mapdata.WIDTH - mapdata.PLAYER_SIZE)
+        self.y = random.uniform(0, mapdata.HEIGHT - mapdata.PLAYER_SIZE)
+        self.heading = random.uniform(0, 2 * math.pi)
+        self.seq = 0
+        self.last_snapshot = None
+        self.others = set()
+        self.dead_at = None
+        self.last_ping = 0.0
+
+    def hello(self):
+        self.hello_at = time.perf_counter()
+        msg = {'type': 'hello', 'name': f'bot{self.n}', 'x': self.x, 'y': self.y,
+               'delta': not self.args.full}
+        if self.args.binary:
+            msg['proto'] = protocol.PROTO_BIN
+        if self.args.rooms:
+            msg['room'] = f'load{self.n % self.args.rooms + 1}'
+        return msg
+
+    def on_message(self, msg, now):
+        """Handle one server message; returns messages to send back."""
+        t = msg.get('type')
+        r = self.results
+        if t in ('state', 'delta'):
+            r.snapshots += 1
+            if self.last_snapshot is not None:
+                r.intervals.append(now - self.last_snapshot)
+            self.last_snapshot = now
+            tick = msg.get('tick')
+            if tick is not None:
+                r.on_tick(now, tick, self.room)
+            if t == 'state':
+                self.others = {int(k) for k in msg.get('players', {})}
+            else:
+                self.others.update(int(k) for k in msg.get('join', {}))
+                self.others.difference_update(int(k) for k in msg.get('leave', ()))
+            self.others.discard(self.cid)
+        elif t == 'shot':
+            sent = self.shots.get((msg.get('owner'), int(round(msg.get('x', 0))), int(round(msg.get('y', 0)))))
+            if sent is not None:
+                r.shot_latency.append(now - sent)
+        elif t == 'ping':
+            return [{'type': 'pong', 't': msg.get('t')}]
+        elif t == 'pong':
+            if msg.get('t'):
+                r.rtt.append(now - msg['t'])
+        elif t == 'hp':
+            if msg.get('id') == self.cid and msg.get('hp', 1) <= 0 and self.dead_at is None:
+                self.dead_at = now
+        elif t == 'welcome':
+            self.cid = msg.get('id')
+            self.room = msg.get('room')
+            self.binary = msg.get('proto') == protocol.PROTO_BIN
+            r.joins.append(now - self.hello_at)
+            self.joined.set()
+        return ()
+
+    def step(self, now, dt):
+        """Messages for one send interval: movement, maybe a shot, hit, revive or ping."""
+        args = self.args
+        out = []
+        if self.dead_at is not None:
+            if now - self.dead_at >= args.revive_delay:
+                self.dead_at = None
+                out.append({'type': 'revive', 'x': self.x, 'y': self.y})
+            return out
+        dx, dy = self.direction(now)
+        if dx or dy:
+            if args.input:
+                n = max(1, min(movement.MAX_STEPS, round(dt * movement.FRAME_RATE)))
+                self.seq += 1
+                out.append({'type': 'input', 'seq': self.seq, 'dx': dx * n, 'dy': dy * n, 'n': n})
+                x, y = movement.apply(self.x, self.y, dx * n, dy * n)
+            else:
+                x, y = movement.apply(self.x, self.y, dx * dt * movement.FRAME_RATE, dy * dt * movement.FRAME_RATE)
+            self.x = max(0.0, min(x, mapdata.WIDTH - mapdata.PLAYER_SIZE))
+            self.y = max(0.0, min(y, mapdata.HEIGHT - mapdata.PLAYER_SIZE))
+            if not args.input:
+                out.append({'type': 'pos', 'x': self.x, 'y': self.y})
+        if args.fire_hz and random.random() < args.fire_hz * dt:
+            out.append(self.shot(now))
+            if self.others and random.random() < args.hit_prob:
+                out.append({'type': 'hit', 'victim': random.choice(list(self.others)), 'damage': 10})
+        if args.ping_interval and now - self.last_ping >= args.ping_interval:
+            self.last_ping = now
+            out.append({'type': 'ping', 't': now})
+        return out
+
+    def direction(self, now):
+        pattern = self.args.move
+        if pattern == 'idle':
+            return 0.0, 0.0
+        if pattern == 'circle':
+            a = now * 2.0 + self.n
+            return math.cos(a), math.sin(a)
+        # Random walk that turns back at the map edges
+        self.heading += random.uniform(-0.3, 0.3)
+        if not 0 < self.x < mapdata.WIDTH - mapdata.PLAYER_SIZE or not 0 < self.y < mapdata.HEIGHT - mapdata.PLAYER_SIZE:
+            cx = mapdata.WIDTH / 2 - self.x
+            cy = mapdata.HEIGHT / 2 - self.y
+            self.heading = math.atan2(cy, cx)
+        return math.cos(self.heading), math.sin(self.heading)
+
+    def shot(self, now):
+        # Integer origins survive both wire formats exactly, so receivers
+        # can match the shot back to its send time
+        x = int(self.x + mapdata.PLAYER_SIZE / 2)
+        y = int(self.y + mapdata.PLAYER_SIZE / 2)
+        a = random.uniform(0, 2 * math.pi)
+        self.shots[(self.cid, x, y)] = now
+        return {'type': 'shot', 'x': x, 'y': y, 'vx': math.cos(a) * SHOT_SPEED, 'vy': math.sin(a) * SHOT_SPEED,
+                'damage': 10, 'size': 6, 'color': [255, 90, 90], 'ref': self.seq & 0xFFFF}
+
+
+async def tick_bot(bot, send, stop):
+    """Send the bot's traffic every 1/send_hz seconds, starting at a random phase."""
+    interval = 1.0 / bot.args.send_hz
+    await asyncio.sleep(random.uniform(0, interval))
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        msgs = bot.step(now, now - last)
+        last = now
+        if msgs:
+            bot.results.msgs_out += len(msgs)
+            await send(msgs[0] if len(msgs) == 1 else {'type': 'batch', 'msgs': msgs})
+
+
+async def run_tcp(bot, stop):
+    args = bot.args
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    async def send(msg):
+        writer.write(protocol.encode_stream(msg, bot.binary))
+
+    await send(bot.hello())
+    ticker = None
+    buf = b''
+    try:
+        while not stop.is_set():
+            data = await reader.read(65536)
+            if not data:
+                bot.results.disconnects += 1
+                break
+            now = time.perf_counter()
+            bot.results.bytes_in += len(data)
+            buf += data
+            while buf:
+                if bot.binary:
+                    frames, buf = protocol.split_frames(buf)
+                    msgs = [protocol.decode(p) for p in frames]
+                    for msg in msgs:
+                        for reply in bot.on_message(msg, now):
+                            await send(reply)
+                    break
+                if b'\n' not in buf:
+                    break
+                line, buf = buf.split(b'\n', 1)
+                if line.strip():
+                    # The welcome may switch the rest of the stream to binary
+                    for reply in bot.on_message(protocol.loads(line), now):
+                        await send(reply)
+            if ticker is None and bot.joined.is_set():
+                ticker = asyncio.create_task(tick_bot(bot, send, stop))
+    finally:
+        if ticker is not None:
+            ticker.cancel()
+        writer.close()
+
+
+async def run_ws(bot, stop):
+    url = bot.args.url
+    hello = bot.hello()
+    for _ in range(MAX_REDIRECTS + 1):
+        redirect = None
+        async with websockets.connect(url, max_size=2 ** 20) as ws:
+            async def send(msg):
+                await ws.send(protocol.encode_ws(msg, bot.binary and msg.get('type') != 'hello'))
+
+            await send(hello)
+            ticker = None
+            try:
+                while not stop.is_set():
+                    data = await ws.recv()
+                    now = time.perf_counter()
+                    bot.results.bytes_in += len(data)
+                    msg = protocol.decode_ws(data)
+                    if msg.get('type') == 'redirect':
+                        # A cluster worker that doesn't host the room names the one that does
+                        redirect = msg
+                        break
+                    for reply in bot.on_message(msg, now):
+                        await send(reply)
+                    if ticker is None and bot.joined.is_set():
+                        ticker = asyncio.create_task(tick_bot(bot, send, stop))
+            except websockets.ConnectionClosed:
+                bot.results.disconnects += 1
+            finally:
+                if ticker is not None:
+                    ticker.cancel()
+        if redirect is None:
+            return
+        bot.results.redirects += 1
+        url = protocol.redirect_url(url, redirect)
+        hello = dict(hello, room=redirect.get('room'))
+    raise RuntimeError('too many redirects')
+
+
+async def run_bot(bot, stop):
+    try:
+        if bot.args.transport == 'ws':
+            await run_ws(bot, stop)
+        else:
+            await run_tcp(bot, stop)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        if not bot.joined.is_set():
+            bot.results.failed += 1
+        else:
+            bot.results.disconnects += 1
+
+
+class ServerProcess:
+    """CPU time of the server under test and its worker processes, read from /proc (Linux only)."""
+
+    def __init__(self, pid, proc=None):
+        self.pid = pid
+        self.proc = proc  # subprocess.Popen when we started it ourselves
+        self.mark()
+
+    def pids(self):
+        # cluster.py runs the game in child processes
+        try:
+            with open(f'/proc/{self.pid}/task/{self.pid}/children') as f:
+                return [self.pid] + [int(p) for p in f.read().split()]
+        except OSError:
+            return [self.pid]
+
+    def cpu_seconds(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                if pid == self.pid:
+                    return None
+                continue  # a worker that just exited
+            # utime and stime are fields 14 and 15 of the stat line
+            total += int(fields[11]) + int(fields[12])
+        return total / os.sysconf('SC_CLK_TCK')
+
+    def mark(self):
+        self.cpu0 = self.cpu_seconds()
+        self.t0 = time.perf_counter()
+
+    def usage(self):
+        """Percent of one core used since the last mark(); over 100 with several workers."""
+        cpu = self.cpu_seconds()
+        if cpu is None or self.cpu0 is None:
+            return None
+        return round(100.0 * (cpu - self.cpu0) / (time.perf_counter() - self.t0), 1)
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+def spawn_server(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    if args.transport == 'ws':
+        port = int(args.url.rsplit(':', 1)[1].split('/', 1)[0])
+        if args.workers:
+            cmd = [sys.executable, os.path.join(here, 'cluster.py')]
+        else:
+            cmd = [sys.executable, os.path.join(here, 'server_ws.py')]
+        env = dict(os.environ, PORT=str(port), WORKERS=str(args.workers))
+        host = '127.0.0.1'
+    else:
+        host, port = args.host, args.port
+        cmd = [sys.executable, '-c', f'import server; server.start_server({host!r}, {port})']
+        env = os.environ
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+        raise SystemExit(f'something is already listening on {host}:{port}')
+    except OSError:
+        pass
+    proc = subprocess.Popen(cmd, cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return ServerProcess(proc.pid, proc)
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit('server exited during startup')
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit('server did not start listening')
+
+
+def summarize(players, results, server):
+    r = results
+    elapsed = time.perf_counter() - r.started
+    intervals = r.intervals
+    mean = sum(intervals) / len(intervals) if intervals else None
+    jitter = math.sqrt(sum((v - mean) ** 2 for v in intervals) / len(intervals)) if intervals else None
+    tick_rate = r.tick_rate()
+    return {
+        'players': players,
+        'joined': len(r.joins),
+        'failed': r.failed,
+        'redirects': r.redirects,
+        'disconnects': r.disconnects,
+        'join_p50_ms': ms(percentile(r.joins, 0.5)),
+        'join_p99_ms': ms(percentile(r.joins, 0.99)),
+        'snapshots_per_bot_s': round(r.snapshots / players / elapsed, 2) if players else None,
+        'interval_p50_ms': ms(percentile(intervals, 0.5)),
+        'interval_p99_ms': ms(percentile(intervals, 0.99)),
+        'jitter_ms': ms(jitter),
+        'shot_p50_ms': ms(percentile(r.shot_latency, 0.5)),
+        'shot_p99_ms': ms(percentile(r.shot_latency, 0.99)),
+        'rtt_p50_ms': ms(percentile(r.rtt, 0.5)),
+        'rtt_p99_ms': ms(percentile(r.rtt, 0.99)),
+        'server_tick_hz': None if tick_rate is None else round(tick_rate, 2),
+        'server_cpu_pct': server.usage() if server is not None else None,
+        'kb_in_s': round(r.bytes_in / 1024 / elapsed, 1),
+        'msgs_out_s': round(r.msgs_out / elapsed, 1),
+    }
+
+
+COLUMNS = ('players', 'joined', 'failed', 'join_p99_ms', 'snapshots_per_bot_s', 'interval_p99_ms', 'jitter_ms',
+           'shot_p50_ms', 'shot_p99_ms', 'rtt_p99_ms', 'server_tick_hz', 'server_cpu_pct')
+
+
+def print_row(row, header=False):
+    if header:
+        print(' '.join(f'{c[:14]:>14}' for c in COLUMNS))
+    print(' '.join(f'{"-" if row[c] is None else row[c]:>14}' for c in COLUMNS), flush=True)
+
+
+async def forget_old_shots(shots, stop):
+    while not stop.is_set():
+        await asyncio.sleep(1.0)
+        cutoff = time.perf_counter() - SHOT_MEMORY
+        for key in [k for k, t in shots.items() if t < cutoff]:
+            del shots[key]
+
+
+async def main_async(args, server):
+    results = Results()
+    shots = {}
+    stop = asyncio.Event()
+    tasks = []
+    rows = []
+    janitor = asyncio.create_task(forget_old_shots(shots, stop))
+    steps = [int(s) for s in args.steps.split(',')] if args.steps else [args.players]
+    try:
+        for i, count in enumerate(steps):
+            results.reset_joins()
+            # Ramp up to this stage's player count, then measure a steady hold
+            while len(tasks) < count:
+                bot = Bot(len(tasks), args, results, shots)
+                tasks.append(asyncio.create_task(run_bot(bot, stop)))
+                await asyncio.sleep(1.0 / args.ramp)
+            await asyncio.sleep(args.settle)
+            results.reset()
+            if server is not None:
+                server.mark()
+            await asyncio.sleep(args.hold)
+            row = summarize(count, results, server)
+            rows.append(row)
+            print_row(row, header=i == 0)
+    finally:
+        stop.set()
+        janitor.cancel()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, janitor, return_exceptions=True)
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--transport', choices=('tcp', 'ws'), default='tcp')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=12345)
+    ap.add_argument('--url', default='ws://127.0.0.1:8000/ws')
+    ap.add_argument('--players', type=int, default=100, help='bots for a single stage')
+    ap.add_argument('--steps', help='comma-separated player counts for a capacity curve')
+    ap.add_argument('--ramp', type=float, default=200.0, help='new connections per second')
+    ap.add_argument('--settle', type=float, default=2.0, help='seconds after ramp-up before measuring')
+    ap.add_argument('--hold', type=float, default=10.0, help='seconds measured per stage')
+    ap.add_argument('--move', choices=('random', 'circle', 'idle'), default='random')
+    ap.add_argument('--input', action='store_true', help="send 'input' commands instead of 'pos'")
+    ap.add_argument('--send-hz', type=float, default=20.0, help='messages per second per bot')
+    ap.add_argument('--fire-hz', type=float, default=1.0, help='shots per second per bot')
+    ap.add_argument('--hit-prob', type=float, default=0.2, help="chance a shot is followed by a 'hit' report")
+    ap.add_argument('--revive-delay', type=float, default=1.0)
+    ap.add_argument('--ping-interval', type=float, default=2.0)
+    ap.add_argument('--binary', action='store_true', help='negotiate the binary protocol')
+    ap.add_argument('--full', action='store_true', help='ask for full state snapshots instead of deltas')
+    ap.add_argument('--rooms', type=int, default=0,
+                    help='spread bots round-robin over this many named rooms (0: let the server place them)')
+    ap.add_argument('--spawn', action='store_true', help='start the server under test as a subprocess')
+    ap.add_argument('--workers', type=int, default=0,
+                    help='with --spawn and --transport ws, run cluster.py with this many worker processes')
+    ap.add_argument('--server-pid', type=int, help='measure CPU of an already running server')
+    ap.add_argument('--json', help='write the results to this file')
+    args = ap.parse_args(argv)
+    if args.transport == 'ws' and websockets is None:
+        raise SystemExit('websockets is not installed')
+    server = None
+    if args.spawn:
+        server = spawn_server(args)
+    elif args.server_pid:
+        server = ServerProcess(args.server_pid)
+    try:
+        rows = asyncio.run(main_async(args, server))
+    except KeyboardInterrupt:
+        rows = []
+    finally:
+        if server is not None:
+            server.stop()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+"""Map layout shared by the client and the servers."""
+
+WIDTH = 800
+HEIGHT = 600
+PLAYER_SIZE = 50
+
+# Test walls for cover: (x, y, w, h)
+WALLS = [
+    (180, 140, 120, 20),
+    (420, 120, 20, 140),
+    (580, 260, 140, 20),
+    (240, 360, 200, 20),
+    (90, 280, 20, 160),
+    (640, 420, 120, 20),
+]
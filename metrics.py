@@ -0,0 +1,255 @@
+"""Prometheus-style metrics for the game servers.
+
+No client library needed: counters, gauges and histograms live in a
+Registry that renders the Prometheus text exposition format. server_ws.py
+serves it on /metrics; server.py can answer scrapes from its own event
+loop through StatsListener. ServerMetrics holds the metrics both servers
+report, under the same names, so one dashboard covers either.
+"""
+import bisect
+import selectors
+import socket
+import time
+
+import protocol
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds; spans sub-millisecond encodes up to ticks that blow the budget
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Message types used as label values; anything else a client sends is
+# counted as 'other' so it can't grow the label set
+MESSAGE_TYPES = frozenset(protocol.STRUCTS) | {'batch'}
+
+
+def _labels(names, values, extra=''):
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _num(v):
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self.values = {}  # label values -> total
+
+    def inc(self, amount=1, labels=()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, v in sorted(self.values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_num(v)}'
+
+
+class Gauge:
+    """A value set by the server, or read from fn at scrape time.
+
+    fn may return a number or a dict of label values -> number.
+    """
+
+    def __init__(self, name, help, fn=None, labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = labels
+        self.values = {}
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} gauge'
+        values = self.values
+        if self.fn is not None:
+            v = self.fn()
+            values = v if isinstance(v, dict) else {(): v}
+        for labels, v in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_num(v)}'
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        total = 0
+        for bound, n in zip(self.bounds + ('+Inf',), self.counts):
+            total += n
+            le = bound if bound == '+Inf' else repr(bound)
+            yield f'{self.name}_bucket{{le="{le}"}} {total}'
+        yield f'{self.name}_sum {_num(self.sum)}'
+        yield f'{self.name}_count {self.count}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, fn=None, labels=()):
+        return self.add(Gauge(name, help, fn, labels))
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS):
+        return self.add(Histogram(name, help, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class ServerMetrics:
+    """What both game servers report; each adds its own gauges on top."""
+
+    def __init__(self, registry=None):
+        r = self.registry = registry if registry is not None else Registry()
+        self.tick = r.histogram('game_tick_seconds', 'Time spent in one server tick.')
+        self.snapshot = r.histogram('game_snapshot_seconds',
+                                    'Time to build and encode one round of snapshots.')
+        self.send_latency = r.histogram('game_send_latency_seconds',
+                                        'Time from queueing data for a client to handing it to the socket.',
+                                        LATENCY_BUCKETS)
+        self.loop_lag = r.histogram('game_loop_lag_seconds',
+                                    'How late each tick started against its schedule.', LATENCY_BUCKETS)
+        self.msgs_in = r.counter('game_messages_received_total', 'Messages received, by type.', ('type',))
+        self.bytes_in = r.counter('game_bytes_received_total', 'Bytes received, by message type.', ('type',))
+        self.msgs_out = r.counter('game_messages_sent_total', 'Messages queued to clients, by type.', ('type',))
+        self.bytes_out = r.counter('game_bytes_sent_total', 'Bytes queued to clients, by message type.', ('type',))
+        self.dropped = r.counter('game_clients_dropped_total',
+                                 'Clients disconnected by the server, by reason.', ('reason',))
+
+    def received(self, kind, nbytes):
+        key = (kind if kind in MESSAGE_TYPES else 'other',)
+        self.msgs_in.inc(1, key)
+        self.bytes_in.inc(nbytes, key)
+
+    def sent(self, kind, nbytes, n=1):
+        key = (kind if kind in MESSAGE_TYPES else 'other',)
+        self.msgs_out.inc(n, key)
+        self.bytes_out.inc(nbytes * n, key)
+
+    def drop(self, reason):
+        self.dropped.inc(1, (reason,))
+
+
+class StatsListener:
+    """Answers HTTP scrapes from inside a selectors event loop.
+
+    The listening socket and every scrape connection are registered with
+    this object as their selector data; the loop hands their events to
+    handle(). Requests are read and answered without blocking, and
+    connections idle for longer than timeout are closed by expire().
+    """
+
+    def __init__(self, sel, host, port, render, timeout=5.0):
+        self.sel = sel
+        self.render = render
+        self.timeout = timeout
+        self.pending = {}  # socket -> [inbuf, outbuf, opened]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.sock.setblocking(False)
+        sel.register(self.sock, selectors.EVENT_READ, self)
+
+    def handle(self, sock, mask):
+        if sock is self.sock:
+            self._accept()
+            return
+        state = self.pending.get(sock)
+        if state is None:
+            return
+        try:
+            if mask & selectors.EVENT_READ and state[1] is None:
+                data = sock.recv(4096)
+                if not data:
+                    self._close(sock)
+                    return
+                state[0] += data
+                if b'\r\n\r\n' in state[0] or len(state[0]) > 8192:
+                    state[1] = self._respond(state[0])
+                    self.sel.modify(sock, selectors.EVENT_WRITE, self)
+            if state[1]:
+                sent = sock.send(state[1])
+                del state[1][:sent]
+                if not state[1]:
+                    self._close(sock)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except Exception:
+            self._close(sock)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except Exception:
+                return
+            sock.setblocking(False)
+            self.pending[sock] = [b'', None, time.monotonic()]
+            self.sel.register(sock, selectors.EVENT_READ, self)
+
+    def _respond(self, request):
+        parts = request.split(b' ', 2)
+        path = parts[1].split(b'?', 1)[0] if len(parts) > 1 else b''
+        if path in (b'/', b'/metrics'):
+            status, body = '200 OK', self.render().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        head = (f'HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n')
+        return bytearray(head.encode() + body)
+
+    def _close(self, sock):
+        self.pending.pop(sock, None)
+        try:
+            self.sel.unregister(sock)
+        except Exception:
+            pass
+        try:
+            sock.close()
+        except Exception:
+            pass
+
+    def expire(self, now):
+        for sock, state in list(self.pending.items()):
+            if now - state[2] > self.timeout:
+                self._close(sock)
+
+    def close(self):
+        for sock in list(self.pending):
+            self._close(sock)
+        self._close(self.sock)
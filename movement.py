@@ -0,0 +1,69 @@
+"""Player movement rules shared by client-side prediction and the servers.
+
+Clients send movement as sequence-numbered 'input' commands instead of
+positions: each command sums the stick direction over n client frames.
+Applying the same commands in the same order gives the same position on
+both ends, so the client can move immediately and only correct itself
+when the server's acknowledged position disagrees.
+"""
+import math
+
+SPEED = 5  # pixels per client frame at full stick
+FRAME_RATE = 60  # client frames per second SPEED is tuned for
+MAX_STEPS = 30  # frames a single command may cover
+
+
+def clamp(dx, dy, n):
+    """Bound a command to n frames of at most unit-length stick input.
+
+    A non-finite dx or dy is no movement at all: NaN compares False
+    against any bound and would otherwise pass straight through.
+    """
+    if not (math.isfinite(dx) and math.isfinite(dy)):
+        return 0.0, 0.0, 0
+    n = max(0, min(int(n), MAX_STEPS))
+    mag = math.hypot(dx, dy)
+    if mag > n:
+        if n == 0:
+            return 0.0, 0.0, 0
+        dx *= n / mag
+        dy *= n / mag
+    return dx, dy, n
+
+
+def apply(x, y, dx, dy):
+    return x + dx * SPEED, y + dy * SPEED
+
+
+class StepBudget:
+    """Caps the frames of movement a client can claim over time.
+
+    Refills at FRAME_RATE frames per second up to `burst`, so batching
+    or jitter is fine but a client can't move faster than the game runs.
+    """
+
+    def __init__(self, rate=FRAME_RATE, burst=FRAME_RATE):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = None
+
+    def take(self, n, now):
+        """Frames of n the client may use now (possibly fewer)."""
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        n = min(n, int(self.tokens))
+        self.tokens -= n
+        return n
+
+    def command(self, dx, dy, n, now):
+        """Clamp a command and charge it to the budget; returns the (dx, dy) to apply."""
+        dx, dy, n = clamp(dx, dy, n)
+        if n == 0:
+            return 0.0, 0.0
+        allowed = self.take(n, now)
+        if allowed < n:
+            dx *= allowed / n
+            dy *= allowed / n
+        return dx, dy
@@ -0,0 +1,153 @@
+"""Frame profiler for the pygame client.
+
+The game loop calls begin_frame() at the top of every frame and lap(name)
+after each phase; the time since the previous lap is charged to that
+phase. Network threads report their own spans with span() and count
+traffic with count_in()/count_out(). Rolling p50/p99 per phase, FPS and
+traffic rates are summarized for an on-screen HUD, and while tracing every
+span is also kept as a Chrome trace event, so a session captured on a
+phone can be opened in chrome://tracing or Perfetto.
+
+Everything is a no-op while the profiler is disabled.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+WINDOW = 240  # frames kept for the rolling percentiles
+HUD_INTERVAL = 0.5  # seconds between HUD summaries
+MAX_TRACE_EVENTS = 500000  # tracing stops recording past this
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+class FrameProfiler:
+    def __init__(self, window=WINDOW, max_events=MAX_TRACE_EVENTS):
+        self.enabled = False
+        self.tracing = False
+        self.window = window
+        self.max_events = max_events
+        self.origin = time.perf_counter()
+        self.phases = {}  # name -> deque of per-frame seconds, in first-seen order
+        self.frames = collections.deque(maxlen=window)
+        self.events = []
+        self.threads = {}  # thread id -> name, for the trace metadata
+        self._frame = {}  # phase totals for the frame in progress
+        self._frame_start = None
+        self._last = None
+        # Best-effort counters: network threads bump them without a lock
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.msgs_in = 0
+        self.msgs_out = 0
+        self._hud = []
+        self._hud_at = 0.0
+        self._hud_counts = (0, 0, 0, 0)
+
+    def enable(self, on=True):
+        self.enabled = on
+        if not on:
+            self._frame_start = self._last = None
+            self._frame = {}
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._frame_start is not None:
+            self.frames.append(now - self._frame_start)
+            for name, total in self._frame.items():
+                d = self.phases.get(name)
+                if d is None:
+                    d = self.phases[name] = collections.deque(maxlen=self.window)
+                d.append(total)
+            self._frame = {}
+        self._frame_start = self._last = now
+
+    def lap(self, name):
+        """Charge the time since the previous lap (or frame start) to name."""
+        if not self.enabled or self._last is None:
+            return
+        now = time.perf_counter()
+        start, self._last = self._last, now
+        self._frame[name] = self._frame.get(name, 0.0) + (now - start)
+        if self.tracing:
+            self._trace(name, start, now)
+
+    def span(self, name, start, end=None):
+        """Record a span measured elsewhere (e.g. on a network thread)."""
+        if not self.enabled:
+            return
+        if end is None:
+            end = time.perf_counter()
+        if self.tracing:
+            self._trace(name, start, end)
+
+    def count_in(self, nbytes, msgs=0):
+        if self.enabled:
+            self.bytes_in += nbytes
+            self.msgs_in += msgs
+
+    def count_out(self, nbytes, msgs=0):
+        if self.enabled:
+            self.bytes_out += nbytes
+            self.msgs_out += msgs
+
+    def _trace(self, name, start, end):
+        if len(self.events) >= self.max_events:
+            return
+        thread = threading.current_thread()
+        if thread.ident not in self.threads:
+            self.threads[thread.ident] = thread.name
+        self.events.append({
+            'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+            'ts': round((start - self.origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+        })
+
+    def start_trace(self):
+        self.enable()
+        self.events = []
+        self.tracing = True
+
+    def stop_trace(self, path=None):
+        """Stop tracing and write the events to path; returns the path."""
+        self.tracing = False
+        if path is None:
+            path = time.strftime('trace-%Y%m%d-%H%M%S.json')
+        pid = os.getpid()
+        meta = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in self.threads.items()]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': meta + self.events, 'displayTimeUnit': 'ms'}, f)
+        self.events = []
+        return path
+
+    def hud_lines(self, now=None):
+        """Summary text for the HUD, refreshed every HUD_INTERVAL seconds."""
+        if now is None:
+            now = time.perf_counter()
+        if now - self._hud_at < HUD_INTERVAL and self._hud:
+            return self._hud
+        elapsed = now - self._hud_at
+        counts = (self.bytes_in, self.bytes_out, self.msgs_in, self.msgs_out)
+        rates = [(c - p) / elapsed for c, p in zip(counts, self._hud_counts)] if self._hud_at else [0.0] * 4
+        self._hud_at = now
+        self._hud_counts = counts
+        frames = sorted(self.frames)
+        fps = len(frames) / sum(frames) if frames else 0.0
+        lines = [f"FPS {fps:.0f}  frame p50 {_percentile(frames, 0.5) * 1e3:.1f} p99 {_percentile(frames, 0.99) * 1e3:.1f} ms"]
+        for name, d in self.phases.items():
+            values = sorted(d)
+            lines.append(f"{name:<8} p50 {_percentile(values, 0.5) * 1e3:5.2f}  p99 {_percentile(values, 0.99) * 1e3:5.2f} ms")
+        lines.append(f"in  {rates[0] / 1024:.1f} KB/s {rates[2]:.0f} msg/s")
+        lines.append(f"out {rates[1] / 1024:.1f} KB/s {rates[3]:.0f} msg/s")
+        if self.tracing:
+            lines.append(f"trace: {len(self.events)} events")
+        self._hud = lines
+        return lines
@@ -0,0 +1,232 @@
+"""Structure-of-arrays projectile simulation backed by NumPy.
+
+Every live projectile occupies one slot in a set of parallel arrays;
+stepping integrates, expires and collides all of them in a single
+vectorized pass and compacts dead slots in place. Collision rules match
+the pygame client: a projectile is the square
+Rect(int(x - size/2), int(y - size/2), size, size) and dies when it
+leaves the map, runs out of life or overlaps a wall or target.
+
+Walls and targets go through a CellTable broad phase, so each projectile
+is only tested against the rects sharing its grid cells and collision
+cost doesn't grow with the number of walls or players on the map.
+"""
+import numpy as np
+
+_NO_HITS = (np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros(0, np.int32))
+CELL_SIZE = 64
+
+
+class CellTable:
+    """Uniform-grid broad phase over axis-aligned rects.
+
+    Each cell lists the indices of the rects overlapping it, packed into
+    a (cells, depth) array padded with -1 so candidate lookup for many
+    query boxes at once is a single gather. Rects outside the map are
+    clamped into the border cells.
+    """
+
+    def __init__(self, x0, y0, x1, y1, width, height, cell_size=CELL_SIZE):
+        self.cell_size = float(cell_size)
+        self.cols = int(width // cell_size) + 1
+        self.rows = int(height // cell_size) + 1
+        cx0 = self._col(np.asarray(x0, np.float64)).tolist()
+        cy0 = self._row(np.asarray(y0, np.float64)).tolist()
+        cx1 = self._col(np.asarray(x1, np.float64)).tolist()
+        cy1 = self._row(np.asarray(y1, np.float64)).tolist()
+        cells = []
+        idxs = []
+        cols = self.cols
+        for i in range(len(cx0)):
+            for cy in range(cy0[i], cy1[i] + 1):
+                for cx in range(cx0[i], cx1[i] + 1):
+                    cells.append(cy * cols + cx)
+                    idxs.append(i)
+        ncells = self.cols * self.rows
+        if not cells:
+            self.table = np.full((ncells, 1), -1, np.int32)
+            return
+        cells = np.asarray(cells, np.int64)
+        idxs = np.asarray(idxs, np.int32)
+        order = np.argsort(cells, kind='stable')
+        cells = cells[order]
+        slot = np.arange(len(cells)) - np.searchsorted(cells, cells, 'left')
+        self.table = np.full((ncells, int(slot.max()) + 1), -1, np.int32)
+        self.table[cells, slot] = idxs[order]
+
+    def _col(self, x):
+        return np.clip(np.floor(x / self.cell_size), 0, self.cols - 1).astype(np.int64)
+
+    def _row(self, y):
+        return np.clip(np.floor(y / self.cell_size), 0, self.rows - 1).astype(np.int64)
+
+    def candidates(self, x0, y0, x1, y1):
+        """(N, 4 * depth) rect indices (-1 = none) near each query box.
+
+        Looks up the cells under the four corners of every box, so boxes
+        must not be wider or taller than one cell.
+        """
+        ca = self._col(x0)
+        cb = self._col(x1)
+        ra = self._row(y0) * self.cols
+        rb = self._row(y1) * self.cols
+        t = self.table
+        return np.concatenate((t[ra + ca], t[ra + cb], t[rb + ca], t[rb + cb]), axis=1)
+
+    def query(self, x0, y0, x1, y1):
+        """Indices of rects sharing a cell with the box (any size)."""
+        ca, cb = self._col(np.array([x0, x1], np.float64)).tolist()
+        ra, rb = self._row(np.array([y0, y1], np.float64)).tolist()
+        found = set()
+        for cy in range(ra, rb + 1):
+            for idx in self.table[cy * self.cols + ca:cy * self.cols + cb + 1].ravel().tolist():
+                if idx >= 0:
+                    found.add(idx)
+        return found
+
+
+class ProjectileSystem:
+    # Per-projectile arrays; subclasses may append their own
+    FIELDS = ('x', 'y', 'vx', 'vy', 'life', 'size', 'id', 'owner', 'damage', 'color')
+
+    def __init__(self, width, height, walls=(), capacity=256, target_size=50):
+        self.width = float(width)
+        self.height = float(height)
+        self.target_size = float(target_size)
+        self.capacity = int(capacity)
+        self.count = 0
+        self.next_id = 1
+        n = self.capacity
+        self.x = np.zeros(n, np.float32)
+        self.y = np.zeros(n, np.float32)
+        self.vx = np.zeros(n, np.float32)
+        self.vy = np.zeros(n, np.float32)
+        self.life = np.zeros(n, np.float32)
+        self.size = np.zeros(n, np.float32)
+        self.id = np.zeros(n, np.int64)
+        self.owner = np.full(n, -1, np.int32)
+        self.damage = np.zeros(n, np.int32)
+        self.color = np.zeros((n, 3), np.uint8)
+        self.set_walls(walls)
+
+    def set_walls(self, walls):
+        w = np.asarray([tuple(r) for r in walls], np.float32).reshape(-1, 4)
+        self.walls = CellTable(w[:, 0], w[:, 1], w[:, 0] + w[:, 2], w[:, 1] + w[:, 3],
+                               self.width, self.height)
+        # A trailing sentinel that overlaps nothing absorbs the -1 padding
+        self.wall_x0 = np.append(w[:, 0], np.inf)
+        self.wall_y0 = np.append(w[:, 1], np.inf)
+        self.wall_x1 = np.append(w[:, 0] + w[:, 2], -np.inf)
+        self.wall_y1 = np.append(w[:, 1] + w[:, 3], -np.inf)
+
+    def _grow(self):
+        new = self.capacity * 2
+        for name in self.FIELDS:
+            arr = getattr(self, name)
+            bigger = np.zeros((new,) + arr.shape[1:], arr.dtype)
+            bigger[:self.count] = arr[:self.count]
+            setattr(self, name, bigger)
+        self.capacity = new
+
+    def spawn(self, x, y, vx, vy, damage, owner=-1, size=6, color=(255, 90, 90), life=2.0, pid=None):
+        """Add a projectile and return its id."""
+        if self.count == self.capacity:
+            self._grow()
+        if pid is None:
+            pid = self.next_id
+            self.next_id += 1
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.vx[i] = vx
+        self.vy[i] = vy
+        self.life[i] = life
+        # CellTable.candidates only looks one cell around each projectile
+        self.size[i] = min(size, CELL_SIZE)
+        self.id[i] = pid
+        self.owner[i] = -1 if owner is None else owner
+        self.damage[i] = damage
+        self.color[i] = color
+        self.count = i + 1
+        return pid
+
+    def kill(self, pid):
+        """Remove the projectile with the given id, if it is still alive."""
+        n = self.count
+        idx = np.flatnonzero(self.id[:n] == pid)
+        if len(idx):
+            keep = np.ones(n, bool)
+            keep[idx] = False
+            self._compact(keep)
+
+    def clear(self):
+        self.count = 0
+
+    def _compact(self, keep):
+        n = self.count
+        m = int(np.count_nonzero(keep))
+        if m == n:
+            return
+        for name in self.FIELDS:
+            arr = getattr(self, name)
+            arr[:m] = arr[:n][keep]
+        self.count = m
+
+    def step(self, dt, target_ids=None, target_x=None, target_y=None, local_id=None):
+        """Advance every projectile by dt and resolve collisions.
+
+        Targets are squares of target_size with top-left corners at
+        (target_x, target_y); a projectile never hits its own owner.
+        With local_id set (the client view), only projectiles owned by
+        local_id can hit other targets and everyone else's projectiles
+        can only hit local_id.
+        Returns (projectile ids, target ids, damage, owners) for the
+        projectiles that struck a target this step; those projectiles
+        and any that expired or hit a wall are removed.
+        """
+        n = self.count
+        if n == 0:
+            return _NO_HITS
+        x = self.x[:n]
+        y = self.y[:n]
+        x += self.vx[:n] * dt
+        y += self.vy[:n] * dt
+        life = self.life[:n]
+        life -= dt
+        dead = (x < 0) | (x > self.width) | (y < 0) | (y > self.height) | (life <= 0)
+        size = np.trunc(self.size[:n])
+        bx0 = np.trunc(x - self.size[:n] / 2)
+        by0 = np.trunc(y - self.size[:n] / 2)
+        bx1 = bx0 + size
+        by1 = by0 + size
+        if len(self.wall_x0) > 1:
+            cand = self.walls.candidates(bx0, by0, bx1, by1)
+            hit_wall = ((bx0[:, None] < self.wall_x1[cand]) & (self.wall_x0[cand] < bx1[:, None]) &
+                        (by0[:, None] < self.wall_y1[cand]) & (self.wall_y0[cand] < by1[:, None]))
+            dead |= hit_wall.any(axis=1)
+        hits = _NO_HITS
+        if target_ids is not None and len(target_ids):
+            tids = np.asarray(target_ids, np.int64)
+            tx0 = np.trunc(np.asarray(target_x, np.float32))
+            ty0 = np.trunc(np.asarray(target_y, np.float32))
+            ts = self.target_size
+            # Targets move every step, so their grid is rebuilt per call
+            cand = CellTable(tx0, ty0, tx0 + ts, ty0 + ts, self.width, self.height).candidates(bx0, by0, bx1, by1)
+            tx0 = np.append(tx0, np.inf)[cand]
+            ty0 = np.append(ty0, np.inf)[cand]
+            tids = np.append(tids, -1)[cand]
+            owner = self.owner[:n]
+            over = ((bx0[:, None] < tx0 + ts) & (tx0 < bx1[:, None]) &
+                    (by0[:, None] < ty0 + ts) & (ty0 < by1[:, None]) &
+                    (owner[:, None] != tids) & ~dead[:, None])
+            if local_id is not None:
+                over &= (owner[:, None] == local_id) | (tids == local_id)
+            hit_any = over.any(axis=1)
+            if hit_any.any():
+                idx = np.flatnonzero(hit_any)
+                first = over[idx].argmax(axis=1)
+                hits = (self.id[idx].copy(), tids[idx, first], self.damage[idx].copy(), owner[idx].copy())
+                dead |= hit_any
+        if dead.any():
+            self._compact(~dead)
+        return hits
@@ -0,0 +1,552 @@
+"""Game protocol shared by the client and both servers.
+
+Messages are dicts with a 'type' key. They travel as JSON by default
+(newline-delimited over TCP, text frames over WebSocket), serialized with
+orjson or msgspec when installed and the stdlib json module otherwise.
+
+Clients may opt in to a compact binary encoding by sending 'proto': 'bin'
+in their JSON hello; the server confirms with 'proto': 'bin' in the JSON
+welcome and both sides switch to the binary encoding after that. Every
+binary message starts with a one byte type id followed by fixed
+little-endian fields. Over raw TCP each binary message is prefixed with
+its length (FRAME_HEADER); over WebSocket each travels in its own frame.
+
+Receivers turn decoded dicts into typed structs (Pos, Shot, ...) and
+route them with a Dispatcher, so field coercion lives in one place.
+"""
+import collections
+import json
+import math
+import struct
+import urllib.parse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+PROTO_BIN = 'bin'
+
+# Message type ids
+POS = 1
+SHOT = 2
+HIT = 3
+REVIVE = 4
+PING = 5
+PONG = 6
+STATE = 7
+DELTA = 8
+HP = 9
+DESPAWN = 10
+INPUT = 11
+ACK = 12
+BATCH = 13
+
+TYPE_IDS = {
+    'pos': POS,
+    'shot': SHOT,
+    'hit': HIT,
+    'revive': REVIVE,
+    'ping': PING,
+    'pong': PONG,
+    'state': STATE,
+    'delta': DELTA,
+    'hp': HP,
+    'despawn': DESPAWN,
+    'input': INPUT,
+    'ack': ACK,
+    'batch': BATCH,
+}
+TYPE_NAMES = {v: k for k, v in TYPE_IDS.items()}
+
+FRAME_HEADER = struct.Struct('<I')
+MAX_FRAME = 1 << 20
+MAX_BATCH = 256  # messages unpacked from one 'batch'; the rest are dropped
+MAX_DAMAGE = 1000  # per shot or hit; players have 100 hp
+# Bullet size in px; the projectile broad phase needs a bullet to fit in
+# one projectiles.CELL_SIZE cell
+MAX_SHOT_SIZE = 64
+
+_TYPE = struct.Struct('<B')
+_POS = struct.Struct('<Bff')
+_SHOT = struct.Struct('<BiffffHB3BIH')  # ..., server shot id (0 = none), shooter's ref
+_HIT = struct.Struct('<BiH')
+_HP = struct.Struct('<Bih')
+_DESPAWN = struct.Struct('<BI')
+_PING = struct.Struct('<Bd')  # ping/pong: sender's timestamp, echoed back
+_INPUT = struct.Struct('<BIffB')  # seq, summed stick dx, dy, frames
+_ACK = struct.Struct('<BIff')  # last applied input seq, resulting x, y
+_COUNT = struct.Struct('<H')
+_LEN = struct.Struct('<H')
+_BATCH_HEAD = struct.Struct('<BH')  # type, message count
+_STAMP = struct.Struct('<BId')  # type, server tick, server time
+_SEQ = struct.Struct('<BIId')  # type, seq, server tick, server time
+_ID = struct.Struct('<i')
+_ENTITY = struct.Struct('<iffhh3BB')  # id, x, y, hp, max_hp, r, g, b, name length
+_UPD_HEAD = struct.Struct('<iB')  # id, field mask
+_F32 = struct.Struct('<f')
+_I16 = struct.Struct('<h')
+_RGB = struct.Struct('<3B')
+_U8 = struct.Struct('<B')
+
+# Field mask bits used by 'delta' updates
+F_X = 1
+F_Y = 2
+F_HP = 4
+F_MAX_HP = 8
+F_COLOR = 16
+F_NAME = 32
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def _rgb(color, default=(255, 90, 90)):
+    try:
+        r, g, b = color
+        return max(0, min(255, int(r))), max(0, min(255, int(g))), max(0, min(255, int(b)))
+    except Exception:
+        return default
+
+
+def _i16(v):
+    # hp fields are int16 on the wire; saturate rather than fail the whole snapshot
+    return max(-0x8000, min(0x7FFF, int(v)))
+
+
+def _damage(v):
+    v = int(v)
+    if v < 0:
+        raise ValueError(f'negative damage: {v}')
+    return min(v, MAX_DAMAGE)
+
+
+def _between(lo, hi):
+    def conv(v):
+        return max(lo, min(hi, int(v)))
+    return conv
+
+
+def _finite(v):
+    # NaN or inf coordinates would poison every grid and snapshot they reach
+    v = float(v)
+    if not math.isfinite(v):
+        raise ValueError(f'non-finite number: {v!r}')
+    return v
+
+
+def _name_bytes(name):
+    return str(name if name is not None else '').encode('utf-8')[:255]
+
+
+def _pack_entity(out, pid, p):
+    name = _name_bytes(p.get('name'))
+    r, g, b = _rgb(p.get('color'), (255, 0, 0))
+    out += _ENTITY.pack(int(pid), float(p.get('x', 0.0)), float(p.get('y', 0.0)),
+                        _i16(p.get('hp', 100)), _i16(p.get('max_hp', 100)), r, g, b, len(name))
+    out += name
+
+
+def _unpack_entity(data, off):
+    pid, x, y, hp, max_hp, r, g, b, n = _ENTITY.unpack_from(data, off)
+    off += _ENTITY.size
+    name = bytes(data[off:off + n]).decode('utf-8', errors='ignore')
+    return pid, {'name': name, 'x': x, 'y': y, 'color': [r, g, b], 'hp': hp, 'max_hp': max_hp}, off + n
+
+
+def _pack_entities(out, entities):
+    out += _COUNT.pack(len(entities))
+    for pid, p in entities.items():
+        _pack_entity(out, pid, p)
+
+
+def _unpack_entities(data, off):
+    (count,) = _COUNT.unpack_from(data, off)
+    off += _COUNT.size
+    entities = {}
+    for _ in range(count):
+        pid, p, off = _unpack_entity(data, off)
+        entities[pid] = p
+    return entities, off
+
+
+def _pack_update(out, pid, fields):
+    mask = 0
+    body = bytearray()
+    if 'x' in fields:
+        mask |= F_X
+        body += _F32.pack(float(fields['x']))
+    if 'y' in fields:
+        mask |= F_Y
+        body += _F32.pack(float(fields['y']))
+    if 'hp' in fields:
+        mask |= F_HP
+        body += _I16.pack(_i16(fields['hp']))
+    if 'max_hp' in fields:
+        mask |= F_MAX_HP
+        body += _I16.pack(_i16(fields['max_hp']))
+    if 'color' in fields:
+        mask |= F_COLOR
+        body += _RGB.pack(*_rgb(fields['color']))
+    if 'name' in fields:
+        mask |= F_NAME
+        name = _name_bytes(fields['name'])
+        body += _U8.pack(len(name)) + name
+    out += _UPD_HEAD.pack(int(pid), mask)
+    out += body
+
+
+def _unpack_update(data, off):
+    pid, mask = _UPD_HEAD.unpack_from(data, off)
+    off += _UPD_HEAD.size
+    fields = {}
+    if mask & F_X:
+        fields['x'] = _F32.unpack_from(data, off)[0]
+        off += _F32.size
+    if mask & F_Y:
+        fields['y'] = _F32.unpack_from(data, off)[0]
+        off += _F32.size
+    if mask & F_HP:
+        fields['hp'] = _I16.unpack_from(data, off)[0]
+        off += _I16.size
+    if mask & F_MAX_HP:
+        fields['max_hp'] = _I16.unpack_from(data, off)[0]
+        off += _I16.size
+    if mask & F_COLOR:
+        fields['color'] = list(_RGB.unpack_from(data, off))
+        off += _RGB.size
+    if mask & F_NAME:
+        n = data[off]
+        off += 1
+        fields['name'] = bytes(data[off:off + n]).decode('utf-8', errors='ignore')
+        off += n
+    return pid, fields, off
+
+
+def encode(msg):
+    """Encode a message dict into a binary payload (without framing).
+
+    Raises ProtocolError when msg has no binary form or a field doesn't
+    fit it, like decode does for payloads.
+    """
+    try:
+        return _encode(msg)
+    except (struct.error, OverflowError, KeyError, TypeError) as e:
+        raise ProtocolError(f"can't encode {msg.get('type')!r}: {e}") from None
+
+
+def _encode(msg):
+    t = TYPE_IDS.get(msg.get('type'))
+    if t is None:
+        raise ProtocolError(f"no binary encoding for {msg.get('type')!r}")
+    if t == POS:
+        return _POS.pack(t, float(msg.get('x', 0.0)), float(msg.get('y', 0.0)))
+    if t == SHOT:
+        owner = msg.get('owner')
+        return _SHOT.pack(t, int(owner) if owner is not None else -1,
+                          float(msg.get('x', 0)), float(msg.get('y', 0)),
+                          float(msg.get('vx', 0)), float(msg.get('vy', 0)),
+                          max(0, min(0xFFFF, int(msg.get('damage', 10)))),
+                          max(0, min(0xFF, int(msg.get('size', 6)))),
+                          *_rgb(msg.get('color')),
+                          int(msg.get('sid') or 0) & 0xFFFFFFFF,
+                          int(msg.get('ref') or 0) & 0xFFFF)
+    if t == HIT:
+        return _HIT.pack(t, int(msg.get('victim', -1)), max(0, min(0xFFFF, int(msg.get('damage', 0)))))
+    if t == HP:
+        return _HP.pack(t, int(msg['id']), _i16(msg['hp']))
+    if t == DESPAWN:
+        return _DESPAWN.pack(t, int(msg['sid']) & 0xFFFFFFFF)
+    if t in (PING, PONG):
+        return _PING.pack(t, float(msg.get('t') or 0.0))
+    if t == INPUT:
+        return _INPUT.pack(t, int(msg.get('seq', 0)) & 0xFFFFFFFF, float(msg.get('dx', 0.0)),
+                           float(msg.get('dy', 0.0)), max(0, min(0xFF, int(msg.get('n', 1)))))
+    if t == ACK:
+        return _ACK.pack(t, int(msg.get('seq', 0)) & 0xFFFFFFFF, float(msg['x']), float(msg['y']))
+    if t == BATCH:
+        # Count, then each message as a length-prefixed binary payload
+        msgs = msg.get('msgs', ())
+        out = bytearray(_BATCH_HEAD.pack(t, len(msgs)))
+        for sub in msgs:
+            payload = encode(sub)
+            out += _LEN.pack(len(payload))
+            out += payload
+        return bytes(out)
+    if t == REVIVE:
+        # Optional respawn position; NaN when absent
+        x = msg.get('x')
+        y = msg.get('y')
+        return _POS.pack(t, float('nan') if x is None else float(x), float('nan') if y is None else float(y))
+    out = bytearray()
+    if t == STATE:
+        out += _STAMP.pack(t, int(msg.get('tick', 0)) & 0xFFFFFFFF, float(msg.get('t', 0.0)))
+        _pack_entities(out, msg.get('players', {}))
+        return bytes(out)
+    # DELTA
+    out += _SEQ.pack(t, int(msg.get('seq', 0)) & 0xFFFFFFFF, int(msg.get('tick', 0)) & 0xFFFFFFFF,
+                     float(msg.get('t', 0.0)))
+    _pack_entities(out, msg.get('join', {}))
+    upd = msg.get('upd', {})
+    out += _COUNT.pack(len(upd))
+    for pid, fields in upd.items():
+        _pack_update(out, pid, fields)
+    leave = msg.get('leave', ())
+    out += _COUNT.pack(len(leave))
+    for pid in leave:
+        out += _ID.pack(int(pid))
+    return bytes(out)
+
+
+def decode(data):
+    """Decode a binary payload back into the same dict shape the JSON protocol uses."""
+    try:
+        t = data[0]
+        name = TYPE_NAMES.get(t)
+        if name is None:
+            raise ProtocolError(f"unknown message type id {t}")
+        if t == POS:
+            _, x, y = _POS.unpack_from(data)
+            return {'type': name, 'x': x, 'y': y}
+        if t == SHOT:
+            _, owner, x, y, vx, vy, dmg, size, r, g, b, sid, ref = _SHOT.unpack_from(data)
+            return {'type': name, 'owner': owner if owner >= 0 else None, 'x': x, 'y': y,
+                    'vx': vx, 'vy': vy, 'damage': dmg, 'size': size, 'color': [r, g, b],
+                    'sid': sid or None, 'ref': ref}
+        if t == HIT:
+            _, victim, dmg = _HIT.unpack_from(data)
+            return {'type': name, 'victim': victim, 'damage': dmg}
+        if t == HP:
+            _, pid, hp = _HP.unpack_from(data)
+            return {'type': name, 'id': pid, 'hp': hp}
+        if t == DESPAWN:
+            return {'type': name, 'sid': _DESPAWN.unpack_from(data)[1]}
+        if t in (PING, PONG):
+            return {'type': name, 't': _PING.unpack_from(data)[1] or None}
+        if t == INPUT:
+            _, seq, dx, dy, n = _INPUT.unpack_from(data)
+            return {'type': name, 'seq': seq, 'dx': dx, 'dy': dy, 'n': n}
+        if t == ACK:
+            _, seq, x, y = _ACK.unpack_from(data)
+            return {'type': name, 'seq': seq, 'x': x, 'y': y}
+        if t == BATCH:
+            _, count = _BATCH_HEAD.unpack_from(data)
+            off = _BATCH_HEAD.size
+            msgs = []
+            for _ in range(count):
+                (size,) = _LEN.unpack_from(data, off)
+                off += _LEN.size
+                if off + size > len(data):
+                    raise ProtocolError('truncated batch')
+                if size and data[off] == BATCH:
+                    raise ProtocolError('nested batch')
+                msgs.append(decode(data[off:off + size]))
+                off += size
+            return {'type': name, 'msgs': msgs}
+        if t == REVIVE:
+            _, x, y = _POS.unpack_from(data)
+            if x != x or y != y:
+                return {'type': name}
+            return {'type': name, 'x': x, 'y': y}
+        if t == STATE:
+            _, tick, ts = _STAMP.unpack_from(data)
+            players, _ = _unpack_entities(data, _STAMP.size)
+            return {'type': name, 'tick': tick, 't': ts, 'players': players}
+        # DELTA
+        _, seq, tick, ts = _SEQ.unpack_from(data)
+        join, off = _unpack_entities(data, _SEQ.size)
+        (count,) = _COUNT.unpack_from(data, off)
+        off += _COUNT.size
+        upd = {}
+        for _ in range(count):
+            pid, fields, off = _unpack_update(data, off)
+            upd[pid] = fields
+        (count,) = _COUNT.unpack_from(data, off)
+        off += _COUNT.size
+        leave = [_ID.unpack_from(data, off + i * _ID.size)[0] for i in range(count)]
+        return {'type': name, 'seq': seq, 'tick': tick, 't': ts, 'join': join, 'upd': upd, 'leave': leave}
+    except (struct.error, IndexError) as e:
+        raise ProtocolError(str(e)) from None
+
+
+def frame(payload):
+    """Length-prefix a payload for the TCP stream."""
+    if len(payload) > MAX_FRAME:
+        raise ProtocolError('frame too large')
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def split_frames(buf):
+    """Split complete length-prefixed frames off buf; return (payloads, rest)."""
+    frames = []
+    off = 0
+    n = len(buf)
+    while n - off >= FRAME_HEADER.size:
+        (size,) = FRAME_HEADER.unpack_from(buf, off)
+        end = off + FRAME_HEADER.size + size
+        if end > n:
+            break
+        frames.append(buf[off + FRAME_HEADER.size:end])
+        off = end
+    return frames, buf[off:]
+
+
+# JSON backend: dumps() returns UTF-8 bytes without a trailing newline and
+# loads() accepts bytes or str. Player dicts are keyed by int ids, which
+# every backend writes as strings like the stdlib does.
+if orjson is not None:
+    JSON_BACKEND = 'orjson'
+
+    def dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+elif msgspec is not None:
+    JSON_BACKEND = 'msgspec'
+    dumps = msgspec.json.Encoder().encode
+    _decoder = msgspec.json.Decoder()
+
+    def loads(data):
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from None
+else:
+    JSON_BACKEND = 'json'
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    loads = json.loads
+
+
+def encode_stream(msg, binary=False):
+    """Bytes for msg on the TCP stream: a binary frame or a JSON line."""
+    if binary:
+        return frame(encode(msg))
+    return dumps(msg) + b'\n'
+
+
+def encode_ws(msg, binary=False):
+    """Payload for msg as one WebSocket frame: bytes (binary) or str (text)."""
+    if binary:
+        return encode(msg)
+    return dumps(msg).decode('utf-8')
+
+
+def unbatch(msg):
+    """Messages carried by a 'batch', minus nested batches and non-messages."""
+    msgs = msg.get('msgs')
+    if not isinstance(msgs, list):
+        return []
+    return [m for m in msgs[:MAX_BATCH] if isinstance(m, dict) and m.get('type') != 'batch']
+
+
+def decode_ws(data):
+    """Decode a WebSocket frame: bytes are binary messages, str is JSON."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return decode(data)
+    return loads(data)
+
+
+def redirect_url(url, msg):
+    """Where a 'redirect' sends a client connected to url: its url, or the same host on its port."""
+    if msg.get('url'):
+        return msg['url']
+    parts = urllib.parse.urlsplit(url)
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    return urllib.parse.urlunsplit(parts._replace(netloc=f"{host}:{int(msg['port'])}"))
+
+
+# Typed message structs. Each is a namedtuple whose parse(msg) builds it
+# from a decoded dict, coercing every field and filling in defaults;
+# malformed values raise ValueError or TypeError.
+STRUCTS = {}
+
+
+def _message(type_name, *spec):
+    """Define the struct for type_name from (field, converter, default) triples."""
+    cls = collections.namedtuple(type_name.title(), [field for field, _, _ in spec])
+
+    def parse(msg):
+        values = []
+        for field, conv, default in spec:
+            v = msg.get(field)
+            values.append(default if v is None else conv(v))
+        return cls(*values)
+
+    def to_msg(self):
+        out = {'type': type_name}
+        for field, v in zip(cls._fields, self):
+            if v is not None:
+                out[field] = v
+        return out
+
+    cls.type = type_name
+    cls.parse = staticmethod(parse)
+    cls.to_msg = to_msg
+    STRUCTS[type_name] = cls
+    return cls
+
+
+Hello = _message('hello', ('name', str, None), ('x', _finite, 100.0), ('y', _finite, 100.0),
+                 ('color', _rgb, None), ('delta', bool, False), ('proto', str, None),
+                 ('room', str, None))
+Welcome = _message('welcome', ('id', int, None), ('delta', bool, False), ('proto', str, None),
+                   ('auth_shots', bool, False), ('room', str, None))
+# Sent instead of a welcome by a cluster worker that doesn't host the room:
+# reconnect to url (or the same host on port) and say hello for room again
+Redirect = _message('redirect', ('room', str, None), ('port', int, None), ('url', str, None))
+Pos = _message('pos', ('x', _finite, None), ('y', _finite, None))
+Shot = _message('shot', ('owner', int, None), ('x', _finite, 0.0), ('y', _finite, 0.0),
+                ('vx', _finite, 0.0), ('vy', _finite, 0.0), ('damage', _between(0, MAX_DAMAGE), 10),
+                ('size', _between(1, MAX_SHOT_SIZE), 6),
+                ('color', _rgb, (255, 90, 90)), ('sid', int, None), ('ref', int, 0))
+Hit = _message('hit', ('victim', int, None), ('damage', _damage, 0))
+Revive = _message('revive', ('x', _finite, None), ('y', _finite, None))
+# Whoever receives a ping answers with a pong echoing its 't'
+Ping = _message('ping', ('t', _finite, None))
+Pong = _message('pong', ('t', _finite, None))
+Hp = _message('hp', ('id', int, None), ('hp', int, None))
+Despawn = _message('despawn', ('sid', int, None))
+Input = _message('input', ('seq', int, 0), ('dx', _finite, 0.0), ('dy', _finite, 0.0), ('n', int, 1))
+Ack = _message('ack', ('seq', int, 0), ('x', _finite, None), ('y', _finite, None))
+# Snapshots carry the server tick and time (seconds) they were taken at
+State = _message('state', ('tick', int, None), ('t', _finite, None), ('players', dict, {}))
+Delta = _message('delta', ('seq', int, 0), ('tick', int, None), ('t', _finite, None), ('join', dict, {}),
+                 ('upd', dict, {}), ('leave', list, ()))
+
+
+class Dispatcher:
+    """Table-driven routing of decoded messages to handlers.
+
+    Handlers are registered per type with on() and called as
+    handler(ctx, struct), where struct is the message parsed into its
+    typed struct (or the raw dict for types without one). Unknown types
+    are ignored.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, *types):
+        def register(fn):
+            for t in types:
+                self.handlers[t] = fn
+            return fn
+        return register
+
+    def dispatch(self, ctx, msg):
+        t = msg.get('type')
+        handler = self.handlers.get(t)
+        if handler is None:
+            return None
+        struct = STRUCTS.get(t)
+        return handler(ctx, struct.parse(msg) if struct is not None else msg)
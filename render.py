@@ -0,0 +1,139 @@
+"""Rendering caches for the pygame client."""
+import collections
+
+import pygame
+
+
+class TextCache:
+    """Fonts loaded once per (name, size) and rendered text kept in an LRU.
+
+    pygame.font.SysFont walks the system font list on every call, which
+    is slow on Android, and re-rendering unchanged strings every frame is
+    wasted work; both are done once here and reused.
+    """
+
+    def __init__(self, max_surfaces=256):
+        self.fonts = {}  # (name, size) -> pygame.font.Font
+        self.surfaces = collections.OrderedDict()  # (text, color, size, name) -> Surface
+        self.max_surfaces = max_surfaces
+
+    def font(self, size, name=None):
+        key = (name, size)
+        font = self.fonts.get(key)
+        if font is None:
+            font = self.fonts[key] = pygame.font.SysFont(name, size)
+        return font
+
+    def render(self, text, color, size, name=None):
+        """Antialiased surface for text, rendered only on first use."""
+        key = (text, tuple(color), size, name)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.surfaces.move_to_end(key)
+            return surf
+        surf = self.font(size, name).render(text, True, color)
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.max_surfaces:
+            self.surfaces.popitem(last=False)
+        return surf
+
+
+class DirtyRenderer:
+    """Redraws only what moved over a cached static background.
+
+    Static content (floor, walls, HUD frames) is composed once into a
+    converted background surface. Each frame begin() paints it back over
+    last frame's dirty rects, the caller draws the moving things and
+    passes their rects to add(), and present() pushes only those regions,
+    old and new, to the display. invalidate() asks for one full repaint
+    and flip, for menus and full-screen overlays.
+    """
+
+    def __init__(self, screen, background):
+        self.screen = screen
+        self.bounds = screen.get_rect()
+        self.background = background.convert()
+        self.prev = []   # rects drawn last frame, to be erased
+        self.dirty = []  # rects drawn this frame
+        self.repaint = True  # next begin() restores the whole background
+        self.flip = True     # next present() pushes the whole window
+
+    def invalidate(self):
+        self.repaint = True
+        self.flip = True
+
+    def begin(self):
+        screen = self.screen
+        if self.repaint:
+            screen.blit(self.background, (0, 0))
+            self.repaint = False
+            self.flip = True
+        else:
+            for r in self.prev:
+                screen.blit(self.background, r, r)
+
+    def add(self, rect):
+        if rect:
+            rect = rect.clip(self.bounds)
+            if rect:
+                self.dirty.append(rect)
+
+    def extend(self, rects):
+        for rect in rects:
+            self.add(rect)
+
+    def present(self):
+        if self.flip:
+            pygame.display.flip()
+            self.flip = False
+        else:
+            pygame.display.update(self.prev + self.dirty)
+        self.prev, self.dirty = self.dirty, []
+
+
+class SpriteCache:
+    """Entity sprites pre-rendered once per look and reused every frame.
+
+    Drawing shapes costs a rasterization call per entity per frame; with
+    sprites a whole layer goes to the screen in one Surface.blits() call.
+    Callers quantize anything continuous (like health) so the number of
+    distinct sprites stays small.
+    """
+
+    def __init__(self):
+        self.surfaces = {}
+
+    def box(self, color, w, h):
+        key = ('box', color, w, h)
+        surf = self.surfaces.get(key)
+        if surf is None:
+            surf = pygame.Surface((w, h)).convert()
+            surf.fill(color)
+            self.surfaces[key] = surf
+        return surf
+
+    def bar(self, w, h, fill, color, back):
+        """A w x h bar whose first `fill` pixels are color over back."""
+        key = ('bar', w, h, fill, color, back)
+        surf = self.surfaces.get(key)
+        if surf is None:
+            surf = pygame.Surface((w, h)).convert()
+            surf.fill(back)
+            if fill > 0:
+                surf.fill(color, (0, 0, fill, h))
+            self.surfaces[key] = surf
+        return surf
+
+    def disc(self, color, radius):
+        """Filled circle, blitted at (x - radius, y - radius) to center it on (x, y)."""
+        key = ('disc', color, radius)
+        surf = self.surfaces.get(key)
+        if surf is None:
+            # Colorkeyed and RLE-encoded: much cheaper to blit than per-pixel alpha
+            key_color = (0, 0, 0) if tuple(color) != (0, 0, 0) else (255, 255, 255)
+            surf = pygame.Surface((radius * 2, radius * 2)).convert()
+            surf.fill(key_color)
+            pygame.draw.circle(surf, color, (radius, radius), radius)
+            surf.set_colorkey(key_color, pygame.RLEACCEL)
+            self.surfaces[key] = surf
+        return surf
@@ -0,0 +1,142 @@
+"""Rooms: independent matches hosted by one server process.
+
+Each room has its own player table, interest manager, projectiles and tick
+counter, and messages only ever go to the room's own clients, so a server
+hosting many small matches pays per room rather than for everyone
+connected. A client names the room it wants in its hello or is placed in
+the default one; a full room overflows into name-2, name-3 and so on,
+which are created on demand and dropped once empty.
+
+Room names also decide placement when several worker processes share the
+load (cluster.py): owner() maps a name to a worker the same way in every
+process, and pick() takes the occupancy of rooms hosted elsewhere into
+account so overflow is decided for the whole cluster.
+"""
+import zlib
+
+import mapdata
+import spatial
+try:
+    import projectiles
+except ImportError:
+    projectiles = None
+
+DEFAULT_ROOM = 'main'
+MAX_PLAYERS = 16  # players per room before new joiners overflow
+MAX_NAME = 32
+
+
+def clean_name(name):
+    """Room name from a hello, or None for the default room."""
+    if not isinstance(name, str):
+        return None
+    name = ''.join(c for c in name.strip()[:MAX_NAME] if c.isprintable())
+    return name or None
+
+
+def split_name(name):
+    """(base, n) for an overflow room name like 'main-3'; n is 1 for a base name."""
+    base, sep, suffix = name.rpartition('-')
+    if sep and base and suffix.isdigit() and suffix[0] != '0' and int(suffix) >= 2:
+        return base, int(suffix)
+    return name, 1
+
+
+def owner(name, workers):
+    """Index of the worker that hosts room name.
+
+    crc32 rather than hash(): str hashes are salted per process.
+    """
+    return zlib.crc32(name.encode()) % workers
+
+
+class Room:
+    def __init__(self, name, cap=MAX_PLAYERS, aoi_radius=1000.0, aoi_hysteresis=0.0, auth_shots=False):
+        self.name = name
+        self.cap = cap
+        self.tick = 0  # ticks simulated since the room was created; snapshots are stamped with it
+        self.clients = {}  # id -> server connection
+        self.players = {}  # id -> {name, x, y, color, hp, max_hp, invuln_until}
+        self.interest = spatial.InterestManager(aoi_radius, aoi_hysteresis)
+        self.shots = None  # projectiles.ProjectileSystem with server-authoritative shots
+        if auth_shots and projectiles is not None:
+            self.shots = projectiles.ProjectileSystem(mapdata.WIDTH, mapdata.HEIGHT, mapdata.WALLS,
+                                                      target_size=mapdata.PLAYER_SIZE)
+
+    def __len__(self):
+        return len(self.players)
+
+    @property
+    def full(self):
+        return len(self.players) >= self.cap
+
+    def join(self, cid, conn, player):
+        self.clients[cid] = conn
+        self.players[cid] = player
+
+    def leave(self, cid):
+        self.clients.pop(cid, None)
+        self.players.pop(cid, None)
+        self.interest.remove(cid)
+
+    def connections(self, ids):
+        clients = self.clients
+        return [clients[i] for i in ids if i in clients]
+
+
+class Rooms:
+    """Every room on a server, and the rules for placing a joining client."""
+
+    def __init__(self, cap=MAX_PLAYERS, aoi_radius=1000.0, aoi_hysteresis=0.0, auth_shots=False):
+        self.cap = cap
+        self.aoi_radius = aoi_radius
+        self.aoi_hysteresis = aoi_hysteresis
+        self.auth_shots = auth_shots
+        self.rooms = {}  # name -> Room
+
+    def __iter__(self):
+        return iter(list(self.rooms.values()))
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def get(self, name):
+        return self.rooms.get(name)
+
+    def pick(self, name=None, occupancy=None):
+        """Name of the room for a client asking for name: the first of name, name-2, ... with space.
+
+        An overflow name ('main-3') continues its own sequence. occupancy
+        maps rooms hosted by other processes to their player counts;
+        rooms in neither place are empty.
+        """
+        base, n = split_name(clean_name(name) or DEFAULT_ROOM)
+        while True:
+            candidate = base if n == 1 else f'{base}-{n}'
+            room = self.rooms.get(candidate)
+            if room is not None:
+                if not room.full:
+                    return candidate
+            elif occupancy is None or occupancy.get(candidate, 0) < self.cap:
+                return candidate
+            n += 1
+
+    def open(self, name):
+        """Room called name, created if it doesn't exist yet."""
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(name, self.cap, self.aoi_radius,
+                                           self.aoi_hysteresis, self.auth_shots)
+        return room
+
+    def assign(self, name=None):
+        """Room for a client asking for name, created on demand."""
+        return self.open(self.pick(name))
+
+    def release(self, room):
+        """Drop room once its last client has left."""
+        if not room.clients and not room.players and self.rooms.get(room.name) is room:
+            del self.rooms[room.name]
+
+    def player_count(self):
+        return sum(len(room) for room in self.rooms.values())
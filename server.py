@@ -1,165 +1,626 @@
+import collections
+import selectors
 import socket
-import threading
-import json
 import time
 import random
 
+import mapdata
+import metrics
+import movement
+import protocol
+import rooms
+import snapshot
+import spatial
+try:
+    import projectiles
+except ImportError:
+    projectiles = None
+
 HOST = '0.0.0.0'
 PORT = 12345
-BROADCAST_FPS = 20  # 20 updates per second
+TICK_RATE = 20  # simulation ticks per second: inputs, projectiles
+# Snapshots per second. Clients interpolate between stamped snapshots, so
+# this can stay well below the tick rate. Each client gets a rate between
+# MIN_BROADCAST_FPS and BROADCAST_FPS picked from its RTT and backlog.
+BROADCAST_FPS = 10
+MIN_BROADCAST_FPS = 2
+PING_INTERVAL = 1.0  # seconds between RTT probes to each client
+CLIENT_TIMEOUT = 15.0  # seconds without data before a client is dropped
+RECV_SIZE = 4096
+MAX_INBOX = 256  # queued inputs per client; the oldest are dropped beyond this
+# Outbound backpressure: a client whose unsent backlog stays above the
+# high-water mark for SLOW_CLIENT_GRACE seconds is dropped, and one that
+# reaches MAX_BACKLOG is dropped at once.
+HIGH_WATER = 256 * 1024
+MAX_BACKLOG = 1024 * 1024
+SLOW_CLIENT_GRACE = 3.0
+# Area of interest: players only receive entities and shots within this
+# distance. The default covers the whole 800x600 map; shrink it for bigger maps.
+AOI_RADIUS = 1000.0
+AOI_HYSTERESIS = 100.0  # extra distance before a visible entity is dropped
+# Players per room: each room is a separate match with its own snapshots,
+# and joiners past the cap overflow into a new room
+ROOM_CAP = rooms.MAX_PLAYERS
+SHOT_LIFE = 2.0  # seconds a bullet lives on the client, bounds its travel
+# Server-authoritative shots: the server simulates every projectile and
+# decides hits itself, ignoring client 'hit' reports (requires numpy)
+AUTHORITATIVE_SHOTS = False
+PROJECTILE_HZ = 60  # simulation steps per second, matches the client frame rate
+# Server-authoritative movement: positions only change through 'input'
+# commands (plus spawn and revive); raw 'pos' updates are ignored
+AUTHORITATIVE_MOVEMENT = False
+# Port for Prometheus scrapes (GET /metrics), served from the same event
+# loop; None to disable
+METRICS_PORT = None
 
 next_id = 1
-clients = {}   # id -> socket
-players = {}   # id -> {name, x, y, color, hp, max_hp}
-lock = threading.Lock()
+clients = {}   # id -> Connection, across every room
+all_rooms = rooms.Rooms(ROOM_CAP, AOI_RADIUS, AOI_HYSTERESIS)
+sel = selectors.DefaultSelector()
+stats = metrics.ServerMetrics()
+stats_listener = None  # metrics.StatsListener when METRICS_PORT is set
+stats.registry.gauge('game_clients', 'Connected clients that sent hello.', lambda: len(clients))
+stats.registry.gauge('game_players', 'Players across all rooms.', lambda: all_rooms.player_count())
+stats.registry.gauge('game_rooms', 'Rooms with at least one player.', lambda: len(all_rooms))
+stats.registry.gauge('game_outbound_backlog_bytes', 'Unsent bytes per client: the largest and the total.',
+                     lambda: outbound_backlog(), ('stat',))
+
+
+class Connection:
+    """State of one TCP client served by the event loop."""
 
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.cid = None
+        self.room = None  # rooms.Room joined through hello
+        self.inbuf = b""
+        self.outq = collections.deque()  # encoded messages waiting for the next flush
+        self.queued = 0  # bytes in outq
+        self.snapshot = None  # newest encoded state snapshot; replaces older ones
+        self.outbuf = bytearray()  # bytes handed to send() but not yet accepted
+        self.over_since = None  # when the backlog went above HIGH_WATER
+        self.queued_at = None  # when the oldest data in outq/snapshot was queued
+        self.outbuf_at = None  # same, for the data now in outbuf
+        self.last_recv = time.monotonic()
+        self.inbox = collections.deque(maxlen=MAX_INBOX)  # inputs waiting for the next tick
+        self.pos = None  # newest 'pos' input; older ones in the same tick are superseded
+        self.events = selectors.EVENT_READ
+        self.delta = None  # snapshot.DeltaTracker when the client asked for deltas
+        self.rate = snapshot.SnapshotRate(MIN_BROADCAST_FPS, BROADCAST_FPS, TICK_RATE)
+        self.last_ping = 0.0
+        self.input_seq = 0  # last movement command applied
+        self.acked_seq = 0  # last one acknowledged to the client
+        self.budget = movement.StepBudget()
+        self.binary = False  # length-prefixed binary frames negotiated in hello
+        self.closed = False
 
-def send_line(sock, obj):
+
+def send_line(conn, obj):
     try:
-        line = json.dumps(obj) + "\n"
-        sock.sendall(line.encode('utf-8'))
+        data = protocol.encode_stream(obj, conn.binary)
     except Exception:
-        pass
+        return
+    stats.sent(obj.get('type'), len(data))
+    queue_bytes(conn, data)
+
+
+def queue_bytes(conn, data):
+    if conn.closed:
+        return
+    conn.outq.append(data)
+    conn.queued += len(data)
+    if conn.queued_at is None:
+        conn.queued_at = time.monotonic()
+    if backlog(conn) > MAX_BACKLOG:
+        close_connection(conn, 'backlog')
+
+
+def queue_snapshot(conn, data):
+    # Only the newest snapshot is worth sending; an unsent older one is dropped
+    if conn.closed:
+        return
+    conn.snapshot = data
+    if conn.queued_at is None:
+        conn.queued_at = time.monotonic()
+    if backlog(conn) > MAX_BACKLOG:
+        close_connection(conn, 'backlog')
+
+
+def backlog(conn):
+    return len(conn.outbuf) + conn.queued + (len(conn.snapshot) if conn.snapshot else 0)
+
+
+def flush(conn):
+    """Write everything queued for conn with a single non-blocking send."""
+    if conn.closed:
+        return
+    # Queued messages join the write buffer only once the socket has
+    # drained, so a slow client's backlog stays coalescable
+    if not conn.outbuf and (conn.outq or conn.snapshot is not None):
+        if conn.snapshot is not None:
+            conn.outq.append(conn.snapshot)
+            conn.snapshot = None
+        conn.outbuf = bytearray(b"".join(conn.outq))
+        conn.outq.clear()
+        conn.queued = 0
+        conn.outbuf_at, conn.queued_at = conn.queued_at, None
+    if conn.outbuf:
+        try:
+            sent = conn.sock.send(conn.outbuf)
+            del conn.outbuf[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except Exception:
+            close_connection(conn)
+            return
+        if not conn.outbuf and conn.outbuf_at is not None:
+            stats.send_latency.observe(time.monotonic() - conn.outbuf_at)
+            conn.outbuf_at = None
+    # Only ask for write readiness while there is something left to send
+    events = selectors.EVENT_READ
+    if conn.outbuf:
+        events |= selectors.EVENT_WRITE
+    if events != conn.events:
+        conn.events = events
+        try:
+            sel.modify(conn.sock, events, conn)
+        except Exception:
+            pass
+
+
+def all_connections():
+    return [key.data for key in list(sel.get_map().values()) if isinstance(key.data, Connection)]
+
+
+def outbound_backlog():
+    sizes = [backlog(conn) for conn in all_connections()]
+    return {('max',): max(sizes, default=0), ('sum',): sum(sizes)}
 
 
-def handle_client(sock, addr):
+def flush_all(now):
+    for conn in all_connections():
+        flush(conn)
+        if conn.closed:
+            continue
+        if backlog(conn) > HIGH_WATER:
+            if conn.over_since is None:
+                conn.over_since = now
+            elif now - conn.over_since > SLOW_CLIENT_GRACE:
+                close_connection(conn, 'slow')
+        else:
+            conn.over_since = None
+
+
+def broadcast_line(obj, targets, queue=queue_bytes):
+    # Encode once per wire format and hand the same bytes to every connection
+    encoded = {}
+    counts = {}  # wire format -> connections it was queued for
+    for conn in targets:
+        data = encoded.get(conn.binary)
+        if data is None:
+            try:
+                data = encoded[conn.binary] = protocol.encode_stream(obj, conn.binary)
+            except Exception:
+                continue
+        queue(conn, data)
+        counts[conn.binary] = counts.get(conn.binary, 0) + 1
+    for binary, n in counts.items():
+        stats.sent(obj.get('type'), len(encoded[binary]), n)
+
+
+def apply_damage(room, victim, dmg):
+    vp = room.players.get(victim)
+    if vp is None:
+        return
+    # Ignore damage if victim is invulnerable (e.g., just revived)
+    if time.time() >= vp.get('invuln_until', 0):
+        vp['hp'] = max(0, min(vp.get('max_hp', 100), vp.get('hp', 100) - dmg))
+    broadcast_line({'type': 'hp', 'id': victim, 'hp': vp['hp']},
+                   room.connections(room.interest.watchers_of(victim)))
+
+
+dispatcher = protocol.Dispatcher()
+# Handled as soon as they are read: hello decides how the rest of the
+# stream is framed and ping/pong measure latency. Everything else is game
+# input and waits in the connection's inbox for the next tick.
+IMMEDIATE = ('hello', 'ping', 'pong')
+
+
+def handle_message(conn, msg):
+    t = msg.get('type')
+    if t == 'batch':
+        for sub in protocol.unbatch(msg):
+            try:
+                handle_message(conn, sub)
+            except Exception:
+                pass
+        return
+    if t in IMMEDIATE:
+        dispatcher.dispatch(conn, msg)
+    elif conn.cid is None:
+        return
+    elif t == 'pos':
+        conn.pos = msg
+    else:
+        conn.inbox.append(msg)
+
+
+def apply_inputs():
+    """Drain every inbox so the tick simulates and snapshots one consistent state."""
+    for conn in list(clients.values()):
+        if conn.pos is not None:
+            msg, conn.pos = conn.pos, None
+            try:
+                dispatcher.dispatch(conn, msg)
+            except Exception:
+                pass
+        inbox = conn.inbox
+        while inbox and not conn.closed:
+            try:
+                dispatcher.dispatch(conn, inbox.popleft())
+            except Exception:
+                pass
+
+
+@dispatcher.on('hello')
+def on_hello(conn, m):
     global next_id
-    sock.settimeout(15)
-    cid = None
-    buf = ""
+    if conn.cid is not None:
+        return
+    cid = next_id
+    next_id += 1
+    conn.cid = cid
+    clients[cid] = conn
+    room = conn.room = all_rooms.assign(m.room)
+    color = [random.randint(50, 255) for _ in range(3)]
+    room.join(cid, conn, {
+        'name': m.name if m.name is not None else f'Player{cid}',
+        'x': max(0.0, min(m.x, mapdata.WIDTH - mapdata.PLAYER_SIZE)),
+        'y': max(0.0, min(m.y, mapdata.HEIGHT - mapdata.PLAYER_SIZE)),
+        'color': color,
+        'hp': 100,
+        'max_hp': 100,
+        'invuln_until': 0.0,
+    })
+    welcome = {'type': 'welcome', 'id': cid, 'room': room.name}
+    if m.delta:
+        conn.delta = snapshot.DeltaTracker()
+        welcome['delta'] = True
+    binary = m.proto == protocol.PROTO_BIN
+    if binary:
+        welcome['proto'] = protocol.PROTO_BIN
+    if room.shots is not None:
+        welcome['auth_shots'] = True
+    # The welcome itself is always JSON; both directions switch after it
+    send_line(conn, welcome)
+    conn.binary = binary
+
+
+@dispatcher.on('pos')
+def on_pos(conn, m):
+    if AUTHORITATIVE_MOVEMENT:
+        return
+    p = conn.room.players.get(conn.cid)
+    if p:
+        if m.x is not None:
+            p['x'] = m.x
+        if m.y is not None:
+            p['y'] = m.y
+
+
+@dispatcher.on('input')
+def on_input(conn, m):
+    p = conn.room.players.get(conn.cid)
+    if p is None or m.seq <= conn.input_seq:
+        return
+    conn.input_seq = m.seq
+    dx, dy = conn.budget.command(m.dx, m.dy, m.n, time.monotonic())
+    p['x'], p['y'] = movement.apply(p['x'], p['y'], dx, dy)
+
+
+@dispatcher.on('shot')
+def on_shot(conn, m):
+    # Send shot event to clients whose area of interest its path crosses
+    cid = conn.cid
+    room = conn.room
+    shot = m._replace(owner=cid, sid=None, ref=None).to_msg()
+    targets = room.interest.shot_targets(m.x, m.y, m.vx, m.vy, SHOT_LIFE)
+    if room.shots is not None:
+        # The shooter also gets the spawn so it can tag its local bullet
+        # (matched by 'ref') with the server id used by 'despawn'
+        shot['sid'] = room.shots.spawn(m.x, m.y, m.vx, m.vy, m.damage,
+                                       owner=cid, size=m.size, life=SHOT_LIFE)
+        shot['ref'] = m.ref
+    else:
+        targets.discard(cid)
+    broadcast_line(shot, room.connections(targets))
+
+
+@dispatcher.on('hit')
+def on_hit(conn, m):
+    # Reduce victim hp and send hp update to everyone who can see the victim
+    if conn.room.shots is not None:
+        return  # the server decides hits itself
+    if m.victim is not None:
+        apply_damage(conn.room, m.victim, m.damage)
+
+
+@dispatcher.on('revive')
+def on_revive(conn, m):
+    # Restore player's hp to max and send hp update to everyone who can see it
+    cid = conn.cid
+    room = conn.room
+    p = room.players.get(cid)
+    if p:
+        p['hp'] = p.get('max_hp', 100)
+        # Set short invulnerability window
+        p['invuln_until'] = time.time() + 1.5
+        if m.x is not None and m.y is not None:
+            # Respawn point picked by the client, kept inside the map
+            p['x'] = max(0.0, min(m.x, mapdata.WIDTH - mapdata.PLAYER_SIZE))
+            p['y'] = max(0.0, min(m.y, mapdata.HEIGHT - mapdata.PLAYER_SIZE))
+        broadcast_line({'type': 'hp', 'id': cid, 'hp': p['hp']},
+                       room.connections(room.interest.watchers_of(cid)))
+
+
+@dispatcher.on('ping')
+def on_ping(conn, m):
+    send_line(conn, {'type': 'pong', 't': m.t})
+
+
+@dispatcher.on('pong')
+def on_pong(conn, m):
+    # Echo of our own ping; the RTT includes time spent in our send queue
+    if m.t:
+        conn.rate.on_rtt(time.monotonic() - m.t)
+
+
+def ping_clients(now):
+    for conn in list(clients.values()):
+        if now - conn.last_ping >= PING_INTERVAL:
+            conn.last_ping = now
+            send_line(conn, {'type': 'ping', 't': now})
+
+
+def handle_read(conn):
     try:
-        while True:
-            data = sock.recv(4096)
-            if not data:
-                break
-            buf += data.decode('utf-8', errors='ignore')
-            while '\n' in buf:
-                line, buf = buf.split('\n', 1)
-                if not line.strip():
-                    continue
-                try:
-                    msg = json.loads(line)
-                except Exception:
-                    continue
-                t = msg.get('type')
-                if t == 'hello':
-                    with lock:
-                        cid = next_id
-                        next_id += 1
-                        clients[cid] = sock
-                        color = [random.randint(50, 255) for _ in range(3)]
-                        players[cid] = {
-                            'name': msg.get('name', f'Player{cid}'),
-                            'x': float(msg.get('x', 100)),
-                            'y': float(msg.get('y', 100)),
-                            'color': color,
-                            'hp': 100,
-                            'max_hp': 100,
-                            'invuln_until': 0.0,
-                        }
-                    send_line(sock, {'type': 'welcome', 'id': cid})
-                elif t == 'pos' and cid is not None:
-                    with lock:
-                        p = players.get(cid)
-                        if p:
-                            p['x'] = float(msg.get('x', p['x']))
-                            p['y'] = float(msg.get('y', p['y']))
-                elif t == 'shot' and cid is not None:
-                    # Broadcast shot event to all clients
-                    shot = {
-                        'type': 'shot',
-                        'owner': cid,
-                        'x': float(msg.get('x', 0)),
-                        'y': float(msg.get('y', 0)),
-                        'vx': float(msg.get('vx', 0)),
-                        'vy': float(msg.get('vy', 0)),
-                        'damage': int(msg.get('damage', 10)),
-                        'size': int(msg.get('size', 6)),
-                        'color': msg.get('color', [255, 90, 90])
-                    }
-                    with lock:
-                        targets = list(clients.values())
-                    for s in targets:
-                        send_line(s, shot)
-                elif t == 'hit' and cid is not None:
-                    # Reduce victim hp and broadcast hp update
-                    victim = int(msg.get('victim')) if 'victim' in msg else None
-                    dmg = int(msg.get('damage', 0))
-                    if victim is not None:
-                        with lock:
-                            vp = players.get(victim)
-                            if vp:
-                                # Ignore damage if victim is invulnerable (e.g., just revived)
-                                if time.time() >= vp.get('invuln_until', 0):
-                                    vp['hp'] = max(0, vp.get('hp', 100) - dmg)
-                                hp_msg = {'type': 'hp', 'id': victim, 'hp': vp['hp']}
-                                targets = list(clients.values())
-                        for s in targets:
-                            send_line(s, hp_msg)
-                elif t == 'revive' and cid is not None:
-                    # Restore player's hp to max and broadcast hp update
-                    with lock:
-                        p = players.get(cid)
-                        if p:
-                            p['hp'] = p.get('max_hp', 100)
-                            # Set short invulnerability window
-                            p['invuln_until'] = time.time() + 1.5
-                            hp_msg = {'type': 'hp', 'id': cid, 'hp': p['hp']}
-                            targets = list(clients.values())
-                    for s in targets:
-                        send_line(s, hp_msg)
-                elif t == 'ping':
-                    send_line(sock, {'type': 'pong'})
+        data = conn.sock.recv(RECV_SIZE)
+    except (BlockingIOError, InterruptedError):
+        return
     except Exception:
-        pass
-    finally:
-        with lock:
-            if cid in clients:
+        close_connection(conn)
+        return
+    if not data:
+        close_connection(conn)
+        return
+    conn.last_recv = time.monotonic()
+    conn.inbuf += data
+    while conn.inbuf and not conn.closed:
+        if conn.binary:
+            frames, conn.inbuf = protocol.split_frames(conn.inbuf)
+            for payload in frames:
                 try:
-                    del clients[cid]
-                except Exception:
-                    pass
-            if cid in players:
-                try:
-                    del players[cid]
+                    msg = protocol.decode(payload)
+                    stats.received(msg.get('type'), len(payload))
+                    handle_message(conn, msg)
                 except Exception:
                     pass
+            if len(conn.inbuf) >= protocol.FRAME_HEADER.size and \
+                    protocol.FRAME_HEADER.unpack_from(conn.inbuf)[0] > protocol.MAX_FRAME:
+                close_connection(conn, 'oversize')
+            return
+        if b'\n' not in conn.inbuf:
+            return
+        line, conn.inbuf = conn.inbuf.split(b'\n', 1)
+        if not line.strip():
+            continue
         try:
-            sock.close()
+            msg = protocol.loads(line)
+        except Exception:
+            continue
+        # A hello may switch the rest of the buffer over to binary frames
+        try:
+            stats.received(msg.get('type'), len(line) + 1)
+            handle_message(conn, msg)
         except Exception:
             pass
 
 
-def broadcast_loop():
-    interval = 1.0 / BROADCAST_FPS
+def accept_clients(srv):
     while True:
-        time.sleep(interval)
-        with lock:
-            state = {
-                'type': 'state',
-                'players': players
-            }
-            targets = list(clients.values())
-        for s in targets:
-            send_line(s, state)
+        try:
+            sock, addr = srv.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = Connection(sock, addr)
+        sel.register(sock, selectors.EVENT_READ, conn)
+
+
+def close_connection(conn, reason=None):
+    # reason is set when the server drops the client on purpose
+    if conn.closed:
+        return
+    conn.closed = True
+    if reason is not None:
+        stats.drop(reason)
+    try:
+        sel.unregister(conn.sock)
+    except Exception:
+        pass
+    try:
+        conn.sock.close()
+    except Exception:
+        pass
+    if conn.cid is not None:
+        clients.pop(conn.cid, None)
+    if conn.room is not None:
+        conn.room.leave(conn.cid)
+        all_rooms.release(conn.room)
+
+
+def step_projectiles(room, dt):
+    shots = room.shots
+    if shots is None or shots.count == 0:
+        return
+    players = room.players
+    ids = list(players)
+    xs = [players[pid]['x'] for pid in ids]
+    ys = [players[pid]['y'] for pid in ids]
+    steps = max(1, round(dt * PROJECTILE_HZ))
+    for _ in range(steps):
+        sids, victims, damage, _owners = shots.step(dt / steps, ids, xs, ys)
+        for sid, victim, dmg in zip(sids.tolist(), victims.tolist(), damage.tolist()):
+            # Walls and expiry play out the same on every client; only
+            # player hits need an explicit despawn
+            broadcast_line({'type': 'despawn', 'sid': sid},
+                           room.connections(room.interest.watchers_of(victim)))
+            apply_damage(room, victim, dmg)
+
+
+def broadcast_state(room):
+    # A client whose last snapshot is still unsent is congested and gets
+    # its rate cut; the new snapshot replaces the stale one
+    tick = room.tick
+    due = [conn for conn in list(room.clients.values())
+           if conn.rate.due(tick, conn.snapshot is not None or bool(conn.outbuf))]
+    if not due:
+        return
+    started = time.perf_counter()
+    players = room.players
+    interest = room.interest
+    stamp = {'tick': tick, 't': round(tick / TICK_RATE, 3)}
+    interest.update(players)
+    groups = {}  # visible set -> full-state connections that share it
+    view = None
+    for conn in due:
+        if conn.input_seq != conn.acked_seq:
+            # Tell the client where its movement commands left it so it can
+            # replay the ones still in flight on top
+            p = players.get(conn.cid)
+            if p is not None:
+                conn.acked_seq = conn.input_seq
+                send_line(conn, {'type': 'ack', 'seq': conn.input_seq, 'x': p['x'], 'y': p['y']})
+        seen = interest.visible_to(conn.cid)
+        if conn.delta is None:
+            groups.setdefault(frozenset(seen), []).append(conn)
+            continue
+        if conn.snapshot is not None:
+            # The previous delta hasn't gone out yet; skipping this tick lets
+            # the next delta cover both instead of queueing another one
+            continue
+        if view is None:
+            view = snapshot.public_view(players)
+        # Idle ticks produce no delta and nothing is sent
+        msg = conn.delta.build(spatial.filter_view(view, seen), exclude=conn.cid)
+        if msg is not None:
+            msg.update(stamp)
+            try:
+                data = protocol.encode_stream(msg, conn.binary)
+            except Exception:
+                continue
+            stats.sent('delta', len(data))
+            queue_snapshot(conn, data)
+    for seen, conns in groups.items():
+        state = {
+            'type': 'state',
+            **stamp,
+            'players': {pid: players[pid] for pid in seen if pid in players}
+        }
+        broadcast_line(state, conns, queue=queue_snapshot)
+    stats.snapshot.observe(time.perf_counter() - started)
+
+
+def drop_idle_clients(now):
+    for conn in all_connections():
+        if now - conn.last_recv > CLIENT_TIMEOUT:
+            close_connection(conn, 'idle')
+    if stats_listener is not None:
+        stats_listener.expire(now)
+
+
+def tick_rooms(dt):
+    # Rooms never see each other's players, so each one is simulated and
+    # snapshotted on its own
+    for room in all_rooms:
+        room.tick += 1
+        try:
+            step_projectiles(room, dt)
+            broadcast_state(room)
+        except Exception as e:
+            print(f"room {room.name!r} tick failed: {e!r}")
+
+
+def serve_forever(srv):
+    interval = 1.0 / TICK_RATE
+    next_tick = time.monotonic() + interval
+    while True:
+        timeout = max(0.0, next_tick - time.monotonic())
+        for key, mask in sel.select(timeout):
+            if key.data is None:
+                accept_clients(key.fileobj)
+                continue
+            if key.data is stats_listener:
+                stats_listener.handle(key.fileobj, mask)
+                continue
+            conn = key.data
+            if mask & selectors.EVENT_READ:
+                handle_read(conn)
+            if mask & selectors.EVENT_WRITE:
+                flush(conn)
+        now = time.monotonic()
+        if now >= next_tick:
+            stats.loop_lag.observe(now - next_tick)
+            try:
+                apply_inputs()
+                ping_clients(now)
+                tick_rooms(interval)
+                flush_all(now)
+                drop_idle_clients(now)
+            except Exception as e:
+                print(f"tick failed: {e!r}")
+            stats.tick.observe(time.monotonic() - now)
+            next_tick += interval
+            # Don't try to catch up on ticks missed during a stall
+            if next_tick < now:
+                next_tick = now + interval
 
 
 def start_server(host=HOST, port=PORT):
+    global stats_listener
+    if AUTHORITATIVE_SHOTS:
+        if projectiles is None:
+            print("numpy not installed; server-authoritative shots disabled")
+        else:
+            all_rooms.auth_shots = True
     srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     srv.bind((host, port))
-    srv.listen(64)
+    srv.listen(1024)
+    srv.setblocking(False)
+    sel.register(srv, selectors.EVENT_READ, None)
     print(f"Server listening on {host}:{port}")
-
-    threading.Thread(target=broadcast_loop, daemon=True).start()
+    if METRICS_PORT:
+        stats_listener = metrics.StatsListener(sel, host, METRICS_PORT, stats.registry.render)
+        print(f"Metrics on http://{host}:{METRICS_PORT}/metrics")
 
     try:
-        while True:
-            sock, addr = srv.accept()
-            threading.Thread(target=handle_client, args=(sock, addr), daemon=True).start()
+        serve_forever(srv)
     except KeyboardInterrupt:
         print("Server shutting down...")
     finally:
+        for conn in list(clients.values()):
+            close_connection(conn)
+        if stats_listener is not None:
+            stats_listener.close()
+        try:
+            sel.unregister(srv)
+        except Exception:
+            pass
         try:
             srv.close()
         except Exception:
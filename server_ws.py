@@ -1,12 +1,25 @@
 import asyncio
-import json
+import collections
 import time
 import random
 import os
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import uvicorn
 
+import mapdata
+import metrics
+import movement
+import protocol
+import rooms
+import snapshot
+import spatial
+try:
+    import projectiles
+except ImportError:
+    projectiles = None
+
 app = FastAPI()
 
 # CORS para aceitar requisições de qualquer origem
@@ -20,10 +33,48 @@ app.add_middleware(
 
 HOST = '0.0.0.0'
 PORT = int(os.environ.get('PORT', 8000))  # SquaredCloud fornece PORT via variável
+# Area of interest: players only receive entities and shots within this
+# distance. The default covers the whole 800x600 map; shrink it for bigger maps.
+AOI_RADIUS = float(os.environ.get('AOI_RADIUS', 1000))
+AOI_HYSTERESIS = float(os.environ.get('AOI_HYSTERESIS', 100))
+SHOT_LIFE = 2.0  # seconds a bullet lives on the client, bounds its travel
+# Server-authoritative shots: the server simulates every projectile and
+# decides hits itself, ignoring client 'hit' reports (requires numpy)
+AUTHORITATIVE_SHOTS = os.environ.get('AUTH_SHOTS', '0') == '1'
+PROJECTILE_HZ = 60  # simulation steps per second, matches the client frame rate
+# Server-authoritative movement: positions only change through 'input'
+# commands (plus spawn and revive); raw 'pos' updates are ignored
+AUTHORITATIVE_MOVEMENT = os.environ.get('AUTH_MOVE', '0') == '1'
+TICK_RATE = 20  # simulation ticks per second: projectiles
+# Snapshots per second. Clients interpolate between stamped snapshots, so
+# this can stay well below the tick rate. Each client gets a rate between
+# MIN_BROADCAST_FPS and BROADCAST_FPS picked from its RTT and backlog.
+BROADCAST_FPS = int(os.environ.get('BROADCAST_FPS', 10))
+MIN_BROADCAST_FPS = int(os.environ.get('MIN_BROADCAST_FPS', 2))
+PING_INTERVAL = 1.0  # seconds between RTT probes to each client
+# Messages a connection may have waiting besides its latest snapshot; a
+# client that falls this far behind is disconnected
+MAX_QUEUE = int(os.environ.get('WS_MAX_QUEUE', 512))
+# Players per room: each room is a separate match with its own snapshots,
+# and joiners past the cap overflow into a new room
+ROOM_CAP = int(os.environ.get('ROOM_CAP', rooms.MAX_PLAYERS))
 
 next_id = 1
-clients = {}   # id -> websocket
-players = {}   # id -> {name, x, y, color, hp, max_hp, invuln_until}
+ID_STEP = 1  # cluster workers interleave ids so they stay unique across processes
+clients = {}   # id -> Client, across every room
+all_rooms = rooms.Rooms(ROOM_CAP, AOI_RADIUS, AOI_HYSTERESIS)
+worker = None  # cluster.WorkerLink when running as one of several worker processes
+stats = metrics.ServerMetrics()
+stats.registry.gauge('game_clients', 'Connected clients that sent hello.', lambda: len(clients))
+stats.registry.gauge('game_players', 'Players across all rooms.', lambda: all_rooms.player_count())
+stats.registry.gauge('game_rooms', 'Rooms with at least one player.', lambda: len(all_rooms))
+stats.registry.gauge('game_outbound_queue_messages', 'Queued messages per client: the largest and the total.',
+                     lambda: outbound_queue(), ('stat',))
+if AUTHORITATIVE_SHOTS:
+    if projectiles is None:
+        print("numpy not installed; server-authoritative shots disabled")
+    else:
+        all_rooms.auth_shots = True
 
 
 @app.get("/")
@@ -33,192 +84,500 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"players": len(players), "clients": len(clients)}
+    status = {"players": all_rooms.player_count(), "clients": len(clients),
+              "rooms": {room.name: len(room) for room in all_rooms}}
+    if worker is not None:
+        status["worker"] = worker.index
+        status["cluster"] = worker.health
+    return status
 
 
-@app.websocket("/ws")
-async def websocket_ws(websocket: WebSocket):
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(stats.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def outbound_queue():
+    sizes = [len(client.queue) + (client.snapshot is not None) for client in list(clients.values())]
+    return {('max',): max(sizes, default=0), ('sum',): sum(sizes)}
+
+
+async def receive_msg(websocket):
+    message = await websocket.receive()
+    if message['type'] == 'websocket.disconnect':
+        raise WebSocketDisconnect(message.get('code', 1000))
+    data = message.get('bytes')
+    if data is None:
+        data = message.get('text') or ''
+        if not data.strip():
+            return None
+    msg = protocol.decode_ws(data)
+    if isinstance(msg, dict):
+        stats.received(msg.get('type'), len(data))
+    return msg
+
+
+async def send_encoded(ws, data):
+    if isinstance(data, bytes):
+        await ws.send_bytes(data)
+    else:
+        await ws.send_text(data)
+
+
+class Client:
+    """A websocket with its own writer task and bounded outbound queue.
+
+    Broadcasts only enqueue, so one slow socket never holds up the tick or
+    the other clients. Snapshots don't queue up: an unsent one is replaced
+    by the next, and events queued before it are always written first.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.cid = None
+        self.room = None  # rooms.Room joined through hello
+        self.queue = collections.deque()  # (encoded message, time queued)
+        self.snapshot = None  # latest encoded snapshot not yet written
+        self.snapshot_at = 0.0  # when the unsent snapshot slot was first filled
+        self.wakeup = asyncio.Event()
+        self.binary = False
+        self.delta = None     # snapshot.DeltaTracker when the client asked for deltas
+        self.rate = snapshot.SnapshotRate(MIN_BROADCAST_FPS, BROADCAST_FPS, TICK_RATE)
+        self.last_ping = 0.0
+        self.input_seq = 0  # last movement command applied
+        self.acked_seq = 0  # last one acknowledged to the client
+        self.budget = movement.StepBudget()
+        self.closed = False
+        self.draining = False  # close once the queue has been written
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def send(self, data):
+        if self.closed:
+            return
+        if len(self.queue) >= MAX_QUEUE:
+            stats.drop('backlog')
+            self.close()
+            return
+        self.queue.append((data, time.monotonic()))
+        self.wakeup.set()
+
+    def send_snapshot(self, data):
+        if self.closed:
+            return
+        if self.snapshot is None:
+            self.snapshot_at = time.monotonic()
+        self.snapshot = data
+        self.wakeup.set()
+
+    def close(self):
+        # The writer closes the socket, which ends the reader's receive loop
+        self.closed = True
+        self.wakeup.set()
+
+    def finish(self):
+        """Close after writing everything queued so far."""
+        self.draining = True
+        self.wakeup.set()
+
+    def stop(self):
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while not self.closed:
+                    if self.queue:
+                        data, queued_at = self.queue.popleft()
+                    elif self.snapshot is not None:
+                        data, self.snapshot = self.snapshot, None
+                        queued_at = self.snapshot_at
+                    else:
+                        break
+                    await send_encoded(self.ws, data)
+                    stats.send_latency.observe(time.monotonic() - queued_at)
+                if self.draining:
+                    break
+        except Exception:
+            pass
+        self.closed = True
+        self.queue.clear()
+        self.snapshot = None
+        try:
+            await self.ws.close()
+        except Exception:
+            pass
+
+
+def send_msg(client, obj):
+    try:
+        data = protocol.encode_ws(obj, client.binary)
+    except Exception:
+        return
+    stats.sent(obj['type'], len(data))
+    client.send(data)
+
+
+dispatcher = protocol.Dispatcher()
+
+
+@dispatcher.on('hello')
+def on_hello(client, m):
     global next_id
+    if client.cid is not None:
+        return
+    if worker is not None:
+        name = all_rooms.pick(m.room, worker.remote)
+        if not worker.owns(name):
+            # Another worker process hosts this room; send the client there
+            send_msg(client, worker.redirect(name))
+            client.finish()
+            return
+        room = all_rooms.open(name)
+    else:
+        room = all_rooms.assign(m.room)
+    cid = next_id
+    next_id += ID_STEP
+    client.cid = cid
+    clients[cid] = client
+    client.room = room
+    color = [random.randint(50, 255) for _ in range(3)]
+    room.join(cid, client, {
+        'name': m.name if m.name is not None else f'Player{cid}',
+        'x': max(0.0, min(m.x, mapdata.WIDTH - mapdata.PLAYER_SIZE)),
+        'y': max(0.0, min(m.y, mapdata.HEIGHT - mapdata.PLAYER_SIZE)),
+        'color': list(m.color) if m.color is not None else color,
+        'hp': 100,
+        'max_hp': 100,
+        'invuln_until': 0.0,
+    })
+    welcome = {'type': 'welcome', 'id': cid, 'room': room.name}
+    if m.delta:
+        client.delta = snapshot.DeltaTracker()
+        welcome['delta'] = True
+    binary = m.proto == protocol.PROTO_BIN
+    if binary:
+        welcome['proto'] = protocol.PROTO_BIN
+    if room.shots is not None:
+        welcome['auth_shots'] = True
+    # The welcome itself is always JSON; both directions switch after it
+    send_msg(client, welcome)
+    client.binary = binary
+
+
+@dispatcher.on('pos')
+def on_pos(client, m):
+    if AUTHORITATIVE_MOVEMENT:
+        return
+    p = client.room.players.get(client.cid)
+    if p:
+        if m.x is not None:
+            p['x'] = m.x
+        if m.y is not None:
+            p['y'] = m.y
+
+
+@dispatcher.on('input')
+def on_input(client, m):
+    p = client.room.players.get(client.cid)
+    if p is None or m.seq <= client.input_seq:
+        return
+    client.input_seq = m.seq
+    dx, dy = client.budget.command(m.dx, m.dy, m.n, time.monotonic())
+    p['x'], p['y'] = movement.apply(p['x'], p['y'], dx, dy)
+
+
+@dispatcher.on('shot')
+def on_shot(client, m):
+    cid = client.cid
+    room = client.room
+    shot = m._replace(owner=cid, sid=None, ref=None).to_msg()
+    targets = room.interest.shot_targets(m.x, m.y, m.vx, m.vy, SHOT_LIFE)
+    if room.shots is not None:
+        # The shooter also gets the spawn so it can tag its local
+        # bullet (matched by 'ref') with the id used by 'despawn'
+        shot['sid'] = room.shots.spawn(m.x, m.y, m.vx, m.vy, m.damage,
+                                       owner=cid, size=m.size, life=SHOT_LIFE)
+        shot['ref'] = m.ref
+    else:
+        targets.discard(cid)
+    broadcast(shot, room, targets)
+
+
+@dispatcher.on('hit')
+def on_hit(client, m):
+    if client.room.shots is not None:
+        return  # the server decides hits itself
+    if m.victim is not None:
+        apply_damage(client.room, m.victim, m.damage)
+
+
+@dispatcher.on('revive')
+def on_revive(client, m):
+    cid = client.cid
+    room = client.room
+    p = room.players.get(cid)
+    if p:
+        p['hp'] = p.get('max_hp', 100)
+        p['invuln_until'] = time.time() + 1.5
+        if m.x is not None and m.y is not None:
+            # Respawn point picked by the client, kept inside the map
+            p['x'] = max(0.0, min(m.x, mapdata.WIDTH - mapdata.PLAYER_SIZE))
+            p['y'] = max(0.0, min(m.y, mapdata.HEIGHT - mapdata.PLAYER_SIZE))
+        broadcast({'type': 'hp', 'id': cid, 'hp': p['hp']}, room, room.interest.watchers_of(cid))
+
+
+@dispatcher.on('ping')
+def on_ping(client, m):
+    send_msg(client, {'type': 'pong', 't': m.t})
+
+
+@dispatcher.on('pong')
+def on_pong(client, m):
+    # Echo of our own ping; the RTT includes time spent in the send queue
+    if m.t:
+        client.rate.on_rtt(time.monotonic() - m.t)
+
+
+def ping_clients(now):
+    for client in list(clients.values()):
+        if now - client.last_ping >= PING_INTERVAL:
+            client.last_ping = now
+            send_msg(client, {'type': 'ping', 't': now})
+
+
+PRE_HELLO = ('hello', 'ping', 'pong')  # the only messages accepted before hello
+
+
+def handle_message(client, msg):
+    t = msg.get('type')
+    if t == 'batch':
+        for sub in protocol.unbatch(msg):
+            try:
+                handle_message(client, sub)
+            except Exception:
+                pass
+        return
+    if client.cid is None and t not in PRE_HELLO:
+        return
+    dispatcher.dispatch(client, msg)
+
+
+async def serve_socket(websocket):
     await websocket.accept()
-    cid = None
+    client = Client(websocket)
+    client.start()
     try:
         while True:
-            line = await websocket.receive_text()
-            if not line.strip():
+            try:
+                msg = await receive_msg(websocket)
+            except (ValueError, TypeError):
+                continue
+            if msg is None:
                 continue
             try:
-                msg = json.loads(line)
+                handle_message(client, msg)
             except Exception:
+                # A message that breaks its handler is dropped, not the client
                 continue
-            t = msg.get('type')
-            if t == 'hello':
-                cid = next_id
-                next_id += 1
-                clients[cid] = websocket
-                color = [random.randint(50, 255) for _ in range(3)]
-                players[cid] = {
-                    'name': msg.get('name', f'Player{cid}'),
-                    'x': float(msg.get('x', 100)),
-                    'y': float(msg.get('y', 100)),
-                    'color': msg.get('color', color),
-                    'hp': 100,
-                    'max_hp': 100,
-                    'invuln_until': 0.0,
-                }
-                await websocket.send_json({'type': 'welcome', 'id': cid})
-
-            elif t == 'pos' and cid is not None:
-                p = players.get(cid)
-                if p:
-                    p['x'] = float(msg.get('x', p['x']))
-                    p['y'] = float(msg.get('y', p['y']))
-
-            elif t == 'shot' and cid is not None:
-                shot = {
-                    'type': 'shot',
-                    'owner': cid,
-                    'x': float(msg.get('x', 0)),
-                    'y': float(msg.get('y', 0)),
-                    'vx': float(msg.get('vx', 0)),
-                    'vy': float(msg.get('vy', 0)),
-                    'damage': int(msg.get('damage', 10)),
-                    'size': int(msg.get('size', 6)),
-                    'color': msg.get('color', [255, 90, 90])
-                }
-                await broadcast(shot)
-
-            elif t == 'hit' and cid is not None:
-                victim = int(msg.get('victim')) if 'victim' in msg else None
-                dmg = int(msg.get('damage', 0))
-                if victim is not None:
-                    vp = players.get(victim)
-                    if vp:
-                        if time.time() >= vp.get('invuln_until', 0):
-                            vp['hp'] = max(0, vp.get('hp', 100) - dmg)
-                        hp_msg = {'type': 'hp', 'id': victim, 'hp': vp['hp']}
-                    await broadcast(hp_msg)
-
-            elif t == 'revive' and cid is not None:
-                p = players.get(cid)
-                if p:
-                    p['hp'] = p.get('max_hp', 100)
-                    p['invuln_until'] = time.time() + 1.5
-                    hp_msg = {'type': 'hp', 'id': cid, 'hp': p['hp']}
-                await broadcast(hp_msg)
-
     except Exception:
         pass
     finally:
-        if cid in clients:
+        client.stop()
+        cid = client.cid
+        if clients.get(cid) is client:
             del clients[cid]
-        if cid in players:
-            del players[cid]
+        room = client.room
+        if room is not None:
+            room.leave(cid)
+            all_rooms.release(room)
+
+
+@app.websocket("/ws")
+async def websocket_ws(websocket: WebSocket):
+    await serve_socket(websocket)
 
 
 @app.websocket("/")
 async def websocket_root(websocket: WebSocket):
     """Alias para /ws para compatibilidade com clientes"""
-    global next_id
-    await websocket.accept()
-    cid = None
-    try:
-        while True:
-            line = await websocket.receive_text()
-            if not line.strip():
-                continue
+    await serve_socket(websocket)
+
+
+def apply_damage(room, victim, dmg):
+    vp = room.players.get(victim)
+    if vp is None:
+        return
+    if time.time() >= vp.get('invuln_until', 0):
+        vp['hp'] = max(0, min(vp.get('max_hp', 100), vp.get('hp', 100) - dmg))
+    hp_msg = {'type': 'hp', 'id': victim, 'hp': vp['hp']}
+    broadcast(hp_msg, room, room.interest.watchers_of(victim))
+
+
+def step_projectiles(room, dt):
+    shots = room.shots
+    if shots is None or shots.count == 0:
+        return
+    players = room.players
+    ids = list(players)
+    xs = [players[pid]['x'] for pid in ids]
+    ys = [players[pid]['y'] for pid in ids]
+    steps = max(1, round(dt * PROJECTILE_HZ))
+    for _ in range(steps):
+        sids, victims, damage, _owners = shots.step(dt / steps, ids, xs, ys)
+        for sid, victim, dmg in zip(sids.tolist(), victims.tolist(), damage.tolist()):
+            # Walls and expiry play out the same on every client; only
+            # player hits need an explicit despawn
+            broadcast({'type': 'despawn', 'sid': sid}, room, room.interest.watchers_of(victim))
+            apply_damage(room, victim, dmg)
+
+
+def broadcast(obj, room, targets=None, latest=False):
+    """Queue obj for every client in room (or only targets); never waits on a socket.
+
+    With latest=True the message is a snapshot and replaces any the
+    client hasn't been sent yet.
+    """
+    clients = room.clients
+    if not clients:
+        return
+    # Encode once per wire format and hand the same frame to every writer
+    encoded = {}
+    counts = {}  # wire format -> clients it was queued for
+    for cid, client in list(clients.items()):
+        if targets is not None and cid not in targets:
+            continue
+        data = encoded.get(client.binary)
+        if data is None:
             try:
-                msg = json.loads(line)
+                data = encoded[client.binary] = protocol.encode_ws(obj, client.binary)
             except Exception:
                 continue
-            t = msg.get('type')
-            if t == 'hello':
-                cid = next_id
-                next_id += 1
-                clients[cid] = websocket
-                color = [random.randint(50, 255) for _ in range(3)]
-                players[cid] = {
-                    'name': msg.get('name', f'Player{cid}'),
-                    'x': float(msg.get('x', 100)),
-                    'y': float(msg.get('y', 100)),
-                    'color': msg.get('color', color),
-                    'hp': 100,
-                    'max_hp': 100,
-                    'invuln_until': 0.0,
-                }
-                await websocket.send_json({'type': 'welcome', 'id': cid})
-
-            elif t == 'pos' and cid is not None:
-                p = players.get(cid)
-                if p:
-                    p['x'] = float(msg.get('x', p['x']))
-                    p['y'] = float(msg.get('y', p['y']))
-
-            elif t == 'shot' and cid is not None:
-                shot = {
-                    'type': 'shot',
-                    'owner': cid,
-                    'x': float(msg.get('x', 0)),
-                    'y': float(msg.get('y', 0)),
-                    'vx': float(msg.get('vx', 0)),
-                    'vy': float(msg.get('vy', 0)),
-                    'damage': int(msg.get('damage', 10)),
-                    'size': int(msg.get('size', 6)),
-                    'color': msg.get('color', [255, 90, 90])
-                }
-                await broadcast(shot)
-
-            elif t == 'hit' and cid is not None:
-                victim = int(msg.get('victim')) if 'victim' in msg else None
-                dmg = int(msg.get('damage', 0))
-                if victim is not None:
-                    vp = players.get(victim)
-                    if vp:
-                        if time.time() >= vp.get('invuln_until', 0):
-                            vp['hp'] = max(0, vp.get('hp', 100) - dmg)
-                        hp_msg = {'type': 'hp', 'id': victim, 'hp': vp['hp']}
-                    await broadcast(hp_msg)
-
-            elif t == 'revive' and cid is not None:
-                p = players.get(cid)
-                if p:
-                    p['hp'] = p.get('max_hp', 100)
-                    p['invuln_until'] = time.time() + 1.5
-                    hp_msg = {'type': 'hp', 'id': cid, 'hp': p['hp']}
-                await broadcast(hp_msg)
-
-    except Exception:
-        pass
-    finally:
-        if cid in clients:
+        if latest:
+            client.send_snapshot(data)
+        else:
+            client.send(data)
+        counts[client.binary] = counts.get(client.binary, 0) + 1
+        if client.closed:
             del clients[cid]
-        if cid in players:
-            del players[cid]
+    for binary, n in counts.items():
+        stats.sent(obj['type'], len(encoded[binary]), n)
 
 
-async def broadcast(obj):
-    if not clients:
+def broadcast_state(room):
+    # A client whose last snapshot is still unsent is congested and gets
+    # its rate cut; the new snapshot replaces the stale one
+    tick = room.tick
+    due = {cid: client for cid, client in list(room.clients.items())
+           if client.rate.due(tick, client.snapshot is not None or bool(client.queue))}
+    if not due:
         return
-    bad_clients = []
-    for cid, ws in list(clients.items()):
+    started = time.perf_counter()
+    players = room.players
+    interest = room.interest
+    stamp = {'tick': tick, 't': round(tick / TICK_RATE, 3)}
+    interest.update(players)
+    view = None
+    groups = {}  # visible set -> full-state clients that share it
+    for cid, client in due.items():
+        if client.input_seq != client.acked_seq:
+            # Tell the client where its movement commands left it so it can
+            # replay the ones still in flight on top
+            p = players.get(cid)
+            if p is not None:
+                client.acked_seq = client.input_seq
+                send_msg(client, {'type': 'ack', 'seq': client.input_seq, 'x': p['x'], 'y': p['y']})
+        seen = interest.visible_to(cid)
+        if client.delta is None:
+            groups.setdefault(frozenset(seen), set()).add(cid)
+            continue
+        # A delta is relative to the last one written, so it can't replace an
+        # unsent one; wait for the writer to catch up and diff against that
+        if client.snapshot is not None:
+            continue
+        if view is None:
+            view = snapshot.public_view(players)
+        # Idle ticks produce no delta and nothing is sent
+        msg = client.delta.build(spatial.filter_view(view, seen), exclude=cid)
+        if msg is not None:
+            msg.update(stamp)
+            try:
+                data = protocol.encode_ws(msg, client.binary)
+            except Exception:
+                continue
+            stats.sent('delta', len(data))
+            client.send_snapshot(data)
+    for seen, targets in groups.items():
+        state = {'type': 'state', **stamp, 'players': {pid: players[pid] for pid in seen if pid in players}}
+        broadcast(state, room, targets, latest=True)
+    stats.snapshot.observe(time.perf_counter() - started)
+
+
+def tick(dt):
+    ping_clients(time.monotonic())
+    # Rooms never see each other's players, so each one is simulated and
+    # snapshotted on its own
+    for room in all_rooms:
+        room.tick += 1
         try:
-            await ws.send_json(obj)
-        except Exception:
-            bad_clients.append(cid)
-    for cid in bad_clients:
-        if cid in clients:
-            del clients[cid]
+            step_projectiles(room, dt)
+            broadcast_state(room)
+        except Exception as e:
+            print(f"room {room.name!r} tick failed: {e!r}")
 
 
 async def broadcast_loop():
+    loop = asyncio.get_running_loop()
+    interval = 1.0 / TICK_RATE
+    next_tick = loop.time() + interval
     while True:
-        await asyncio.sleep(0.05)
-        state = {'type': 'state', 'players': players}
-        await broadcast(state)
+        # Sleep until the scheduled tick rather than a fixed interval, so the
+        # time spent ticking doesn't stretch the period
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        started = loop.time()
+        # Oversleeping means other callbacks held the event loop
+        stats.loop_lag.observe(max(0.0, started - next_tick))
+        try:
+            tick(interval)
+        except Exception as e:
+            print(f"tick failed: {e!r}")
+        now = loop.time()
+        stats.tick.observe(now - started)
+        next_tick += interval
+        # Don't try to catch up on ticks missed during a stall
+        if next_tick < now:
+            next_tick = now + interval
+
+
+async def report_loop():
+    # Presence for the cluster supervisor; a stalled event loop stops
+    # reporting and shows up as unhealthy
+    while True:
+        worker.report({'worker': worker.index, 'pid': os.getpid(), 'clients': len(clients),
+                       'rooms': {room.name: len(room) for room in all_rooms}})
+        await asyncio.sleep(worker.interval)
+
+
+def join_cluster(link):
+    """Run as worker link.index of a cluster.py deployment."""
+    global worker, next_id, ID_STEP
+    worker = link
+    next_id = link.index + 1
+    ID_STEP = link.workers
+    link.start()
 
 
 @app.on_event("startup")
 async def startup():
     asyncio.create_task(broadcast_loop())
+    if worker is not None:
+        asyncio.create_task(report_loop())
 
 
 if __name__ == '__main__':
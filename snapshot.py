@@ -0,0 +1,126 @@
+"""Delta-compressed player snapshots shared by server.py and server_ws.py."""
+
+# Fields clients are allowed to see; server-only bookkeeping stays out.
+PUBLIC_FIELDS = ('name', 'x', 'y', 'color', 'hp', 'max_hp')
+POS_DECIMALS = 1
+
+
+def public_view(players):
+    """Build {id: {field: value}} with only the fields sent to clients."""
+    view = {}
+    for pid, p in players.items():
+        view[pid] = {
+            'name': p.get('name'),
+            'x': round(p.get('x', 0.0), POS_DECIMALS),
+            'y': round(p.get('y', 0.0), POS_DECIMALS),
+            'color': list(p.get('color', ())),
+            'hp': p.get('hp'),
+            'max_hp': p.get('max_hp'),
+        }
+    return view
+
+
+class DeltaTracker:
+    """Remembers what one client has been sent and diffs new views against it.
+
+    The baseline advances when a delta is built: both transports are
+    reliable and ordered, so a snapshot that was handed to the socket is
+    one the client will apply before anything sent after it.
+
+    The first idle build after a change still returns an empty delta, so
+    interpolating clients learn that moving entities have stopped; later
+    idle builds return None.
+    """
+
+    def __init__(self):
+        self.baseline = {}  # id -> fields as last sent
+        self.seq = 0
+        self.quiet = True  # the last delta built was empty
+
+    def build(self, view, exclude=None):
+        """Return a 'delta' message for view, or None when nothing changed again."""
+        join = {}
+        upd = {}
+        leave = []
+        baseline = self.baseline
+        for pid, fields in view.items():
+            if pid == exclude:
+                continue
+            base = baseline.get(pid)
+            if base is None:
+                join[pid] = fields
+                baseline[pid] = dict(fields)
+                continue
+            changed = None
+            for k, v in fields.items():
+                if base.get(k) != v:
+                    if changed is None:
+                        changed = {}
+                    changed[k] = v
+                    base[k] = v
+            if changed:
+                upd[pid] = changed
+        for pid in list(baseline):
+            if pid not in view or pid == exclude:
+                leave.append(pid)
+                del baseline[pid]
+        if not (join or upd or leave):
+            if self.quiet:
+                return None
+            self.quiet = True
+        else:
+            self.quiet = False
+        self.seq += 1
+        msg = {'type': 'delta', 'seq': self.seq}
+        if join:
+            msg['join'] = join
+        if upd:
+            msg['upd'] = upd
+        if leave:
+            msg['leave'] = leave
+        return msg
+
+
+class SnapshotRate:
+    """Chooses how often one client gets a snapshot.
+
+    The measured RTT sets a ceiling: clients at or under rtt_good get
+    max_rate and slower links get proportionally less. Below that
+    ceiling the rate backs off by half whenever a snapshot is due while
+    the previous one is still waiting to be written, and climbs back by
+    about one snapshot/s per second while the client keeps up.
+    """
+
+    def __init__(self, min_rate, max_rate, tick_rate, rtt_good=0.1):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.tick_rate = tick_rate
+        self.rtt_good = rtt_good
+        self.rate = self.max_rate
+        self.rtt = None  # smoothed round-trip time in seconds
+        self.next_tick = 0
+
+    def on_rtt(self, sample):
+        if sample < 0:
+            return
+        if self.rtt is None:
+            self.rtt = sample
+        else:
+            self.rtt += (sample - self.rtt) * 0.125
+
+    def ceiling(self):
+        if not self.rtt or self.rtt <= self.rtt_good:
+            return self.max_rate
+        return max(self.min_rate, self.max_rate * self.rtt_good / self.rtt)
+
+    def due(self, tick, congested):
+        """Whether the client gets a snapshot this tick; adapts the rate when it does."""
+        if tick < self.next_tick:
+            return False
+        if congested:
+            self.rate = max(self.min_rate, self.rate / 2)
+        else:
+            self.rate += 1.0 / self.rate
+        self.rate = min(self.rate, self.ceiling())
+        self.next_tick = tick + max(1, round(self.tick_rate / self.rate))
+        return True
@@ -0,0 +1,160 @@
+"""Uniform-grid spatial index and area-of-interest filtering for the servers."""
+
+
+class PointGrid:
+    """Buckets entity ids by position into square cells."""
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}  # (cx, cy) -> set of ids
+        self.where = {}  # id -> (cx, cy)
+        self.pos = {}    # id -> (x, y)
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def move(self, eid, x, y):
+        self.pos[eid] = (x, y)
+        cell = self._cell(x, y)
+        old = self.where.get(eid)
+        if old == cell:
+            return
+        if old is not None:
+            bucket = self.cells.get(old)
+            if bucket is not None:
+                bucket.discard(eid)
+                if not bucket:
+                    del self.cells[old]
+        self.cells.setdefault(cell, set()).add(eid)
+        self.where[eid] = cell
+
+    def remove(self, eid):
+        self.pos.pop(eid, None)
+        cell = self.where.pop(eid, None)
+        if cell is None:
+            return
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.discard(eid)
+            if not bucket:
+                del self.cells[cell]
+
+    def query_box(self, x0, y0, x1, y1):
+        """Yield ids in every cell overlapping the box (a superset of the box)."""
+        cx0, cy0 = self._cell(x0, y0)
+        cx1, cy1 = self._cell(x1, y1)
+        cells = self.cells
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(cells):
+            # Box covers more cells than are occupied: walk the occupied ones
+            for (cx, cy), bucket in cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    yield from bucket
+            return
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    yield from bucket
+
+    def query_radius(self, x, y, radius):
+        r2 = radius * radius
+        pos = self.pos
+        for eid in self.query_box(x - radius, y - radius, x + radius, y + radius):
+            ex, ey = pos[eid]
+            if (ex - x) ** 2 + (ey - y) ** 2 <= r2:
+                yield eid
+
+
+def _segment_dist2(px, py, x0, y0, x1, y1):
+    dx = x1 - x0
+    dy = y1 - y0
+    seg2 = dx * dx + dy * dy
+    if seg2 <= 0:
+        return (px - x0) ** 2 + (py - y0) ** 2
+    t = max(0.0, min(1.0, ((px - x0) * dx + (py - y0) * dy) / seg2))
+    cx = x0 + t * dx
+    cy = y0 + t * dy
+    return (px - cx) ** 2 + (py - cy) ** 2
+
+
+class InterestManager:
+    """Tracks which players each player can see.
+
+    An entity enters an observer's set within `radius` and only leaves it
+    once it is farther than `radius + hysteresis`, so players hovering on
+    the edge don't flap in and out of each other's snapshots.
+    """
+
+    def __init__(self, radius, hysteresis=0.0, cell_size=None):
+        self.radius = float(radius)
+        self.hysteresis = float(hysteresis)
+        self.grid = PointGrid(cell_size or max(1.0, self.radius / 2))
+        self.visible = {}   # observer id -> set of ids it sees (itself included)
+        self.watchers = {}  # id -> set of observer ids that see it
+
+    def update(self, players):
+        """Refresh positions from the players dict and recompute every interest set."""
+        grid = self.grid
+        for pid in [pid for pid in grid.pos if pid not in players]:
+            self.remove(pid)
+        for pid, p in players.items():
+            grid.move(pid, p.get('x', 0.0), p.get('y', 0.0))
+        keep2 = (self.radius + self.hysteresis) ** 2
+        pos = grid.pos
+        for pid in players:
+            x, y = pos[pid]
+            seen = set(grid.query_radius(x, y, self.radius))
+            seen.add(pid)
+            old = self.visible.get(pid, ())
+            for oid in old:
+                if oid in seen or oid not in pos:
+                    continue
+                ox, oy = pos[oid]
+                if (ox - x) ** 2 + (oy - y) ** 2 <= keep2:
+                    seen.add(oid)
+            for oid in seen.difference(old):
+                self.watchers.setdefault(oid, set()).add(pid)
+            for oid in set(old).difference(seen):
+                w = self.watchers.get(oid)
+                if w is not None:
+                    w.discard(pid)
+            self.visible[pid] = seen
+
+    def remove(self, pid):
+        self.grid.remove(pid)
+        for oid in self.visible.pop(pid, ()):
+            w = self.watchers.get(oid)
+            if w is not None:
+                w.discard(pid)
+        for obs in self.watchers.pop(pid, ()):
+            seen = self.visible.get(obs)
+            if seen is not None:
+                seen.discard(pid)
+
+    def visible_to(self, pid):
+        return self.visible.get(pid, (pid,))
+
+    def watchers_of(self, pid):
+        """Observers that currently have pid in their interest set (pid included)."""
+        w = set(self.watchers.get(pid, ()))
+        w.add(pid)
+        return w
+
+    def shot_targets(self, x, y, vx, vy, life):
+        """Observers whose area of interest the shot's path crosses."""
+        x1 = x + vx * life
+        y1 = y + vy * life
+        r = self.radius
+        r2 = r * r
+        pos = self.grid.pos
+        targets = set()
+        for pid in self.grid.query_box(min(x, x1) - r, min(y, y1) - r, max(x, x1) + r, max(y, y1) + r):
+            px, py = pos[pid]
+            if _segment_dist2(px, py, x, y, x1, y1) <= r2:
+                targets.add(pid)
+        return targets
+
+
+def filter_view(view, ids):
+    """Subset of a {id: entry} snapshot view restricted to ids."""
+    return {pid: view[pid] for pid in ids if pid in view}
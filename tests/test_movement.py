@@ -0,0 +1,85 @@
+import collections
+import math
+import types
+
+import pytest
+
+import movement
+import protocol
+
+
+def test_clamp_limits_magnitude_to_frames():
+    dx, dy, n = movement.clamp(30.0, 40.0, 5)
+    assert n == 5
+    assert math.hypot(dx, dy) == pytest.approx(5)
+    assert movement.clamp(0.3, 0.4, 1) == (0.3, 0.4, 1)
+    assert movement.clamp(1.0, 0.0, 1000)[2] == movement.MAX_STEPS
+    assert movement.clamp(1.0, 0.0, -3) == (0.0, 0.0, 0)
+
+
+@pytest.mark.parametrize('dx, dy', [(float('nan'), 0.0), (0.0, float('inf')), (float('-inf'), 1.0)])
+def test_clamp_treats_non_finite_as_no_movement(dx, dy):
+    assert movement.clamp(dx, dy, 10) == (0.0, 0.0, 0)
+
+
+def test_step_budget_caps_frames_over_time():
+    budget = movement.StepBudget(rate=60, burst=60)
+    assert budget.take(45, now=0.0) == 45
+    assert budget.take(45, now=0.0) == 15
+    assert budget.take(45, now=0.0) == 0
+    assert budget.take(45, now=0.5) == 30
+    # Refill stops at burst however long the client was idle
+    assert budget.take(1000, now=100.0) == 60
+
+
+def test_step_budget_scales_commands_past_the_budget():
+    budget = movement.StepBudget(rate=60, burst=10)
+    assert budget.command(10.0, 0.0, 10, now=0.0) == (10.0, 0.0)
+    dx, dy = budget.command(10.0, 0.0, 10, now=5 / 60)
+    assert (dx, dy) == pytest.approx((5.0, 0.0))
+    assert budget.command(float('nan'), 0.0, 10, now=1.0) == (0.0, 0.0)
+
+
+def client_state(x, y, pending, ack):
+    # The parts of game.GameClient that reconcile() reads and writes
+    pygame = pytest.importorskip('pygame')
+    player = types.SimpleNamespace(x=x, y=y, rect=pygame.Rect(int(x), int(y), 50, 50))
+    return types.SimpleNamespace(
+        pending_ack=protocol.Ack.parse(ack), teleport_seq=0, player=player,
+        pending_inputs=collections.deque(pending), move_dx=0.0, move_dy=0.0)
+
+
+def test_reconcile_replays_unacked_inputs_on_the_server_position():
+    game = pytest.importorskip('game')
+    inputs = [(1, 1.0, 0.0), (2, 1.0, 0.0), (3, 0.0, 1.0)]
+    # The server applied the first two, then got pushed 3px up
+    ack = {'type': 'ack', 'seq': 2, 'x': 10.0, 'y': -3.0}
+    state = client_state(15.0, 5.0, inputs, ack)
+    game.GameClient.reconcile(state)
+    assert [seq for seq, _, _ in state.pending_inputs] == [3]
+    assert (state.player.x, state.player.y) == (10.0, -3.0 + movement.SPEED)
+    assert state.player.rect.topleft == (10, 2)
+
+
+def test_reconcile_keeps_a_prediction_that_matches():
+    game = pytest.importorskip('game')
+    ack = {'type': 'ack', 'seq': 1, 'x': 5.0, 'y': 0.0}
+    state = client_state(5.2, 0.0, [(1, 1.0, 0.0)], ack)
+    game.GameClient.reconcile(state)
+    assert state.player.x == 5.2
+    assert not state.pending_inputs
+
+
+def test_server_and_client_agree_on_replayed_inputs():
+    budget = movement.StepBudget()
+    x = y = 0.0
+    sent = []
+    for seq in range(1, 6):
+        dx, dy, n = movement.clamp(0.6 * seq, -0.8 * seq, seq)
+        sent.append((dx, dy))
+        dx, dy = budget.command(dx, dy, n, now=seq / 60)
+        x, y = movement.apply(x, y, dx, dy)
+    cx = cy = 0.0
+    for dx, dy in sent:
+        cx, cy = movement.apply(cx, cy, dx, dy)
+    assert (cx, cy) == pytest.approx((x, y))
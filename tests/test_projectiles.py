@@ -0,0 +1,26 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+import projectiles  # noqa: E402
+
+
+def test_oversized_projectile_is_clamped_to_one_cell():
+    ps = projectiles.ProjectileSystem(800, 600)
+    ps.spawn(400, 300, 0, 0, 10, owner=1, size=1000)
+    assert ps.size[0] == projectiles.CELL_SIZE
+    # A target inside the clamped square is still found by the broad phase
+    _, victims, damage, _ = ps.step(0.01, [2], [400 + 20], [300 + 20])
+    assert victims.tolist() == [2]
+    assert damage.tolist() == [10]
+
+
+def test_projectile_hits_wall_and_target_but_not_owner():
+    ps = projectiles.ProjectileSystem(800, 600, walls=[(100, 100, 50, 50)], target_size=50)
+    ps.spawn(90, 125, 600, 0, 10, owner=1)  # into the wall
+    ps.spawn(300, 325, 0, 0, 20, owner=1)  # sitting on its owner
+    ps.spawn(500, 325, 0, 0, 30, owner=1)  # sitting on player 2
+    _, victims, damage, owners = ps.step(0.05, [1, 2], [280, 480], [300, 300])
+    assert victims.tolist() == [2]
+    assert damage.tolist() == [30]
+    assert owners.tolist() == [1]
+    assert ps.count == 1
@@ -0,0 +1,170 @@
+import json
+import struct
+
+import pytest
+
+import protocol
+
+# Float values are exact in float32, so binary round-trips compare equal
+PLAYER = {'name': 'ana', 'x': 12.5, 'y': 300.25, 'color': [10, 20, 30], 'hp': 75, 'max_hp': 100}
+BINARY = [
+    {'type': 'pos', 'x': 12.5, 'y': 300.25},
+    {'type': 'shot', 'owner': 3, 'x': 1.5, 'y': 2.5, 'vx': 400.0, 'vy': -20.0, 'damage': 20, 'size': 6,
+     'color': [255, 90, 90], 'sid': 7, 'ref': 2},
+    {'type': 'hit', 'victim': 4, 'damage': 10},
+    {'type': 'revive', 'x': 10.0, 'y': 20.0},
+    {'type': 'revive'},
+    {'type': 'ping', 't': 12.5},
+    {'type': 'pong', 't': 12.5},
+    {'type': 'state', 'tick': 42, 't': 2.1, 'players': {1: PLAYER}},
+    {'type': 'delta', 'seq': 3, 'tick': 5, 't': 0.25, 'join': {2: PLAYER},
+     'upd': {1: {'x': 3.0, 'hp': 40}, 3: {'name': 'bo', 'color': [1, 2, 3], 'max_hp': 120}}, 'leave': [7]},
+    {'type': 'hp', 'id': 1, 'hp': 80},
+    {'type': 'despawn', 'sid': 9},
+    {'type': 'input', 'seq': 5, 'dx': 1.5, 'dy': -0.5, 'n': 3},
+    {'type': 'ack', 'seq': 5, 'x': 1.0, 'y': 2.0},
+    {'type': 'batch', 'msgs': [{'type': 'pos', 'x': 1.0, 'y': 2.0}, {'type': 'hit', 'victim': 4, 'damage': 10}]},
+]
+JSON_ONLY = [
+    {'type': 'hello', 'name': 'ana', 'x': 100.0, 'y': 100.0, 'delta': True, 'proto': 'bin', 'room': 'arena'},
+    {'type': 'welcome', 'id': 1, 'delta': True, 'proto': 'bin', 'auth_shots': True, 'room': 'arena'},
+    {'type': 'redirect', 'room': 'arena', 'port': 8002},
+]
+
+
+def _ids(msgs):
+    return [m['type'] for m in msgs]
+
+
+def test_every_message_type_is_covered():
+    assert set(_ids(BINARY)) == set(protocol.TYPE_IDS)
+    # 'batch' is unpacked with protocol.unbatch rather than parsed into a struct
+    assert set(_ids(BINARY + JSON_ONLY)) == set(protocol.STRUCTS) | {'batch'}
+
+
+@pytest.mark.parametrize('msg', BINARY, ids=_ids(BINARY))
+def test_binary_round_trip(msg):
+    assert protocol.decode(protocol.encode(msg)) == msg
+
+
+@pytest.mark.parametrize('msg', BINARY, ids=_ids(BINARY))
+def test_binary_stream_round_trip(msg):
+    frames, rest = protocol.split_frames(protocol.encode_stream(msg, True) * 2)
+    assert rest == b''
+    assert [protocol.decode(f) for f in frames] == [msg, msg]
+
+
+@pytest.mark.parametrize('msg', BINARY + JSON_ONLY, ids=_ids(BINARY + JSON_ONLY))
+def test_json_round_trip(msg):
+    # JSON turns integer keys into strings
+    expected = json.loads(json.dumps(msg))
+    line = protocol.encode_stream(msg)
+    assert line.endswith(b'\n')
+    assert protocol.loads(line) == expected
+    assert protocol.decode_ws(protocol.encode_ws(msg)) == expected
+
+
+STRUCT_MESSAGES = [m for m in BINARY + JSON_ONLY if m['type'] != 'batch']
+
+
+@pytest.mark.parametrize('msg', STRUCT_MESSAGES, ids=_ids(STRUCT_MESSAGES))
+def test_struct_parses_decoded_message(msg):
+    struct = protocol.STRUCTS[msg['type']].parse(msg)
+    for field, value in struct.to_msg().items():
+        if isinstance(value, tuple):
+            value = list(value)  # colors parse to tuples
+        assert value == msg.get(field, value)
+
+
+@pytest.mark.parametrize('msg', JSON_ONLY, ids=_ids(JSON_ONLY))
+def test_json_only_messages_have_no_binary_form(msg):
+    with pytest.raises(protocol.ProtocolError):
+        protocol.encode(msg)
+
+
+def test_hp_fields_saturate_to_int16():
+    assert protocol.decode(protocol.encode({'type': 'hp', 'id': 1, 'hp': 100100}))['hp'] == 32767
+    assert protocol.decode(protocol.encode({'type': 'hp', 'id': 1, 'hp': -100100}))['hp'] == -32768
+    state = protocol.decode(protocol.encode(
+        {'type': 'state', 'tick': 1, 't': 0.0, 'players': {1: dict(PLAYER, hp=100100, max_hp=70000)}}))
+    assert (state['players'][1]['hp'], state['players'][1]['max_hp']) == (32767, 32767)
+    delta = protocol.decode(protocol.encode(
+        {'type': 'delta', 'seq': 1, 'tick': 1, 't': 0.0, 'join': {}, 'upd': {1: {'hp': 99999, 'max_hp': -99999}},
+         'leave': []}))
+    assert delta['upd'][1] == {'hp': 32767, 'max_hp': -32768}
+
+
+def test_shot_and_hit_fields_saturate():
+    shot = protocol.decode(protocol.encode({'type': 'shot', 'owner': 1, 'damage': -5, 'size': 1000,
+                                            'color': [999, -1, 3]}))
+    assert (shot['damage'], shot['size'], shot['color']) == (0, 255, [255, 0, 3])
+    assert protocol.decode(protocol.encode({'type': 'hit', 'victim': 1, 'damage': 10 ** 9}))['damage'] == 0xFFFF
+
+
+def test_hit_rejects_negative_damage():
+    with pytest.raises(ValueError):
+        protocol.Hit.parse({'type': 'hit', 'victim': 1, 'damage': -100000})
+    assert protocol.Hit.parse({'type': 'hit', 'victim': 1, 'damage': 10 ** 9}).damage == protocol.MAX_DAMAGE
+
+
+@pytest.mark.parametrize('msg', [
+    {'type': 'pos', 'x': float('nan'), 'y': 1.0},
+    {'type': 'hello', 'x': float('inf')},
+    {'type': 'input', 'dx': float('-inf')},
+    {'type': 'shot', 'vx': float('nan')},
+    {'type': 'revive', 'x': 1.0, 'y': float('nan')},
+])
+def test_structs_reject_non_finite_numbers(msg):
+    with pytest.raises(ValueError):
+        protocol.STRUCTS[msg['type']].parse(msg)
+
+
+def test_decode_rejects_truncated_and_unknown_payloads():
+    data = protocol.encode(BINARY[1])
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(data[:-3])
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(b'\xff')
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(b'')
+
+
+def test_shot_damage_and_size_are_clamped():
+    shot = protocol.Shot.parse({'type': 'shot', 'damage': -50, 'size': 10000})
+    assert (shot.damage, shot.size) == (0, protocol.MAX_SHOT_SIZE)
+    shot = protocol.Shot.parse({'type': 'shot', 'damage': 2 ** 40, 'size': 0})
+    assert (shot.damage, shot.size) == (protocol.MAX_DAMAGE, 1)
+
+
+@pytest.mark.parametrize('msg', [
+    {'type': 'hp', 'id': 2 ** 40, 'hp': 10},
+    {'type': 'hp', 'hp': 10},
+    {'type': 'ack', 'seq': 1, 'x': None, 'y': 0.0},
+    {'type': 'shot', 'owner': 2 ** 40},
+])
+def test_unencodable_fields_raise_protocol_error(msg):
+    with pytest.raises(protocol.ProtocolError):
+        protocol.encode(msg)
+
+
+def test_unbatch_drops_nested_batches_and_non_messages():
+    pos = {'type': 'pos', 'x': 1.0, 'y': 2.0}
+    msg = {'type': 'batch', 'msgs': [pos, 'pos', None, {'type': 'batch', 'msgs': [pos]}, pos]}
+    assert protocol.unbatch(msg) == [pos, pos]
+    assert protocol.unbatch({'type': 'batch', 'msgs': 'nope'}) == []
+    assert protocol.unbatch({'type': 'batch'}) == []
+
+
+def test_unbatch_stops_at_max_batch():
+    msgs = [{'type': 'ping', 't': float(i)} for i in range(protocol.MAX_BATCH + 10)]
+    assert protocol.unbatch({'type': 'batch', 'msgs': msgs}) == msgs[:protocol.MAX_BATCH]
+
+
+def test_decode_rejects_nested_and_truncated_batches():
+    inner = protocol.encode({'type': 'batch', 'msgs': [{'type': 'ping', 't': 1.0}]})
+    nested = struct.pack('<BH', protocol.BATCH, 1) + struct.pack('<H', len(inner)) + inner
+    with pytest.raises(protocol.ProtocolError, match='nested'):
+        protocol.decode(nested)
+    data = protocol.encode({'type': 'batch', 'msgs': [{'type': 'ping', 't': 1.0}]})
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(data[:-1])
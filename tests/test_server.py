@@ -0,0 +1,37 @@
+import movement
+import rooms
+import server
+
+
+def test_apply_damage_keeps_hp_between_zero_and_max():
+    room = rooms.Room('test')
+    conn = server.Connection(None, ('127.0.0.1', 1))
+    conn.binary = True
+    room.join(1, conn, {'name': 'ana', 'x': 0.0, 'y': 0.0, 'hp': 100, 'max_hp': 100, 'invuln_until': 0.0})
+    server.apply_damage(room, 1, -100000)
+    assert room.players[1]['hp'] == 100
+    server.apply_damage(room, 1, 30)
+    assert room.players[1]['hp'] == 70
+    server.apply_damage(room, 1, 10 ** 9)
+    assert room.players[1]['hp'] == 0
+    # Every change went out as an hp update; none failed to encode
+    assert len(conn.outq) == 3
+
+
+def test_batch_applies_every_valid_message(monkeypatch):
+    room = rooms.Room('test')
+    conn = server.Connection(None, ('127.0.0.1', 1))
+    conn.cid = 1
+    conn.room = room
+    room.join(1, conn, {'name': 'ana', 'x': 0.0, 'y': 0.0, 'hp': 100, 'max_hp': 100})
+    monkeypatch.setitem(server.clients, 1, conn)
+    server.handle_message(conn, {'type': 'batch', 'msgs': [
+        {'type': 'input', 'seq': 1, 'dx': 1.0, 'dy': 0.0, 'n': 1},
+        {'type': 'input', 'seq': 2, 'dx': 'far', 'dy': 0.0, 'n': 1},  # fails to parse
+        {'type': 'batch', 'msgs': [{'type': 'input', 'seq': 3, 'dx': 9.0, 'dy': 0.0, 'n': 9}]},
+        7,
+        {'type': 'input', 'seq': 4, 'dx': 0.0, 'dy': 1.0, 'n': 1},
+    ]})
+    server.apply_inputs()
+    assert (room.players[1]['x'], room.players[1]['y']) == (movement.SPEED, movement.SPEED)
+    assert conn.input_seq == 4
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip('fastapi')
+import rooms  # noqa: E402
+import server_ws  # noqa: E402
+
+
+def make_client(room, cid, binary):
+    client = server_ws.Client(None)
+    client.binary = binary
+    client.cid = cid
+    room.clients[cid] = client
+    return client
+
+
+def test_broadcast_skips_recipients_whose_encode_fails():
+    room = rooms.Room('test')
+    text = make_client(room, 1, False)
+    binary = make_client(room, 2, True)
+    # 'id' doesn't fit the binary hp message's int32
+    server_ws.broadcast({'type': 'hp', 'id': 2 ** 40, 'hp': 5}, room)
+    assert len(text.queue) == 1
+    assert len(binary.queue) == 0
+
+
+def test_send_msg_drops_an_unencodable_message():
+    room = rooms.Room('test')
+    client = make_client(room, 1, True)
+    server_ws.send_msg(client, {'type': 'ack', 'seq': 1, 'x': None, 'y': 0.0})
+    assert len(client.queue) == 0
+    server_ws.send_msg(client, {'type': 'ack', 'seq': 1, 'x': 0.0, 'y': 0.0})
+    assert len(client.queue) == 1
@@ -0,0 +1,79 @@
+import snapshot
+
+
+def view(**players):
+    return {int(pid[1:]): dict(fields) for pid, fields in players.items()}
+
+
+def test_public_view_keeps_only_public_fields():
+    players = {1: {'name': 'ana', 'x': 1.26, 'y': 2.0, 'color': (1, 2, 3), 'hp': 90, 'max_hp': 100,
+                   'invuln_until': 5.0}}
+    assert snapshot.public_view(players) == {
+        1: {'name': 'ana', 'x': 1.3, 'y': 2.0, 'color': [1, 2, 3], 'hp': 90, 'max_hp': 100}}
+
+
+def test_delta_tracker_sends_joins_changes_and_leaves():
+    tracker = snapshot.DeltaTracker()
+    msg = tracker.build(view(p1={'x': 0, 'y': 0}, p2={'x': 5, 'y': 5}))
+    assert msg == {'type': 'delta', 'seq': 1, 'join': {1: {'x': 0, 'y': 0}, 2: {'x': 5, 'y': 5}}}
+    # Only fields that changed are sent
+    msg = tracker.build(view(p1={'x': 1, 'y': 0}, p2={'x': 5, 'y': 5}))
+    assert msg == {'type': 'delta', 'seq': 2, 'upd': {1: {'x': 1}}}
+    msg = tracker.build(view(p1={'x': 1, 'y': 0}))
+    assert msg == {'type': 'delta', 'seq': 3, 'leave': [2]}
+    # Rejoining after a leave sends the full entry again
+    msg = tracker.build(view(p1={'x': 1, 'y': 0}, p2={'x': 6, 'y': 5}))
+    assert msg['join'] == {2: {'x': 6, 'y': 5}}
+
+
+def test_delta_tracker_sends_one_empty_delta_then_goes_quiet():
+    tracker = snapshot.DeltaTracker()
+    players = view(p1={'x': 0})
+    assert tracker.build(players)['seq'] == 1
+    assert tracker.build(players) == {'type': 'delta', 'seq': 2}
+    assert tracker.build(players) is None
+    assert tracker.build(players) is None
+    assert tracker.build(view(p1={'x': 1}))['seq'] == 3
+
+
+def test_delta_tracker_excludes_the_receiver():
+    tracker = snapshot.DeltaTracker()
+    msg = tracker.build(view(p1={'x': 0}, p2={'x': 0}), exclude=1)
+    assert msg['join'] == {2: {'x': 0}}
+    assert 1 not in tracker.baseline
+
+
+def test_delta_tracker_baseline_is_not_shared_with_the_view():
+    tracker = snapshot.DeltaTracker()
+    players = view(p1={'x': 0})
+    tracker.build(players)
+    players[1]['x'] = 7
+    assert tracker.build(players)['upd'] == {1: {'x': 7}}
+
+
+def test_snapshot_rate_halves_when_congested_and_recovers():
+    rate = snapshot.SnapshotRate(min_rate=5, max_rate=20, tick_rate=20)
+    assert rate.due(0, congested=False)
+    assert rate.rate == 20
+    tick = rate.next_tick
+    rate.due(tick, congested=True)
+    assert rate.rate == 10
+    assert rate.next_tick == tick + 2  # every other tick at 10/s
+    for _ in range(3):
+        rate.due(rate.next_tick, congested=True)
+    assert rate.rate == 5  # never under min_rate
+    tick = rate.next_tick
+    assert not rate.due(tick - 1, congested=False)
+    for _ in range(200):
+        rate.due(rate.next_tick, congested=False)
+    assert rate.rate == 20
+
+
+def test_snapshot_rate_ceiling_follows_rtt():
+    rate = snapshot.SnapshotRate(min_rate=5, max_rate=20, tick_rate=20, rtt_good=0.1)
+    rate.on_rtt(0.2)
+    assert rate.ceiling() == 10
+    rate.on_rtt(-1)  # ignored
+    assert rate.rtt == 0.2
+    rate.due(0, congested=False)
+    assert rate.rate == 10
@@ -0,0 +1,58 @@
+import spatial
+
+
+def players(**pos):
+    return {int(pid[1:]): {'x': x, 'y': y} for pid, (x, y) in pos.items()}
+
+
+def test_point_grid_tracks_moves_and_removals():
+    grid = spatial.PointGrid(10)
+    grid.move(1, 5, 5)
+    grid.move(2, 25, 5)
+    assert set(grid.query_radius(0, 0, 10)) == {1}
+    grid.move(1, 45, 45)
+    assert set(grid.query_radius(0, 0, 10)) == set()
+    assert set(grid.query_box(0, 0, 50, 50)) == {1, 2}
+    grid.remove(1)
+    grid.remove(1)
+    assert set(grid.query_box(0, 0, 50, 50)) == {2}
+    assert grid.cells == {(2, 0): {2}}
+
+
+def test_interest_enters_at_radius_and_leaves_past_hysteresis():
+    aoi = spatial.InterestManager(radius=100, hysteresis=20)
+    aoi.update(players(p1=(0, 0), p2=(150, 0)))
+    assert aoi.visible_to(1) == {1}
+    aoi.update(players(p1=(0, 0), p2=(100, 0)))
+    assert aoi.visible_to(1) == {1, 2}
+    assert aoi.watchers_of(2) == {1, 2}
+    # Inside radius + hysteresis a seen player stays seen
+    aoi.update(players(p1=(0, 0), p2=(115, 0)))
+    assert aoi.visible_to(1) == {1, 2}
+    aoi.update(players(p1=(0, 0), p2=(125, 0)))
+    assert aoi.visible_to(1) == {1}
+    assert aoi.watchers_of(2) == {2}
+    # ... but an unseen one at the same distance doesn't enter
+    aoi.update(players(p1=(0, 0), p2=(115, 0)))
+    assert aoi.visible_to(1) == {1}
+
+
+def test_interest_forgets_players_that_left():
+    aoi = spatial.InterestManager(radius=100)
+    aoi.update(players(p1=(0, 0), p2=(10, 0), p3=(20, 0)))
+    assert aoi.watchers_of(2) == {1, 2, 3}
+    aoi.update(players(p1=(0, 0), p3=(20, 0)))
+    assert aoi.visible_to(1) == {1, 3}
+    assert aoi.visible_to(2) == (2,)
+    assert 2 not in aoi.watchers_of(1)
+
+
+def test_shot_targets_follow_the_shot_path():
+    aoi = spatial.InterestManager(radius=50)
+    aoi.update(players(p1=(0, 0), p2=(500, 30), p3=(500, 300)))
+    # A shot from p1 along +x passes within 50 of p2 only
+    assert aoi.shot_targets(0, 0, 1000, 0, 0.6) == {1, 2}
+
+
+def test_filter_view_ignores_missing_ids():
+    assert spatial.filter_view({1: 'a', 2: 'b'}, {2, 3}) == {2: 'b'}